@@ -0,0 +1 @@
+from .spectrum import analyze_spectrum, measure_linewidth, measure_peak, measure_smsr
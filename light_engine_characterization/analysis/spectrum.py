@@ -0,0 +1,162 @@
+"""Host-side spectral analysis of OSA traces.
+
+Reproduces the Anritsu MS9740 peak, SMSR and envelope linewidth analyses from a
+downloaded trace so that the analysis does not require a round trip to the OSA.
+
+All functions accept a single trace (shape (n,)) or a stack of traces (shape
+(m, n)). The wavelength grid may either be shared by all traces (shape (n,)) or
+given per trace (shape (m, n)). Results are returned as scalars for a single
+trace and as arrays of length m for a stack.
+"""
+
+import numpy as np
+
+
+def _as_stack(wavelength_nm, power_dbm):
+    """Broadcast the wavelength grid and power traces to 2-D arrays."""
+    power_dbm = np.asarray(power_dbm, dtype=float)
+    single = power_dbm.ndim == 1
+    power_dbm = np.atleast_2d(power_dbm)
+    wavelength_nm = np.broadcast_to(
+        np.asarray(wavelength_nm, dtype=float), power_dbm.shape
+    )
+    return wavelength_nm, power_dbm, single
+
+
+def _unstack(values, single):
+    """Return a scalar for a single trace and an array for a stack."""
+    return values[0].item() if single else values
+
+
+def measure_peak(wavelength_nm, power_dbm):
+    """Measure the wavelength and power of the highest point of the trace.
+
+    Equivalent to the OSA peak search followed by a trace marker read.
+
+    Returns (peak_wavelength_nm, peak_power_dbm).
+    """
+    wavelength_nm, power_dbm, single = _as_stack(wavelength_nm, power_dbm)
+    rows = np.arange(power_dbm.shape[0])
+    i_peak = np.argmax(power_dbm, axis=1)
+    return (
+        _unstack(wavelength_nm[rows, i_peak], single),
+        _unstack(power_dbm[rows, i_peak], single),
+    )
+
+
+def _prominence(power_dbm, i):
+    """Height of the local maximum at i above the higher of its two bases.
+
+    A base is the lowest point between the maximum and the nearest higher point
+    on that side (or the trace edge), as for the OSA peak excursion.
+    """
+    higher = np.flatnonzero(power_dbm > power_dbm[i])
+    left = higher[higher < i]
+    right = higher[higher > i]
+    left_base = power_dbm[(left[-1] + 1 if left.size else 0) : i + 1].min()
+    right_base = power_dbm[i : (right[0] if right.size else power_dbm.size)].min()
+    return power_dbm[i] - max(left_base, right_base)
+
+
+def _side_mode(wavelength_nm, power_dbm, i_peak, peak_excursion_db, min_separation_nm):
+    """Index of the highest side mode of a single trace, or None."""
+    padded = np.pad(power_dbm, 1, constant_values=-np.inf)
+    is_max = (power_dbm > padded[:-2]) & (power_dbm >= padded[2:])
+    far = np.abs(wavelength_nm - wavelength_nm[i_peak]) >= min_separation_nm
+    candidates = np.flatnonzero(is_max & far)
+    for i in candidates[np.argsort(-power_dbm[candidates], kind="stable")]:
+        if _prominence(power_dbm, i) >= peak_excursion_db:
+            return i
+    return None
+
+
+def measure_smsr(
+    wavelength_nm, power_dbm, peak_excursion_db=3.0, min_separation_nm=0.1
+):
+    """Measure the side-mode suppression ratio of the trace.
+
+    Follows the OSA SMSR analysis in "2nd peak" mode: the side mode is the
+    highest local maximum that rises at least peak_excursion_db above the trace
+    between it and any higher point (so that noise ripples on the skirts of the
+    main mode do not count) and lies at least min_separation_nm from the main
+    peak. The SMSR is the difference between the main and side mode powers.
+
+    Returns (smsr_delta_lambda_nm, smsr_db), where the wavelength difference is
+    measured from the main mode to the side mode. Traces without a side mode
+    return NaN for both values.
+    """
+    wavelength_nm, power_dbm, single = _as_stack(wavelength_nm, power_dbm)
+    delta_lambda_nm = np.full(power_dbm.shape[0], np.nan)
+    smsr_db = np.full(power_dbm.shape[0], np.nan)
+    for row, (wavelength, power) in enumerate(zip(wavelength_nm, power_dbm)):
+        i_peak = np.argmax(power)
+        i_side = _side_mode(
+            wavelength, power, i_peak, peak_excursion_db, min_separation_nm
+        )
+        if i_side is not None:
+            smsr_db[row] = power[i_peak] - power[i_side]
+            delta_lambda_nm[row] = wavelength[i_side] - wavelength[i_peak]
+    return _unstack(delta_lambda_nm, single), _unstack(smsr_db, single)
+
+
+def measure_linewidth(wavelength_nm, power_dbm, delta_db):
+    """Measure the linewidth of the spectrum at peak_power_dbm - delta_db.
+
+    Follows the OSA envelope (ENV) analysis with a cut level of delta_db: the
+    linewidth is the distance between the outermost crossings of the cut level,
+    linearly interpolated between sampling points.
+    """
+    wavelength_nm, power_dbm, single = _as_stack(wavelength_nm, power_dbm)
+    n = power_dbm.shape[1]
+    rows = np.arange(power_dbm.shape[0])
+    threshold = power_dbm.max(axis=1) - delta_db
+
+    above = power_dbm >= threshold[:, None]
+    lo = np.argmax(above, axis=1)
+    hi = n - 1 - np.argmax(above[:, ::-1], axis=1)
+
+    def crossing(i_in, i_out):
+        """Interpolate the cut level crossing between an inside/outside pair."""
+        i_out = np.clip(i_out, 0, n - 1)
+        w_in, w_out = wavelength_nm[rows, i_in], wavelength_nm[rows, i_out]
+        p_in, p_out = power_dbm[rows, i_in], power_dbm[rows, i_out]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = (p_in - threshold) / (p_in - p_out)
+        frac = np.where(i_in == i_out, 0.0, frac)
+        return w_in + frac * (w_out - w_in)
+
+    linewidth_nm = crossing(hi, hi + 1) - crossing(lo, lo - 1)
+    return _unstack(linewidth_nm, single)
+
+
+def analyze_spectrum(
+    wavelength_nm, power_dbm, power_threshold_dbm=-30, linewidths_db=(3, 20)
+):
+    """Run the full spectral analysis performed after each OSA sweep.
+
+    SMSR and linewidths are only evaluated for traces whose peak power exceeds
+    power_threshold_dbm and are NaN otherwise, matching the procedures.
+
+    Returns a dictionary with the keys wavelength_peak_nm, power_peak_dbm,
+    smsr_db, smsr_linewidth_nm and linewidth_<N>db_nm for each N in
+    linewidths_db.
+    """
+    peak_wavelength_nm, peak_power_dbm = measure_peak(wavelength_nm, power_dbm)
+    smsr_linewidth_nm, smsr_db = measure_smsr(wavelength_nm, power_dbm)
+    results = {
+        "wavelength_peak_nm": peak_wavelength_nm,
+        "power_peak_dbm": peak_power_dbm,
+        "smsr_db": smsr_db,
+        "smsr_linewidth_nm": smsr_linewidth_nm,
+    }
+    for delta_db in linewidths_db:
+        results[f"linewidth_{delta_db:g}db_nm"] = measure_linewidth(
+            wavelength_nm, power_dbm, delta_db
+        )
+
+    lasing = np.asarray(peak_power_dbm) > power_threshold_dbm
+    for key in results:
+        if key not in ("wavelength_peak_nm", "power_peak_dbm"):
+            value = np.where(lasing, results[key], np.nan)
+            results[key] = value.item() if value.ndim == 0 else value
+    return results
@@ -1,24 +1,52 @@
 """Driver for Agiltron MSWH 1xN Single mode optical switch series.
 
 Control for the optical switch is implemented through the Labjack T7 digital I/O.
+The channel bits and the strobe pulse are written in a single LJM packet, with
+the pulse width timed on the T7 itself (WAIT_US_BLOCKING), so a channel change
+costs one USB round trip plus the MEMS switching time. Completion is detected by
+polling the done line (AIN0) at the command-response rate for its busy -> done
+transition, or after the worst-case switching time if the busy phase was missed.
 """
 
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from labjack import ljm
 from pymeasure.instruments import Instrument
 from pymeasure.instruments.generic_types import SCPIMixin
 from pymeasure.instruments.validators import strict_discrete_set
 
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
 
 class OpticalSwitch:
     """Agiltron MEMS optical switch."""
 
     labjack_device = "T7"
 
+    # Strobe pulse width [us]; the switch latches the channel bits on the pulse.
+    # The switch documentation gives no minimum width, and the original driver
+    # held the strobe for 1 s (time.sleep(1)) without a stated reason. 1 ms
+    # stays far above the latch time of the TTL inputs while being small next
+    # to the MEMS switching time; if the switch does not follow a channel
+    # change, increase it first.
+    strobe_width_us = 1000
+
+    # The done line (AIN0) is high while the switch moves [V]
+    done_threshold = 0.2
+
+    # Worst-case switching time of the MEMS switch [s]. A switch whose busy
+    # phase is shorter than a poll of the done line counts as done once this
+    # time has passed since the strobe.
+    switch_time = 0.05
+
     def __init__(self, *args) -> None:
         super().__init__(*args)
         self.handle = None
+        self.last_switch_s = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="optical_switch")
 
     def open(self) -> None:
         """Open a connection to the Labjack to control the optical switch."""
@@ -26,6 +54,7 @@ class OpticalSwitch:
 
     def close(self) -> None:
         """Close the connection to the Labjack."""
+        self._executor.shutdown(wait=True)
         ljm.close(self.handle)
         self.handle = None
 
@@ -34,20 +63,22 @@ class OpticalSwitch:
         # Set DAC0 high to prevent switch reset
         ljm.eWriteName(self.handle, "DAC0", 3.3)
 
-    def reset(self) -> None:
-        """Reset the labjack and the optical switch."""
+    def reset(self, timeout=5.0) -> None:
+        """Reset the labjack and the optical switch.
+
+        Raises TimeoutError if the switch does not report done within timeout [s].
+        """
         # Reboot the labjack
         # ljm.eWriteAddress(self.handle, 61998, ljm.constants.UINT32, 0x4C4A0000)
         # time.sleep(0.5)
 
         # Pull DAC0 low for >4ms to reset optical switch
         ljm.eWriteName(self.handle, "DAC0", 0.0)
-        time.sleep(0.1)
+        time.sleep(0.01)
         ljm.eWriteName(self.handle, "DAC0", 3.3)
 
         # Wait for the done pin to go to 0V
-        while self.done_voltage > 0.2:
-            time.sleep(0.25)
+        self.wait_done(timeout, poll_interval=0.01)
 
     def get_channel(self) -> int:
         """Get the current switch input channel.
@@ -60,7 +91,7 @@ class OpticalSwitch:
         states = ljm.eReadNames(self.handle, len(names), names)
         return sum([int(j * 2**i) for i, j in enumerate(states)])
 
-    def set_channel(self, channel, check=True) -> None:
+    def set_channel(self, channel, check=True, timeout=1.0) -> None:
         """Select the switch input channel.
 
         The switch channel is selected by setting bits D[0:2] on the switch
@@ -68,20 +99,58 @@ class OpticalSwitch:
 
         channel: int, which input channel to select
         check: bool, check if the operation has completed
-        """
+        timeout: float, time allowed for the switch to complete [s]
 
-        names = [f"DIO{i}" for i in range(3)]
+        Raises TimeoutError if the switch is still busy after timeout.
+        """
+        start = time.perf_counter()
         states = [int(i) for i in reversed(list(f"{channel:03b}"))]
-        ljm.eWriteNames(self.handle, len(names), names, states)
 
-        # Toggle the strobe pin to activate the switch
-        ljm.eWriteName(self.handle, "DIO3", 1)
-        time.sleep(1)
-        ljm.eWriteName(self.handle, "DIO3", 0)
+        # Set the channel bits and pulse the strobe pin in one packet, the
+        # pulse width is timed by the Labjack
+        names = [f"DIO{i}" for i in range(3)]
+        names += ["DIO3", "WAIT_US_BLOCKING", "DIO3"]
+        values = states + [1, self.strobe_width_us, 0]
+        ljm.eWriteNames(self.handle, len(names), names, values)
 
         if check:
-            while self.done_voltage > 0.2:
-                time.sleep(0.1)
+            self.wait_done(timeout)
+        self.last_switch_s = time.perf_counter() - start
+
+    def set_channel_async(self, channel, timeout=1.0):
+        """Select the switch input channel in the background.
+
+        Returns a Future that completes when the switch has moved, so that other
+        instruments can be configured meanwhile.
+        """
+        return self._executor.submit(self.set_channel, channel, True, timeout)
+
+    def wait_done(self, timeout=1.0, poll_interval=0.0005):
+        """Wait for the done line to report that the switch has completed.
+
+        Right after a strobe the done line may not have gone high yet, so a low
+        reading only counts as done after the line has been seen high (the busy
+        -> done transition), or once the worst-case switch_time has passed.
+
+        Raises TimeoutError if the switch is still busy after timeout [s].
+        """
+        start = time.perf_counter()
+        seen_busy = False
+        while True:
+            busy = self.done_voltage > self.done_threshold
+            elapsed = time.perf_counter() - start
+            if busy:
+                seen_busy = True
+            elif seen_busy:
+                return
+            elif elapsed >= self.switch_time:
+                log.debug(
+                    f"Optical switch busy phase not seen, done after {elapsed:.3f}s"
+                )
+                return
+            if elapsed > timeout:
+                raise TimeoutError(f"Optical switch not done after {timeout}s")
+            time.sleep(poll_interval)
 
     @property
     def done_voltage(self):
@@ -99,6 +168,7 @@ if __name__ == "__main__":
     for i in range(8):
         print(f"Switching channel to {i}")
         switch.set_channel(i)
+        print(f"Switched in {switch.last_switch_s * 1000:.1f}ms")
 
         print()
         print("Reading current channel")
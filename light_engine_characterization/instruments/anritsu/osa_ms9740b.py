@@ -2,6 +2,8 @@ from pymeasure.instruments.anritsu import AnritsuMS9740A
 import time
 import logging
 
+import numpy as np
+
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
@@ -9,13 +11,122 @@ log.addHandler(logging.NullHandler())
 class AnritsuMS9740B(AnritsuMS9740A):
     """Anritsu MS9740B Optical Spectrum Analyzer."""
 
+    # Wire format of the binary memory output (DBA?/DBB?) and the dtype of the
+    # buffer the trace is decoded into
+    binary_trace_dtype = np.dtype("<f4")
+    trace_dtype = np.float64
+    # Largest deviation of the first binary trace of a session from the ASCII
+    # trace (DMA?/DMB?, printed with two decimals) it is checked against [dB]
+    binary_check_tolerance = 0.01
+
+    # Sweep completion settings, timeout [s] and number of sweep retries
+    sweep_timeout = 30
+    sweep_retries = 3
+    # Fixed per-sweep overhead used in the sweep time estimate [s]
+    sweep_overhead = 0.2
+
     def __init__(
-        self, adapter, name="Anritsu MS9740B Optical Spectrum Analyzer", **kwargs
+        self,
+        adapter,
+        name="Anritsu MS9740B Optical Spectrum Analyzer",
+        binary_transfer=True,
+        use_srq=True,
+        **kwargs,
     ):
-        """Constructor."""
+        """Constructor.
+
+        binary_transfer: bool, fetch traces with the binary memory query and fall
+            back to ASCII if the instrument does not support it
+        use_srq: bool, wait for sweep completion with a service request on GPIB
+            connections; pyvisa only offers wait_for_srq on GPIB sessions, so
+            over TCPIP (the usual connection of the OSA) the ESR2 is polled
+        """
         self.analysis_mode = None
+        self.binary_transfer = binary_transfer
+        self._binary_checked = False
+        self.expected_sweep_time = self.sweep_overhead
+        self.sweep_latencies = []
+        self.sweep_timeouts = 0
         super().__init__(adapter, name, **kwargs)
 
+        connection = getattr(self.adapter, "connection", None)
+        self.use_srq = use_srq and hasattr(connection, "wait_for_srq")
+        self._srq_enabled = False
+        self._srq_armed = False
+
+    def read_memory(self, slot="A", out=None):
+        """Read the scan saved in a memory slot.
+
+        If binary transfer is enabled, the trace is read as a block of
+        binary_trace_dtype values directly into a NumPy buffer. The first binary
+        trace of a session is compared with the ASCII trace of the same slot. If
+        the instrument rejects the binary query, returns a malformed block or a
+        trace that differs from the ASCII one, binary transfer is disabled for
+        this session and the trace is read over ASCII instead.
+
+        slot: str, memory slot to read ("A" or "B")
+        out: np.ndarray, optional preallocated buffer for the power trace, reused
+            if it matches the number of sampling points
+        """
+        scan = getattr(self, f"data_memory_{slot.lower()}_condition")
+        n_points = int(scan[2])
+        wavelengths = np.linspace(scan[0], scan[1], n_points)
+
+        if out is None or out.shape != (n_points,):
+            out = np.empty(n_points, dtype=self.trace_dtype)
+
+        if self.binary_transfer:
+            try:
+                self._read_binary_trace(slot, out)
+                return wavelengths, out
+            except Exception as e:
+                log.warning(
+                    f"Binary trace transfer failed ({e}), falling back to ASCII"
+                )
+                self.binary_transfer = False
+                self.clear()
+
+        _, power = super().read_memory(slot)
+        out[:] = power
+        return wavelengths, out
+
+    def _read_binary_trace(self, slot, out):
+        """Read the binary memory block for the given slot into out.
+
+        The block is read with or without an IEEE 488.2 definite length header
+        ("#<digits><length>"), and checked against the ASCII trace on first use.
+        """
+        n_bytes = out.size * self.binary_trace_dtype.itemsize
+        connection = getattr(self.adapter, "connection", None)
+        termination = getattr(connection, "read_termination", None) or ""
+
+        self.write(f"DB{slot.upper()}?")
+        start = self.read_bytes(1)
+        if start == b"#":
+            n_digits = int(self.read_bytes(1))
+            length = int(self.read_bytes(n_digits)) if n_digits else n_bytes
+            if length != n_bytes:
+                raise ValueError(f"expected {n_bytes} bytes, header announces {length}")
+            block = self.read_bytes(n_bytes + len(termination))
+        else:
+            block = start + self.read_bytes(n_bytes - 1 + len(termination))
+        if len(block) < n_bytes:
+            raise ValueError(f"expected {n_bytes} bytes, received {len(block)}")
+
+        trace = np.frombuffer(block, dtype=self.binary_trace_dtype, count=out.size)
+        # A wrong wire format decodes to garbage rather than failing outright, so
+        # reject anything outside of the physical range of the OSA
+        if not np.all(np.isfinite(trace)) or np.any(np.abs(trace) > 200):
+            raise ValueError("binary trace contains out of range values")
+        if not self._binary_checked:
+            _, power = super().read_memory(slot)
+            deviation = np.max(np.abs(trace - np.asarray(power, dtype=float)))
+            if deviation > self.binary_check_tolerance:
+                raise ValueError(f"binary trace differs from ASCII by {deviation:g}dB")
+            self._binary_checked = True
+            log.info("Binary trace matches the ASCII trace, using binary transfer")
+        np.copyto(out, trace, casting="unsafe")
+
     def measure_smsr(self):
         """Measure the side-mode suppression ratio of the OSA sweep."""
         self.analysis_mode = "SMSR"
@@ -32,27 +143,151 @@ class AnritsuMS9740B(AnritsuMS9740A):
         linewidth = result[1]
         return linewidth
 
-    def wait_for_sweep(self, n=20, delay=0.5):
+    def configure_sweep(
+        self, wavelength_start, wavelength_stop, sampling_points, resolution, vbw
+    ):
+        """Configure the sweep parameters and update the expected sweep time.
+
+        wavelength_start: float, sweep start wavelength [nm]
+        wavelength_stop: float, sweep stop wavelength [nm]
+        sampling_points: int, number of sampling points
+        resolution: float, resolution bandwidth [nm]
+        vbw: str, video bandwidth (e.g. "1kHz")
+        """
+        self.wavelength_start = wavelength_start
+        self.wavelength_stop = wavelength_stop
+        self.sampling_points = sampling_points
+        self.resolution = resolution
+        self.resolution_vbw = vbw
+
+        self.expected_sweep_time = self.estimate_sweep_time(
+            wavelength_stop - wavelength_start, sampling_points, resolution, vbw
+        )
+        log.debug(f"Expected sweep time: {self.expected_sweep_time:.2f}s")
+
+    @classmethod
+    def estimate_sweep_time(cls, span_nm, sampling_points, resolution, vbw):
+        """Estimate the duration of a single sweep [s].
+
+        Each sampling point is integrated for roughly 1/VBW, and the monochromator
+        cannot scan faster than max_scan_rate (reduced further at the high
+        resolution settings). The estimate only has to be approximate, since
+        wait_for_sweep refines it from the measured sweep times.
+        """
+        vbw = vbw.lower().replace("mhz", "e6").replace("khz", "e3")
+        vbw_hz = float(vbw.replace("hz", ""))
+        max_scan_rate = 1000 if resolution > 0.05 else 500  # [nm/s]
+        sampling_time = sampling_points / vbw_hz
+        scan_time = span_nm / max_scan_rate
+        return cls.sweep_overhead + max(sampling_time, scan_time)
+
+    @property
+    def sweep_statistics(self):
+        """Latency statistics of the sweeps performed since the last reset [s]."""
+        latencies = np.array(self.sweep_latencies)
+        stats = {
+            "n_sweeps": latencies.size,
+            "n_timeouts": self.sweep_timeouts,
+            "total_s": float(latencies.sum()),
+        }
+        if latencies.size:
+            stats.update(
+                mean_s=float(latencies.mean()),
+                std_s=float(latencies.std()),
+                min_s=float(latencies.min()),
+                max_s=float(latencies.max()),
+            )
+        return stats
+
+    def reset_sweep_statistics(self):
+        """Clear the recorded sweep latencies."""
+        self.sweep_latencies = []
+        self.sweep_timeouts = 0
+
+    def wait_for_sweep(self, timeout=None, min_delay=0.01, max_delay=0.5):
         """Wait for a sweep to stop.
 
-        This is performed by checking bit 1 of the ESR2.
+        The ESR2 is polled with an interval that shrinks as the elapsed time
+        approaches the expected sweep time and backs off again towards max_delay
+        once the sweep is overdue. On GPIB connections with use_srq, the wait
+        first blocks on a service request of the operation complete bit, and the
+        polling only confirms bit 1 of the ESR2.
+
+        timeout: float, time to wait for the sweep [s], defaults to sweep_timeout
+        min_delay: float, shortest polling interval [s]
+        max_delay: float, longest polling interval [s]
+
+        Raises RuntimeWarning if the sweep does not complete within the timeout.
         """
         log.debug("Waiting for spectrum sweep")
+        if timeout is None:
+            timeout = self.sweep_timeout
+        t_start = time.perf_counter()
+        expected = self.expected_sweep_time
+
+        if self._srq_armed:
+            self._srq_armed = False
+            try:
+                self.adapter.connection.wait_for_srq(int(timeout * 1000))
+                self.ask("*ESR?")
+            except Exception as e:
+                # A timeout is handled below, anything else means the
+                # connection cannot deliver service requests
+                if time.perf_counter() - t_start < timeout:
+                    log.warning(f"Service request wait failed ({e}), polling ESR2")
+                    self.use_srq = False
 
-        while self.esr2 != 3 and n > 0:
-            log.debug(f"Wait for sweep [{n}]")
-            # log.debug("ESR2: {}".format(esr2))
+        while True:
+            elapsed = time.perf_counter() - t_start
+            if self.esr2 == 3:
+                break
+            if elapsed > timeout:
+                self.sweep_timeouts += 1
+                raise RuntimeWarning(f"Sweep Timeout Occurred ({timeout:.1f} s)")
+            # Half the time to (or past) the expected end of the sweep
+            delay = np.clip(abs(expected - elapsed) / 2, min_delay, max_delay)
+            log.debug(f"Wait for sweep [{elapsed:.2f}/{expected:.2f}s]")
             time.sleep(delay)
-            n -= 1
 
-        if n <= 0:
-            raise RuntimeWarning(f"Sweep Timeout Occurred ({int(delay * n)} s)")
+        # Track the typical sweep time so the polling converges on it
+        elapsed = time.perf_counter() - t_start
+        self.sweep_latencies.append(elapsed)
+        self.expected_sweep_time = 0.8 * expected + 0.2 * elapsed
+
+    def single_sweep(self, retries=None, **kwargs):
+        """Perform a single sweep and wait for completion.
+
+        The sweep is re-triggered after a timeout, up to the given number of
+        retries (defaults to sweep_retries).
+
+        Raises RuntimeError if none of the attempts complete.
+        """
+        if retries is None:
+            retries = self.sweep_retries
+        for attempt in range(retries + 1):
+            log.debug("Performing a Spectrum Sweep")
+            self.clear()
+            if self.use_srq:
+                if not self._srq_enabled:
+                    # Raise a service request on the operation complete bit
+                    self.write("*ESE 1;*SRE 32")
+                    self._srq_enabled = True
+                self.write("SSI;*OPC")
+                self._srq_armed = True
+            else:
+                self.write("SSI")
+            try:
+                self.wait_for_sweep(**kwargs)
+                return
+            except RuntimeWarning as e:
+                log.warning(f"{e}, re-running sweep [{attempt + 1}/{retries}]")
+        raise RuntimeError(f"OSA sweep failed after {retries + 1} attempts")
 
-    def single_sweep(self, **kwargs):
-        """Perform a single sweep and wait for completion."""
-        log.debug("Performing a Spectrum Sweep")
+    def repeat_sweep(self, **kwargs):
+        """Start a repeat sweep and wait for the first sweep to complete."""
+        log.debug("Performing a repeat Spectrum Sweep")
         self.clear()
-        self.write("SSI")
+        self.write("SRT")
         self.wait_for_sweep(**kwargs)
 
 
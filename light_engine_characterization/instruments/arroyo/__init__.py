@@ -1,2 +1,2 @@
 from .tec_source_5240 import TECSource5240
-from .ldd_source_7144 import LDDSource7144
+from .ldd_source_7144 import LDDSource7144, LIVSweepError
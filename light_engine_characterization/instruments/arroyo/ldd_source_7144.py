@@ -1,18 +1,55 @@
+import logging
+import re
+from time import perf_counter, sleep
+
+import numpy as np
 from pymeasure.instruments import Instrument
 from pymeasure.instruments.generic_types import SCPIMixin
 from pymeasure.instruments.validators import strict_discrete_set
-from time import sleep
+from pyvisa.errors import VisaIOError
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def _liv_columns(steps):
+    """Dictionary of the columns of a list of L-I-V step tuples."""
+    columns = np.array(steps, dtype=float).reshape(-1, 5).T
+    names = ("bias_current_ma", "current_ma", "voltage_v", "pd_current_ua")
+    return dict(zip(names + ("time_s",), columns))
+
+
+class LIVSweepError(RuntimeError):
+    """A step of an L-I-V sweep could not be confirmed.
+
+    liv: dictionary of arrays of the steps completed before the failed one, as
+        returned by LDDSource7144.liv_sweep()
+    """
+
+    def __init__(self, message, liv):
+        super().__init__(message)
+        self.liv = liv
 
 
 class LDDSource7144(SCPIMixin, Instrument):
     """Control the Arroyo 4 Channel 7144 LDD controller."""
 
+    # Time the current may take to settle within tolerance after a set point
+    # and the interval between read-backs [s]
+    settle_timeout = 1.0
+    poll_interval = 0.01
+    # The confirmed current must be within the larger of the LAS:TOL tolerance
+    # of the instrument [mA] and this fraction of the set current, roughly the
+    # set point accuracy of the 7144 current ranges
+    tolerance_fraction = 0.002
+
     def __init__(self, adapter, name="LDD Source 7144", **kwargs):
         kwargs.setdefault("baud_rate", 38400)
         kwargs.setdefault("read_termination", "\n")
         kwargs.setdefault("write_termination", "\n")
         kwargs.setdefault("timeout", 10000)
         super().__init__(adapter, name, **kwargs)
+        self._tolerance_ma = None
 
     ########### Instrument Parameters ################################################
     output_enabled = Instrument.control(
@@ -40,42 +77,163 @@ class LDDSource7144(SCPIMixin, Instrument):
 
     tolerance = Instrument.control("LAS:TOL?", "LAS:TOL %f, 2", """Laser current tolerance criteria.""")
 
-    def set_current(self, current):
-        self.current = current
-        sleep(0.1)
+    def set_current(self, current, tolerance=None, timeout=None):
+        """Set the laser current and confirm it by reading it back.
+
+        The set point is sent on one line with the current and voltage queries,
+        so a settled bias step is a single round trip instead of *OPC? polling
+        with fixed sleeps. While the reply cannot be parsed or the current is
+        outside the tolerance, the current and voltage are polled until they
+        settle or the timeout expires.
+
+        tolerance: float, allowed deviation of the measured current [mA],
+            defaults to confirm_tolerance(current)
+        timeout: float, settle time [s], defaults to settle_timeout
+
+        Returns the measured current [mA] and voltage [V].
+        Raises RuntimeError with the last replies if the current did not settle
+        within the timeout.
+        """
+        return self._set(current, "LAS:LDI?;LAS:LDV?", tolerance, timeout)
+
+    def measure_current_voltage(self, timeout=None):
+        """Read the laser current [mA] and voltage [V] in one exchange.
+
+        Raises RuntimeError with the last replies if none could be parsed within
+        timeout [s], default settle_timeout.
+        """
+        query = "LAS:LDI?;LAS:LDV?"
+        return self._exchange(query, query, lambda values: True, timeout, "read")
+
+    def confirm_tolerance(self, current):
+        """Allowed deviation of the measured from the set current [mA].
+
+        The larger of the LAS:TOL tolerance, read from the instrument once per
+        session, and tolerance_fraction of the set current, so that the
+        confirmation scales with the current range.
+        """
+        if self._tolerance_ma is None:
+            try:
+                self._tolerance_ma = float(re.split("[,;]", self.ask("LAS:TOL?"))[0])
+            except (ValueError, VisaIOError) as e:
+                log.warning(f"Could not read the LDD tolerance, using 0.1mA: {e}")
+                self._flush()
+                self._tolerance_ma = 0.1
+        return max(self._tolerance_ma, self.tolerance_fraction * abs(current))
+
+    def liv_sweep(self, currents, tolerance=None, timeout=None, should_stop=None):
+        """Step the laser current through a list of set points for an L-I-V curve.
+
+        The 7144 has no current list or ramp mode, so the steps are scripted
+        from the host: every step is one exchange of the set point with the
+        current, voltage and monitor photodiode queries, confirmed as in
+        set_current(). The curve is taken at the serial round-trip rate.
+
+        should_stop: callable that ends the sweep early when it returns True
+
+        Returns a dictionary of arrays of the completed steps: the set points
+        ("bias_current_ma"), the measured "current_ma", "voltage_v" and monitor
+        photodiode current "pd_current_ua", and the "time_s" since the start.
+        Raises LIVSweepError with the steps completed so far if a step is not
+        confirmed.
+        """
+        steps = []
+        start = perf_counter()
+        for current in currents:
+            if should_stop is not None and should_stop():
+                break
+            queries = "LAS:LDI?;LAS:LDV?;LAS:MDI?"
+            try:
+                values = self._set(current, queries, tolerance, timeout)
+            except RuntimeError as e:
+                raise LIVSweepError(
+                    f"{e} (LIV step {len(steps) + 1})", _liv_columns(steps)
+                ) from e
+            steps.append((current, *values, perf_counter() - start))
+        return _liv_columns(steps)
+
+    def wait_completed(self, timeout=10.0, poll_interval=0.05):
+        """Wait for pending operations to complete.
+
+        Raises TimeoutError if *OPC? does not report completion within timeout [s].
+        """
+        start = perf_counter()
         while not self.completed:
-            sleep(0.1)
-
-        self.current
-        sleep(0.1)
-        # if abs(self.current - current) > 0.1:
-        #     raise ValueError("LDD current did not settle within tolerance time")
+            if perf_counter() - start > timeout:
+                raise TimeoutError(f"LDD operation not complete after {timeout}s")
+            sleep(poll_interval)
+
+    def _set(self, current, queries, tolerance, timeout):
+        """Set the current and poll the queries until the first one confirms it."""
+        if tolerance is None:
+            tolerance = self.confirm_tolerance(current)
+        return self._exchange(
+            f"LAS:LDI {current:g};{queries}",
+            queries,
+            lambda values: abs(values[0] - current) <= tolerance,
+            timeout,
+            f"set {current:g}mA",
+        )
+
+    def _exchange(self, command, poll, accept, timeout, action):
+        """Send a command, then the poll queries until accept(values) holds.
+
+        The command is sent again until one of its replies parses, so a lost
+        set point is repeated; afterwards only the queries are polled.
+
+        Returns the reply values of the queries.
+        """
+        if timeout is None:
+            timeout = self.settle_timeout
+        replies = []
+        sent = False
+        start = perf_counter()
+        while True:
+            query = poll if sent else command
+            try:
+                reply = self.ask(query)
+                values = tuple(float(v) for v in re.split("[,;]", reply))
+                if len(values) != query.count("?"):
+                    raise ValueError(f"unexpected reply {reply.strip()!r}")
+            except (ValueError, VisaIOError) as e:
+                replies.append(repr(e))
+                self._flush()
+            else:
+                sent = True
+                replies.append(reply.strip())
+                if accept(values):
+                    return values
+                log.debug(f"LDD {action}: {reply.strip()}")
+            if perf_counter() - start > timeout:
+                raise RuntimeError(
+                    f"LDD could not {action} within {timeout}s "
+                    f"({len(replies)} replies), last replies: {replies[-5:]}"
+                )
+            sleep(self.poll_interval)
+
+    def _flush(self):
+        """Discard a partial reply left in the input buffer."""
+        try:
+            self.adapter.flush_read_buffer()
+        except Exception as e:
+            log.debug(f"Could not flush LDD read buffer: {e}")
 
 
 if __name__ == "__main__":
-    from time import sleep
-
     ldd = LDDSource7144('ASRL5::INSTR')
     ldd.tolerance = 0.1
     print(ldd.tolerance)
     ldd.current = 99
     ldd.output_enabled = True
-    while not ldd.completed:
-        sleep(0.1)
+    ldd.wait_completed()
 
     for i in range(100, 110, 1):
-        print(i)
-        ldd.current = i
-
-        sleep(0.1)
-        while not ldd.completed:
-            sleep(0.1)
-        
-        sleep(0.1)
-        current = ldd.current
-        if not current:
-            current = ldd.current
-        print(current)
-        
+        t_start = perf_counter()
+        current, voltage = ldd.set_current(i)
+        print(i, current, voltage, f"{(perf_counter() - t_start) * 1000:.1f}ms")
+
+    t_start = perf_counter()
+    liv = ldd.liv_sweep(np.arange(0, 501, 1))
+    print(f"LIV of {liv['current_ma'].size} steps in {perf_counter() - t_start:.1f}s")
 
     ldd.output_enabled = False
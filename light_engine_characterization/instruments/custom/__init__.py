@@ -1 +1 @@
-from .zeus import ZeusController
+from .zeus import ZeusController, snapshot_dtype
@@ -1,25 +1,178 @@
+import json
 import time
-import traceback
 import logging
+import numpy as np
 import paramiko
 from paramiko import SSHClient
 from paramiko_expect import SSHClientInteraction
 
+from .zeus_agent import BOARD_LOCK, INIT_MARKER, VOLTAGE_ADCS
+from .zeus_rpc import ZeusRPC, stop_agent, token_directory
+
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# Marks the result lines of a batch in the REPL output
+BATCH_MARKER = "@@batch@@"
+
+# REPL statement that evaluates a list of commands and prints one JSON line with
+# the value, printed output and error of each command
+BATCH_STATEMENT = """\
+import io as _io, json as _json, contextlib as _contextlib
+for _command in {commands!r}:
+    _output = _io.StringIO()
+    try:
+        with _contextlib.redirect_stdout(_output):
+            _value = eval(_command)
+        _error = None
+    except Exception as _exception:
+        _value, _error = None, repr(_exception)
+    print({marker!r} + _json.dumps(
+        {{"value": _value, "output": _output.getvalue(), "error": _error}},
+        default=repr,
+    ))
+"""
+
+
+# Telemetry of all channels of the board at one point in time
+snapshot_dtype = np.dtype(
+    [
+        ("timestamp_s", np.float64),
+        ("ambient_temp_c", np.float64),
+        ("light_engine_temp_c", np.float64),
+        ("mpd_current_ma", np.float64, (8,)),
+        ("voltage_v", np.float64, (8,)),
+    ]
+)
+
+
+def _parse_temperatures(output):
+    """Parse the ambient and light engine temperatures of temperature.print_all()."""
+    fields = output.split(" ")
+    return float(fields[1].split("°C")[0]), float(fields[4].split("°C")[0])
+
+
+def _parse_reading(output, unit):
+    """Parse the value of an adc.<channel>.print() reading."""
+    return float(output.split(" ")[1].split(unit)[0])
+
 
 class ZeusController:
     """Class for interfacing with the Zeus controller board over SSH.
 
+    With use_agent, open_session also starts the RPC agent (zeus_agent.py) on the
+    board, and the telemetry and laser current methods go through the agent
+    instead of the REPL.
+
+    connect() is the fast alternative to open_session: it only talks to a
+    persistent agent on the board, started with a single exec command on the
+    first connection and reused afterwards, and has no REPL session. The agent
+    keeps running as root after close(); stop_agent() stops it. open_session
+    fails while the agent holds the board.
+
     TODO: Convert this class to use the pymeasure Instrument base class.
     """
 
     client: SSHClient
 
-    def __init__(self):
-        pass
+    # ADC channels of the cathode voltage of each light engine channel
+    voltage_adcs = VOLTAGE_ADCS
+
+    username = "xilinx"
+    password = "xilinx"
+
+    def __init__(self, use_agent=True):
+        self.use_agent = use_agent
+        self.rpc = None
+        self.interact = None
+        self.hostname = None
+        self.connect_times = []
+
+    @classmethod
+    def fake(cls):
+        """Controller connected to a local agent that simulates the board."""
+        zeus = cls()
+        zeus.rpc = ZeusRPC.fake()
+        return zeus
+
+    def connect(self, hostname="pynq1", initialize=False):
+        """Connect to the persistent RPC agent of the board.
+
+        The SSH connection is reused if it is still alive, and a running agent
+        keeps the board initialized, so a reconnect only opens a new channel.
+        initialize restarts the agent and runs power.init again, which resets
+        the board (see ZeusRPC.connect).
+        Raises ConnectionError if the agent cannot be reached or started.
+        """
+        start = time.perf_counter()
+        self.hostname = hostname
+        if self.rpc is not None:
+            self.rpc.close()
+            self.rpc = None
+
+        transport = self.client.get_transport() if hasattr(self, "client") else None
+        try:
+            if transport is None or not transport.is_active():
+                self.client = paramiko.SSHClient()
+                self.client.load_system_host_keys()
+                self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                self.client.connect(
+                    hostname=hostname,
+                    username=self.username,
+                    password=self.password,
+                    timeout=5,
+                )
+            token_path = token_directory / f"{hostname}.token"
+            self.rpc, reused = ZeusRPC.connect(
+                self.client, self.password, token_path, initialize=initialize
+            )
+        except Exception as e:
+            raise ConnectionError(f"could not connect to Zeus board {hostname}: {e}")
+
+        elapsed = time.perf_counter() - start
+        self.connect_times.append(elapsed)
+        log.info(
+            f"Connected to Zeus board {hostname} in {elapsed:.3f}s "
+            f"({'reused' if reused else 'started'} agent)"
+        )
+
+    def stop_agent(self):
+        """Stop the persistent agent of the board started by connect()."""
+        if self.rpc is not None:
+            self.rpc.close()
+            self.rpc = None
+        return stop_agent(self.client, self.password)
+
+    def reconnect(self):
+        """Reconnect to the board after the connection was lost."""
+        self.connect(self.hostname)
+
+    @property
+    def connection_statistics(self):
+        """Number, mean, standard deviation and range of the connection times [s]."""
+        times = self.connect_times
+        if not times:
+            return {"n_connections": 0}
+        mean = sum(times) / len(times)
+        return {
+            "n_connections": len(times),
+            "mean_s": mean,
+            "std_s": (sum((t - mean) ** 2 for t in times) / len(times)) ** 0.5,
+            "min_s": min(times),
+            "max_s": max(times),
+        }
+
+    def _call(self, method, **params):
+        """Call an agent method, reconnecting once if the connection was lost."""
+        try:
+            return self.rpc.call(method, **params)
+        except (ConnectionError, TimeoutError) as e:
+            if self.hostname is None:
+                raise
+            log.warning(f"Lost connection to the Zeus agent ({e}), reconnecting.")
+            self.reconnect()
+            return self.rpc.call(method, **params)
 
     def open_session(self, HOSTNAME_PYNQ="pynq not set"):  # example 'pynq4'
         HOSTNAME = HOSTNAME_PYNQ  # example 'pynq4'
@@ -28,6 +181,8 @@ class ZeusController:
         sudo_prompt = ".*\#\s+"
         PROMPT = ".*\$\s+"
 
+        start = time.perf_counter()
+
         # Use SSH client to login
         try:
             # Create a new SSH client object
@@ -69,64 +224,192 @@ class ZeusController:
             interact.send(r"import time")
             interact.expect(PYTHON_PROMPT)
 
+            # Hold the board lock of the agents (see zeus_agent.py) while the
+            # REPL session is open
+            interact.send(
+                "import fcntl; _board_lock = open('%s', 'w'); "
+                "fcntl.flock(_board_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)" % BOARD_LOCK
+            )
+            interact.expect(PYTHON_PROMPT)
+            if "BlockingIOError" in interact.current_output_clean:
+                raise ConnectionError(
+                    "the board is in use by the Zeus agent, stop it with stop_agent()"
+                )
             interact.send("from artemis3 import *")
             interact.expect(PYTHON_PROMPT)
             interact.send("power.bypass_asic_check(True)")
             interact.expect(PYTHON_PROMPT)
             interact.send("power.init(TargetRate.Gbps56_0)")
             interact.expect(PYTHON_PROMPT)
+            interact.send("open('%s', 'w').close()" % INIT_MARKER)
+            interact.expect(PYTHON_PROMPT)
 
             if False:
                 print(interact.current_output_clean)
 
-        except Exception:
-            traceback.print_exc()
-        self.interact = interact
+        except Exception as e:
+            log.exception("Failed to open Zeus session.")
+            raise ConnectionError(f"could not open Zeus session on {HOSTNAME}: {e}")
+
+        if self.use_agent:
+            try:
+                self.rpc = ZeusRPC.over_ssh(client, PASSWORD)
+                log.debug("Started Zeus RPC agent.")
+            except Exception as e:
+                log.warning(f"Could not start Zeus RPC agent, using the REPL: {e}")
+                self.rpc = None
+
+        self.connect_times.append(time.perf_counter() - start)
+
+    def _check_repl(self):
+        if self.interact is None:
+            raise ConnectionError("no REPL session (connected with connect())")
 
     def write_only(self, command="pwd"):
+        self._check_repl()
         PYTHON_PROMPT = r"(>>> )"
         self.interact.send(rf"{command}")
         self.interact.expect(PYTHON_PROMPT)
 
     def write_read(self, command="pwd"):
+        self._check_repl()
         PYTHON_PROMPT = r"(>>> )"
         self.interact.send(rf"{command}")
         answer = self.interact.expect(PYTHON_PROMPT)
         return answer
 
+    def execute_batch(self, commands):
+        """Evaluate several Python expressions on the board in one round trip.
+
+        The commands are sent as a single REPL statement which prints one JSON
+        line per command. Returns a list with a dictionary per command, with the
+        returned value (repr() if it is not JSON serializable), the printed
+        output and the error (None if the command succeeded).
+        Raises ConnectionError if there is no REPL session (see connect()).
+        """
+        self._check_repl()
+        PYTHON_PROMPT = r"(>>> )"
+        commands = list(commands)
+        statement = BATCH_STATEMENT.format(commands=commands, marker=BATCH_MARKER)
+        self.interact.send(f"exec({statement!r})")
+        if self.interact.expect(PYTHON_PROMPT) == -1:
+            raise RuntimeError("timed out waiting for the Zeus board")
+
+        results = [
+            json.loads(line[len(BATCH_MARKER) :])
+            for line in self.interact.current_output_clean.splitlines()
+            if line.startswith(BATCH_MARKER)
+        ]
+        if len(results) != len(commands):
+            raise RuntimeError(
+                f"expected {len(commands)} batch results, received {len(results)}"
+            )
+        return results
+
+    def _batch_outputs(self, commands):
+        """Execute a batch and return the printed output of each command."""
+        results = self.execute_batch(commands)
+        for command, result in zip(commands, results):
+            if result["error"] is not None:
+                raise RuntimeError(f"{command} failed: {result['error']}")
+        return [result["output"] for result in results]
+
+    def set_laser_currents(self, currents):
+        """Set the laser current of several channels in one round trip.
+
+        currents: dictionary of channel -> current [mA]
+        """
+        if self.rpc is not None:
+            self._call("set_laser_currents", currents=currents)
+            return
+        self._batch_outputs(
+            [
+                f"light_engine.set_laser_ma(LEChannel.LE{channel},{current})"
+                for channel, current in currents.items()
+            ]
+        )
+
+    def read_telemetry(self, channels=range(8)):
+        """Read the temperatures and the MPD currents and voltages of channels.
+
+        All readings are taken in a single round trip. Returns a dictionary with
+        ambient_temp_c, light_engine_temp_c, and mpd_current_ma and voltage_v
+        lists in the order of channels.
+        """
+        channels = list(channels)
+        if self.rpc is not None:
+            return self._call("read_telemetry", channels=channels)
+
+        commands = (
+            ["temperature.print_all()"]
+            + [f"adc.LE_MPD_IMON_{channel}.print()" for channel in channels]
+            + [f"adc.{self.voltage_adcs[channel]}.print()" for channel in channels]
+        )
+        outputs = self._batch_outputs(commands)
+        try:
+            ambient_temp_c, light_engine_temp_c = _parse_temperatures(outputs[0])
+            n = len(channels)
+            mpd_current_ma = [_parse_reading(o, "°C") for o in outputs[1 : n + 1]]
+            voltage_v = [_parse_reading(o, "V") for o in outputs[n + 1 :]]
+        except (IndexError, ValueError) as e:
+            raise RuntimeError(f"could not parse Zeus telemetry: {e}")
+        return {
+            "ambient_temp_c": ambient_temp_c,
+            "light_engine_temp_c": light_engine_temp_c,
+            "mpd_current_ma": mpd_current_ma,
+            "voltage_v": voltage_v,
+        }
+
+    def snapshot(self):
+        """Read the temperatures and the MPD currents and voltages of all 8 channels.
+
+        The readings are taken in a single round trip. Returns a record of
+        snapshot_dtype; timestamp_s is the time.monotonic() time halfway through
+        the read. Snapshots can be collected into an array with
+        np.array(snapshots, dtype=snapshot_dtype).
+        """
+        start = time.monotonic()
+        telemetry = self.read_telemetry(range(8))
+        stop = time.monotonic()
+
+        snapshot = np.zeros(1, dtype=snapshot_dtype)[0]
+        snapshot["timestamp_s"] = (start + stop) / 2
+        for name in snapshot_dtype.names[1:]:
+            snapshot[name] = telemetry[name]
+        return snapshot
+
+    def set_fan_duty_cycle(self, duty_cycle):
+        """Set the duty cycle of the light engine fan [%]."""
+        if self.rpc is not None:
+            self._call("set_fan_duty_cycle", duty_cycle=duty_cycle)
+        else:
+            self.write_read(f"fan.set_le_duty_cycle({duty_cycle})")
+
     def get_light_engine_temperatures(self):
+        if self.rpc is not None:
+            temperatures = self._call("read_temperatures")
+            return temperatures["ambient_temp_c"], temperatures["light_engine_temp_c"]
         self.write_read("temperature.print_all()")
-        readframe = self.interact.current_output_clean
-        Ambient_C = float(readframe.split(" ")[1].split("°C")[0])
-        LE_C = float(readframe.split(" ")[4].split("°C")[0])
-        return Ambient_C, LE_C
+        return _parse_temperatures(self.interact.current_output_clean)
 
     def get_mpd_readout(self, Channel):
+        if self.rpc is not None:
+            return self._call("read_mpd", channel=Channel)
         query_string = "adc.LE_MPD_IMON_" + str(Channel) + ".print()"
         self.write_read(query_string)
-        answer = self.interact.current_output_clean
-        mpd_mA = float(answer.split(" ")[1].split("°C")[0])
-        return mpd_mA
+        return _parse_reading(self.interact.current_output_clean, "°C")
 
     def get_voltage_readout(self, channel):
-        adc_lut = [
-            "A_LDO_NCCMN",
-            "A_LDO_ECCMN",
-            "A_LDO_SCCMN",
-            "A_LDO_WCCMN",
-            "NE_PIC_APROBE_1",
-            "NE_PIC_APROBE_2",
-            "SW_PIC_APROBE_1",
-            "SW_PIC_APROBE_2",
-        ]
+        if self.rpc is not None:
+            return self._call("read_voltage", channel=channel)
         count = 0
         while count < 3:
             try:
-                query = f"adc.{adc_lut[channel]}.print()"
+                query = f"adc.{self.voltage_adcs[channel]}.print()"
                 self.write_read(query)
                 answer = self.interact.current_output_clean
                 print(answer)
-                voltage_v = float(answer.split(" ")[1].split("V")[0])
+                voltage_v = _parse_reading(answer, "V")
                 return voltage_v
             except IndexError as e:
                 time.sleep(1)
@@ -138,6 +421,11 @@ class ZeusController:
         raise RuntimeError("could not read voltage from Zeus board")
 
     def close(self):
+        if self.rpc is not None:
+            self.rpc.close()
+            self.rpc = None
+        if not hasattr(self, "client"):
+            return
         try:
             self.client.close()  # we dont want to close
         except Exception:
@@ -0,0 +1,290 @@
+"""RPC agent that runs on the Zeus board.
+
+The agent reads JSON-lines requests from stdin and writes one JSON-lines response
+per request to stdout:
+
+    request:  {"id": 1, "method": "read_mpd", "params": {"channel": 0}}
+    response: {"id": 1, "result": 0.512, "error": null}
+
+It only depends on the standard library and artemis3, so its source can be sent
+over an SSH channel and started with the board's Python (see ZeusRPC). The
+artemis3 readings are parsed on the board and returned as floats. With --fake
+the agent simulates a board without artemis3, for testing the client locally.
+
+With --listen PORT the agent initializes the board itself (unless INIT_MARKER
+shows that it was initialized since its last boot and --init is not given),
+prints a ready line, detaches from the launching channel and serves connections
+on 127.0.0.1:PORT, so that later sessions can reuse the initialized process. The
+launching client sends a token on the line after the source; every connection
+has to start with a {"token": ...} line holding it and is closed otherwise. The
+listening agent holds the board lock (BOARD_LOCK, also taken by the REPL of
+ZeusController.open_session) and writes its pid to PID_FILE. It runs until it is
+stopped with SIGTERM, e.g. by zeus_rpc.stop_agent().
+"""
+
+import contextlib
+import hmac
+import io
+import json
+import os
+import random
+import re
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+FLOAT = r"[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?"
+
+# Exclusive lock of the board, so that a listening agent and a REPL session do
+# not drive it at the same time, and pid file of the agent listening on a port
+BOARD_LOCK = "/run/lock/zeus_board.lock"
+PID_FILE = "/run/zeus_agent_{port}.pid"
+
+# Created once the board is initialized; /run is cleared when the board reboots
+INIT_MARKER = "/run/zeus_board.initialized"
+
+# Time a new connection has to send its token [s]
+TOKEN_TIMEOUT = 5.0
+
+# ADC channels of the cathode voltage of each light engine channel
+VOLTAGE_ADCS = [
+    "A_LDO_NCCMN",
+    "A_LDO_ECCMN",
+    "A_LDO_SCCMN",
+    "A_LDO_WCCMN",
+    "NE_PIC_APROBE_1",
+    "NE_PIC_APROBE_2",
+    "SW_PIC_APROBE_1",
+    "SW_PIC_APROBE_2",
+]
+
+
+def _printed(function, *args):
+    """Call a function and return what it printed."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        function(*args)
+    return output.getvalue()
+
+
+def _first_float(text):
+    match = re.search(FLOAT, text.split(" ", 1)[-1])
+    if match is None:
+        raise ValueError(f"no value in {text!r}")
+    return float(match.group())
+
+
+class ArtemisBoard:
+    """Agent methods implemented with artemis3.
+
+    initialize: bool, initialize the board (power.init); otherwise the board has
+        to be initialized by the REPL session already
+    """
+
+    def __init__(self, initialize=False):
+        import artemis3
+
+        self.artemis3 = artemis3
+        if initialize:
+            artemis3.power.bypass_asic_check(True)
+            artemis3.power.init(artemis3.TargetRate.Gbps56_0)
+
+    def ping(self):
+        return True
+
+    def set_laser_ma(self, channel, current_ma):
+        light_engine = self.artemis3.light_engine
+        le_channel = getattr(self.artemis3.LEChannel, f"LE{channel}")
+        light_engine.set_laser_ma(le_channel, current_ma)
+
+    def set_laser_currents(self, currents):
+        for channel, current_ma in currents.items():
+            self.set_laser_ma(int(channel), current_ma)
+
+    def set_fan_duty_cycle(self, duty_cycle):
+        self.artemis3.fan.set_le_duty_cycle(duty_cycle)
+
+    def read_temperatures(self):
+        text = _printed(self.artemis3.temperature.print_all)
+        values = [float(v) for v in re.findall(rf"({FLOAT})\s*°C", text)]
+        if len(values) < 2:
+            raise ValueError(f"could not parse temperatures from {text!r}")
+        return {"ambient_temp_c": values[0], "light_engine_temp_c": values[1]}
+
+    def read_adc(self, name):
+        return _first_float(_printed(getattr(self.artemis3.adc, name).print))
+
+    def read_mpd(self, channel):
+        return self.read_adc(f"LE_MPD_IMON_{channel}")
+
+    def read_voltage(self, channel):
+        return self.read_adc(VOLTAGE_ADCS[channel])
+
+    def read_telemetry(self, channels):
+        return {
+            **self.read_temperatures(),
+            "mpd_current_ma": [self.read_mpd(channel) for channel in channels],
+            "voltage_v": [self.read_voltage(channel) for channel in channels],
+        }
+
+
+class FakeBoard(ArtemisBoard):
+    """Simulated board with the same methods, for testing without hardware."""
+
+    def __init__(self, initialize=False):
+        self.currents = [0.0] * 8
+        self.duty_cycle = 0
+
+    def set_laser_ma(self, channel, current_ma):
+        self.currents[channel] = float(current_ma)
+
+    def set_fan_duty_cycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def read_temperatures(self):
+        heating = 0.01 * sum(self.currents)
+        return {
+            "ambient_temp_c": 25.0 + random.gauss(0, 0.05),
+            "light_engine_temp_c": 30.0 + heating + random.gauss(0, 0.05),
+        }
+
+    def read_mpd(self, channel):
+        return 0.005 * max(self.currents[channel] - 20, 0) + random.gauss(0, 1e-4)
+
+    def read_voltage(self, channel):
+        return 1.0 + 0.002 * self.currents[channel] + random.gauss(0, 1e-3)
+
+
+def serve(board, stdin=sys.stdin, stdout=sys.stdout, lock=None):
+    """Answer requests from stdin until it is closed.
+
+    lock: lock held while a board method runs, if several connections are served
+    """
+    for line in iter(stdin.readline, ""):
+        try:
+            request = json.loads(line)
+            request_id = request["id"]
+        except (ValueError, KeyError, TypeError):
+            # e.g. the sudo password line if sudo did not ask for it
+            continue
+
+        start = time.perf_counter()
+        try:
+            method = getattr(board, request["method"])
+            with lock or contextlib.nullcontext():
+                result, error = method(**request.get("params", {})), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        response = {
+            "id": request_id,
+            "result": result,
+            "error": error,
+            "elapsed_s": time.perf_counter() - start,
+        }
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+def lock_board(path=BOARD_LOCK):
+    """Take the exclusive board lock; raises BlockingIOError if it is held."""
+    import fcntl
+
+    lock = open(path, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise
+    return lock
+
+
+def listen(
+    board_class,
+    port,
+    token,
+    initialize=False,
+    lock_path=BOARD_LOCK,
+    pid_file=PID_FILE,
+    init_marker=INIT_MARKER,
+):
+    """Initialize the board and serve connections on a local TCP port.
+
+    The port is bound and the board lock taken before the board is initialized,
+    so that a second agent, or an agent started next to a REPL session, exits
+    without touching the board. The board is only initialized if init_marker
+    does not exist yet, or if initialize is set. Connections that do not send
+    the token first are closed. Runs until the process receives SIGTERM.
+    """
+    pid_path = pid_file.format(port=port)
+    try:
+        server = socket.create_server(("127.0.0.1", port))
+        try:
+            board_lock = lock_board(lock_path)
+        except BlockingIOError:
+            raise RuntimeError("the board is in use by another session")
+        board = board_class(initialize=initialize or not os.path.exists(init_marker))
+        open(init_marker, "w").close()
+        with open(pid_path, "w") as f:
+            f.write(str(os.getpid()))
+    except Exception as e:
+        print(json.dumps({"ready": False, "error": str(e)}), flush=True)
+        return
+    print(json.dumps({"ready": True, "pid": os.getpid()}), flush=True)
+
+    def stop(signum, frame):
+        with contextlib.suppress(OSError):
+            os.unlink(pid_path)
+        board_lock.close()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    # Detach from the channel that launched the agent
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+    lock = threading.Lock()
+
+    def handle(connection):
+        with connection:
+            try:
+                reader = connection.makefile("r")
+                connection.settimeout(TOKEN_TIMEOUT)
+                hello = json.loads(reader.readline())
+                if not hmac.compare_digest(str(hello["token"]), token):
+                    return
+                connection.settimeout(None)
+                serve(board, reader, connection.makefile("w"), lock)
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+    while True:
+        connection, _ = server.accept()
+        threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    board_class = FakeBoard if "--fake" in sys.argv else ArtemisBoard
+    if "--listen" in sys.argv:
+        port = int(sys.argv[sys.argv.index("--listen") + 1])
+        token = json.loads(sys.stdin.readline())["token"]
+        initialize = "--init" in sys.argv
+        if board_class is FakeBoard:
+            directory = tempfile.gettempdir()
+            listen(
+                board_class,
+                port,
+                token,
+                initialize,
+                lock_path=os.path.join(directory, "zeus_board.lock"),
+                pid_file=os.path.join(directory, "zeus_agent_{port}.pid"),
+                init_marker=os.path.join(directory, "zeus_board.initialized"),
+            )
+        else:
+            listen(board_class, port, token, initialize)
+    else:
+        serve(board_class())
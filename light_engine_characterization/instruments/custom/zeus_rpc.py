@@ -0,0 +1,306 @@
+"""Client of the Zeus board RPC agent (see zeus_agent.py).
+
+A listening agent only serves connections that present the token generated by
+launch_agent(). The token is kept in a file only readable by the user, under
+token_directory, so that later sessions on this host can reuse the agent.
+A running agent is never replaced implicitly: it holds the initialized board a
+procedure may still depend on, so it is only stopped (stop_agent()) if asked.
+"""
+
+import itertools
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from .zeus_agent import PID_FILE
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+agent_source = Path(__file__).with_name("zeus_agent.py")
+
+# Reads the agent source as the first JSON string line of stdin (skipping the
+# sudo password if sudo did not ask for it), so that no quoting of the source is
+# needed on the remote command line
+bootstrap = (
+    "import sys, json; exec(next(json.loads(line) for line in "
+    "iter(sys.stdin.readline, str()) if line.startswith(chr(34))))"
+)
+
+default_python = "/usr/local/share/pynq-venv/bin/python3"
+default_port = 50007
+token_directory = Path("~/.zeus_agent").expanduser()
+
+
+class ZeusRPCError(RuntimeError):
+    """Error returned by the agent for a request."""
+
+
+class ZeusRPC:
+    """JSON-lines RPC client of the Zeus agent.
+
+    writer: binary file-like object connected to the agent's stdin
+    reader: binary file-like object connected to the agent's stdout
+    timeout: float, default timeout of a call [s]
+    """
+
+    def __init__(self, writer, reader, timeout=5.0, close=None):
+        self.writer = writer
+        self.reader = reader
+        self.timeout = timeout
+        self._close = close
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._responses = {}
+        self._received = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._read, name="zeus_rpc_reader", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def over_ssh(cls, client, password, python=default_python):
+        """Start the agent on the board through a new channel of an SSH client.
+
+        The agent runs as long as the channel is open.
+        """
+        stdin, stdout, _ = client.exec_command(
+            f"sudo -S -p '' {python} -u -c '{bootstrap}'"
+        )
+        stdin.write(password + "\n")
+        stdin.write(json.dumps(agent_source.read_text()) + "\n")
+        stdin.flush()
+        rpc = cls(stdin, stdout, close=stdin.channel.close)
+        rpc.call("ping", timeout=30)
+        return rpc
+
+    @classmethod
+    def over_tcp(cls, transport, token, port=default_port, timeout=5.0):
+        """Connect to a listening agent through an SSH port forwarding channel."""
+        channel = transport.open_channel(
+            "direct-tcpip", ("127.0.0.1", port), ("127.0.0.1", 0), timeout=timeout
+        )
+        writer = channel.makefile("wb")
+        writer.write((json.dumps({"token": token}) + "\n").encode())
+        writer.flush()
+        return cls(writer, channel.makefile("rb"), timeout, channel.close)
+
+    @classmethod
+    def connect(
+        cls,
+        client,
+        password,
+        token_path,
+        port=default_port,
+        python=default_python,
+        timeout=120,
+        initialize=False,
+        attempts=3,
+        backoff=0.5,
+    ):
+        """Connect to the listening agent of the board, launching it if needed.
+
+        A running agent keeps the board initialized between sessions, so only
+        the first connection after a board reboot pays for power.init. The
+        connection with the token in token_path is tried attempts times, waiting
+        backoff, 2 * backoff, ... [s] in between, so that a short network drop
+        does not lose the agent. A new agent is only launched if none is running
+        (raises ConnectionError otherwise); it does not initialize a board that
+        was initialized since its last boot. initialize stops a running agent
+        and initializes the board again. The token of a new agent is saved to
+        token_path.
+        Returns the client and whether an existing agent was reused.
+        """
+        transport = client.get_transport()
+        token_path = Path(token_path)
+        if token_path.exists() and not initialize:
+            token = token_path.read_text().strip()
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+                rpc = None
+                try:
+                    rpc = cls.over_tcp(transport, token, port)
+                    rpc.call("ping", timeout=2)
+                    return rpc, True
+                except Exception as e:
+                    if rpc is not None:
+                        rpc.close()
+                    log.warning(
+                        f"Zeus agent on port {port} not reachable "
+                        f"(attempt {attempt + 1}/{attempts}): {e}"
+                    )
+
+        if initialize:
+            stop_agent(client, password, port)
+        elif agent_running(client, port):
+            raise ConnectionError(
+                f"the Zeus agent on port {port} is running but does not accept "
+                "this session; stop it with stop_agent() or connect with "
+                "initialize=True"
+            )
+        token = launch_agent(client, password, port, python, timeout, initialize)
+        token_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w") as f:
+            f.write(token)
+        rpc = cls.over_tcp(transport, token, port)
+        rpc.call("ping", timeout=2)
+        return rpc, False
+
+    @classmethod
+    def fake(cls):
+        """Start a local agent that simulates the board."""
+        process = subprocess.Popen(
+            [sys.executable, "-u", str(agent_source), "--fake"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+        def close():
+            process.stdin.close()
+            process.wait()
+
+        return cls(process.stdin, process.stdout, close=close)
+
+    def call(self, method, timeout=None, **params):
+        """Call an agent method and return its result.
+
+        Raises ZeusRPCError if the method failed on the board and TimeoutError
+        if there is no response within timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        request_id = next(self._ids)
+        request = {"id": request_id, "method": method, "params": params}
+        with self._received:
+            self._pending.add(request_id)
+        try:
+            with self._lock:
+                self.writer.write((json.dumps(request) + "\n").encode())
+                self.writer.flush()
+        except (OSError, ValueError) as e:
+            raise ConnectionError(f"could not send {method} to the Zeus agent: {e}")
+
+        with self._received:
+            received = self._received.wait_for(
+                lambda: request_id in self._responses or not self._thread.is_alive(),
+                timeout,
+            )
+            self._pending.discard(request_id)
+            response = self._responses.pop(request_id, None)
+            if not received:
+                raise TimeoutError(f"no response to {method} within {timeout}s")
+        if response is None:
+            raise ConnectionError("the Zeus agent has stopped")
+        if response["error"] is not None:
+            raise ZeusRPCError(f"{method} failed: {response['error']}")
+        return response["result"]
+
+    def close(self):
+        """Stop the agent."""
+        if self._close is not None:
+            self._close()
+
+    def _read(self):
+        """Collect the responses of the agent."""
+        while True:
+            line = self.reader.readline()
+            if not line:
+                break
+            try:
+                response = json.loads(line)
+                request_id = response["id"]
+            except (ValueError, KeyError, TypeError):
+                log.debug(f"Unexpected output of the Zeus agent: {line!r}")
+                continue
+            with self._received:
+                # Responses of calls that have timed out are dropped
+                if request_id in self._pending:
+                    self._responses[request_id] = response
+                    self._received.notify_all()
+        with self._received:
+            self._received.notify_all()
+
+
+def launch_agent(
+    client,
+    password,
+    port=default_port,
+    python=default_python,
+    timeout=120,
+    initialize=False,
+):
+    """Start a listening agent on the board with a single exec command.
+
+    The token is passed on stdin, so that it does not show up in the process
+    list of the board. Blocks until the agent has initialized the board (only
+    after a board reboot, or always with initialize) and reports that it is
+    ready; raises ConnectionError if it fails.
+    Returns the token connections to the agent have to present.
+    """
+    token = secrets.token_hex(16)
+    init = " --init" if initialize else ""
+    stdin, stdout, _ = client.exec_command(
+        f"sudo -S -p '' setsid {python} -u -c '{bootstrap}' --listen {port}{init}",
+        timeout=timeout,
+    )
+    stdin.write(password + "\n")
+    stdin.write(json.dumps(agent_source.read_text()) + "\n")
+    stdin.write(json.dumps({"token": token}) + "\n")
+    stdin.flush()
+    try:
+        for line in stdout:
+            try:
+                status = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(status, dict) and "ready" in status:
+                break
+        else:
+            raise ConnectionError("the Zeus agent exited before it was ready")
+    except OSError as e:
+        raise ConnectionError(f"the Zeus agent did not start: {e}")
+    finally:
+        stdin.channel.close()
+    if not status["ready"]:
+        raise ConnectionError(f"the Zeus agent did not start: {status['error']}")
+    log.info(f"Started Zeus agent (pid {status['pid']}) on port {port}.")
+    return token
+
+
+def agent_running(client, port=default_port, timeout=10):
+    """Whether the pid file of the port names a live listening agent."""
+    pid_file = PID_FILE.format(port=port)
+    _, stdout, _ = client.exec_command(
+        f"sh -c 'test -f {pid_file} && pid=$(cat {pid_file}) && "
+        f"grep -qa -- --listen /proc/$pid/cmdline && echo running'",
+        timeout=timeout,
+    )
+    return "running" in stdout.read().decode(errors="replace")
+
+
+def stop_agent(client, password, port=default_port, timeout=10):
+    """Stop the listening agent of the board, releasing the board lock.
+
+    Returns True if an agent was running.
+    """
+    pid_file = PID_FILE.format(port=port)
+    stdin, stdout, _ = client.exec_command(
+        f"sudo -S -p '' sh -c 'test -f {pid_file} && pid=$(cat {pid_file}) && "
+        f"grep -qa -- --listen /proc/$pid/cmdline && kill $pid && while kill -0 $pid 2>/dev/null; do sleep 0.05; done && "
+        f"echo stopped'",
+        timeout=timeout,
+    )
+    stdin.write(password + "\n")
+    stdin.flush()
+    stopped = "stopped" in stdout.read().decode(errors="replace")
+    if stopped:
+        log.info(f"Stopped Zeus agent on port {port}.")
+    return stopped
@@ -0,0 +1,149 @@
+"""Discovery of the VISA instruments of the test station.
+
+All VISA resources are probed concurrently with a short timeout, so that dead
+serial ports do not add up. The identity -> resource map is cached on disk, and
+later calls only validate the cached resources, falling back to a full scan if
+an instrument has moved or is missing.
+
+The discovery can be run against a pyvisa-sim description of the station, e.g.
+detect_instruments(visa_library="station.yaml@sim", cache_path=None).
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyvisa as visa
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+cache_file = Path("~/measurement_data/light_engine/instruments.json").expanduser()
+
+# Instrument name and the lower-case *IDN? substrings that identify it. The
+# first matching entry wins, so more specific entries come first.
+identities = [
+    ("anritsu", ("anritsu",)),
+    ("arroyo_ldd", ("arroyo", "7144")),
+    ("arroyo_tec", ("arroyo", "5240")),
+    ("arroyo", ("arroyo",)),
+    ("keithley", ("keithley",)),
+]
+
+
+def identify(idn):
+    """Get the instrument name of an *IDN? response, or None if it is unknown."""
+    idn = idn.lower()
+    for name, keys in identities:
+        if all(key in idn for key in keys):
+            return name
+    return None
+
+
+def probe(rm, resource, timeout=500):
+    """Query the identification of a VISA resource.
+
+    timeout: int, VISA timeout of the query [ms]
+
+    Returns the *IDN? response, or None if the resource does not respond.
+    """
+    try:
+        res = rm.open_resource(resource, open_timeout=timeout)
+    except Exception as e:
+        log.debug(f"Could not open {resource}: {e}")
+        return None
+    try:
+        res.timeout = timeout
+        res.write_termination = "\n"
+        res.read_termination = "\n"
+        if resource.startswith("ASRL"):
+            res.baud_rate = 38400
+        return res.query("*IDN?").strip()
+    except Exception as e:
+        log.debug(f"No response from {resource}: {e}")
+        return None
+    finally:
+        res.close()
+
+
+def _probe_all(rm, resources, timeout, max_workers):
+    """Probe resources concurrently, returning {resource: idn} of the responding ones."""
+    if not resources:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        idns = pool.map(lambda resource: probe(rm, resource, timeout), resources)
+        return {
+            resource: idn for resource, idn in zip(resources, idns) if idn is not None
+        }
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache_path, instruments):
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(instruments, f, indent=2)
+    except OSError as e:
+        log.warning(f"Could not write the instrument cache {cache_path}: {e}")
+
+
+def detect_instruments(
+    required=(),
+    cache_path=cache_file,
+    refresh=False,
+    timeout=500,
+    max_workers=16,
+    visa_library="",
+):
+    """Detect the connected instruments.
+
+    required: names of the instruments that must be found
+    cache_path: path of the identity -> resource cache, or None to not cache
+    refresh: bool, ignore the cached resources and scan all resources
+    timeout: int, per-resource timeout [ms]
+    max_workers: int, number of resources probed at the same time
+    visa_library: VISA library passed to the ResourceManager (e.g. "@sim")
+
+    Returns a dictionary of instrument name -> resource name. Raises a
+    RuntimeError if a required instrument is not found.
+    """
+    rm = visa.ResourceManager(visa_library)
+    cache_path = Path(cache_path) if cache_path is not None else None
+    cached = {} if refresh or cache_path is None else _load_cache(cache_path)
+
+    # Validate the cached resources first
+    idns = _probe_all(rm, list(cached.values()), timeout, max_workers)
+    instruments = {
+        name: resource
+        for name, resource in cached.items()
+        if identify(idns.get(resource, "")) == name
+    }
+
+    if not instruments or not set(required) <= set(instruments):
+        log.info("Scanning VISA resources for instruments.")
+        resources = [
+            resource
+            for resource in rm.list_resources()
+            if resource not in instruments.values()
+        ]
+        for resource, idn in _probe_all(rm, resources, timeout, max_workers).items():
+            name = identify(idn)
+            if name is not None:
+                instruments.setdefault(name, resource)
+
+    if cache_path is not None and instruments != cached:
+        _save_cache(cache_path, instruments)
+
+    missing = set(required) - set(instruments)
+    if missing:
+        raise RuntimeError(f"Instruments not found: {', '.join(sorted(missing))}")
+    log.debug(f"Detected instruments: {instruments}")
+    return instruments
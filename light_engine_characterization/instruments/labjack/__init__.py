@@ -0,0 +1 @@
+from .t7 import LabJackStream
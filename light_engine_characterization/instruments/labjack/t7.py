@@ -1,184 +1,258 @@
-import sys
+"""Hardware-timed streaming acquisition of LabJack T7 inputs.
+
+LabJackStream runs an LJM stream and a background thread that moves every
+eStreamRead block into a preallocated NumPy ring buffer, so signals such as the
+MPD or a photodiode can be monitored at kHz rates without per-sample Python
+calls. Skipped samples (reported by LJM as -9999 after the device buffer
+overflowed) are counted and stored as NaN, and the device and LJM backlogs of
+the last read are kept for monitoring. The stream can start on an edge of a
+DIO line (e.g. DIO0); the process-wide LJM library settings this needs are
+restored when the stream stops.
+
+Every scan gets a time.monotonic() timestamp, so the data captured during an
+operation can be pulled afterwards:
+
+    stream = LabJackStream(handle, ["AIN0"], scan_rate=1000)
+    stream.start()
+    start = time.monotonic()
+    osa.single_sweep()
+    times, data = stream.slice(start, time.monotonic())
+"""
+
+import logging
+import threading
 import time
-from datetime import datetime
 
+import numpy as np
 from labjack import ljm
 
-# import ljm_stream_util
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
 
+# Value of skipped samples in the stream data
+skipped_value = -9999.0
 
-MAX_REQUESTS = 1  # The number of eStreamRead calls that will be performed.
 
-# Open first found LabJack
-handle = ljm.openS("T7", "ANY", "ANY")  # Any device, Any connection, Any identifier
-# handle = ljm.openS("T8", "ANY", "ANY")  # T8 device, Any connection, Any identifier
-# handle = ljm.openS("T7", "ANY", "ANY")  # T7 device, Any connection, Any identifier
-# handle = ljm.open(ljm.constants.dtANY, ljm.constants.ctANY, "ANY")  # Any device, Any connection, Any identifier
+class LabJackStream:
+    """Stream of LabJack inputs into a ring buffer.
 
-info = ljm.getHandleInfo(handle)
-print(
-    "Opened a LabJack with Device type: %i, Connection type: %i,\n"
-    "Serial number: %i, IP address: %s, Port: %i,\nMax bytes per MB: %i"
-    % (info[0], info[1], info[2], ljm.numberToIP(info[3]), info[4], info[5])
-)
-
-deviceType = info[0]
-
-if deviceType == ljm.constants.dtT4:
-    print("\nThe LabJack T4 does not support triggered stream.")
-    sys.exit()
-
-# Stream Configuration
-aScanListNames = ["AIN0"]  # Scan list names to stream
-numAddresses = len(aScanListNames)
-aScanList = ljm.namesToAddresses(numAddresses, aScanListNames)[0]
-scanRate = 4  # This is Hertz. Was 1000
-scansPerRead = int(scanRate / 2)
-
-TRIGGER_NAME = "DIO0"
-# TRIGGER_NAME = "AIN0"
-
-
-def configureDeviceForTriggeredStream(handle, triggerName):
-    """Configure the device to wait for a trigger before beginning stream.
-
-    @para handle: The device handle
-    @type handle: int
-    @para triggerName: The name of the channel that will trigger stream to start
-    @type triggerName: str
+    handle: LJM handle of an opened T7
+    names: list of input names to stream, e.g. ["AIN0", "AIN1"]
+    scan_rate: float, requested scan rate [Hz]; the actual rate is set by start()
+    capacity_s: float, duration of the data kept in the ring buffer [s]
+    reads_per_second: int, number of eStreamRead blocks per second
+    trigger: name of the DIO line whose edge starts the stream, or None
+    ain_range: float, range of the streamed analog inputs [V]
     """
-    address = ljm.nameToAddress(triggerName)[0]
-    ljm.eWriteName(handle, "STREAM_TRIGGER_INDEX", address)
-
-    # Clear any previous settings on triggerName's Extended Feature registers
-    ljm.eWriteName(handle, "%s_EF_ENABLE" % triggerName, 0)
-
-    # 5 enables a rising or falling edge to trigger stream
-    ljm.eWriteName(handle, "%s_EF_INDEX" % triggerName, 5)
-
-    # Enable
-    ljm.eWriteName(handle, "%s_EF_ENABLE" % triggerName, 1)
-
-
-def configureLJMForTriggeredStream():
-    ljm.writeLibraryConfigS(
-        ljm.constants.STREAM_SCANS_RETURN, ljm.constants.STREAM_SCANS_RETURN_ALL_OR_NONE
-    )
-    ljm.writeLibraryConfigS(ljm.constants.STREAM_RECEIVE_TIMEOUT_MS, 0)
-    # By default, LJM will time out with an error while waiting for the stream
-    # trigger to occur.
-
-
-try:
-    # When streaming, negative channels and ranges can be configured for
-    # individual analog inputs, but the stream has only one settling time and
-    # resolution.
-
-    # Ensure triggered stream is disabled.
-    ljm.eWriteName(handle, "STREAM_TRIGGER_INDEX", 0)
-
-    # Enabling internally-clocked stream.
-    ljm.eWriteName(handle, "STREAM_CLOCK_SOURCE", 0)
-
-    # AIN0 and AIN1 ranges are +/-10 V and stream resolution index is
-    # 0 (default).
-    aNames = ["AIN0_RANGE", "AIN1_RANGE", "STREAM_RESOLUTION_INDEX"]
-    aValues = [10.0, 10.0, 0]
-
-    # Negative channel and settling configurations do not apply to the T8
-    if deviceType == ljm.constants.dtT7:
-        #     Negative Channel = 199 (Single-ended)
-        #     Settling = 0 (auto)
-        aNames.extend(["AIN0_NEGATIVE_CH", "STREAM_SETTLING_US", "AIN1_NEGATIVE_CH"])
-        aValues.extend([199, 0, 199])
-
-    # Write the analog inputs' negative channels, ranges, stream settling time
-    # and stream resolution configuration.
-    numFrames = len(aNames)
-    ljm.eWriteNames(handle, numFrames, aNames, aValues)
-
-    if "TRIGGERED" == "NO":
-        configureDeviceForTriggeredStream(handle, TRIGGER_NAME)
-        configureLJMForTriggeredStream()
-
-    # Configure and start stream
-    scanRate = ljm.eStreamStart(handle, scansPerRead, numAddresses, aScanList, scanRate)
-    print("\nStream started with a scan rate of %0.0f Hz." % scanRate)
-
-    print("\nPerforming %i stream reads." % MAX_REQUESTS)
-    start = datetime.now()
-    totScans = 0
-    totSkip = 0  # Total skipped samples
-
-    i = 1
-    ljmScanBacklog = 0
-    while i <= MAX_REQUESTS:
-        # ljm_stream_util.variableStreamSleep(scansPerRead, scanRate, ljmScanBacklog)
-        time.sleep(0.01)
 
+    def __init__(
+        self,
+        handle,
+        names,
+        scan_rate=1000.0,
+        capacity_s=60.0,
+        reads_per_second=50,
+        trigger=None,
+        ain_range=10.0,
+    ):
+        self.handle = handle
+        self.names = list(names)
+        self.scan_rate = float(scan_rate)
+        self.scans_per_read = max(1, int(scan_rate / reads_per_second))
+        self.trigger = trigger
+        self.ain_range = ain_range
+
+        capacity = int(capacity_s * scan_rate)
+        self._data = np.full((capacity, len(self.names)), np.nan)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.n_scans = 0
+        self.n_skipped = 0
+        self.device_backlog = 0
+        self.ljm_backlog = 0
+        self.error = None
+        self._t0 = None
+        # LJM library settings changed by the stream and their previous values
+        self._library_config = {}
+
+    def start(self):
+        """Configure and start the stream and the reader thread."""
+        self._configure()
+        addresses = ljm.namesToAddresses(len(self.names), self.names)[0]
+        try:
+            self.scan_rate = ljm.eStreamStart(
+                self.handle,
+                self.scans_per_read,
+                len(addresses),
+                addresses,
+                self.scan_rate,
+            )
+        except ljm.LJMError:
+            self._restore_library_config()
+            raise
+        log.info(f"Stream of {self.names} started at {self.scan_rate:.0f}Hz")
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="labjack_stream", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread and the stream."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
         try:
-            print("read now")
-            ret = ljm.eStreamRead(handle)
-            print("read now")
-            print(ret)
-
-            aData = ret[0]
-            ljmScanBacklog = ret[2]
-            scans = len(aData) / numAddresses
-            totScans += scans
-
-            # Count the skipped samples which are indicated by -9999 values. Missed
-            # samples occur after a device's stream buffer overflows and are
-            # reported after auto-recover mode ends.
-            curSkip = aData.count(-9999.0)
-            totSkip += curSkip
-
-            print("\neStreamRead %i" % i)
-            ainStr = ""
-            for j in range(0, numAddresses):
-                ainStr += "%s = %0.5f, " % (aScanListNames[j], aData[j])
-            print("  1st scan out of %i: %s" % (scans, ainStr))
-            print(
-                "  Scans Skipped = %0.0f, Scan Backlogs: Device = %i, LJM = "
-                "%i" % (curSkip / numAddresses, ret[1], ljmScanBacklog)
+            ljm.eStreamStop(self.handle)
+        except ljm.LJMError as e:
+            log.debug(f"Could not stop stream: {e}")
+        self._restore_library_config()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def statistics(self):
+        """Scan counts and backlogs of the stream."""
+        return {
+            "scan_rate": self.scan_rate,
+            "n_scans": self.n_scans,
+            "n_skipped": self.n_skipped,
+            "device_backlog": self.device_backlog,
+            "ljm_backlog": self.ljm_backlog,
+        }
+
+    def slice(self, start, stop=None):
+        """Get the buffered scans taken between two time.monotonic() times.
+
+        Returns the scan timestamps [s] and a (scans, inputs) array of the data.
+        Scans that are no longer in the ring buffer are not returned.
+        """
+        stop = time.monotonic() if stop is None else stop
+        with self._lock:
+            if self._t0 is None:
+                return np.empty(0), np.empty((0, len(self.names)))
+            capacity = self._data.shape[0]
+            first = max(self.n_scans - capacity, 0)
+            i_start = max(int(np.ceil((start - self._t0) * self.scan_rate)), first)
+            i_stop = int(np.floor((stop - self._t0) * self.scan_rate)) + 1
+            i_stop = min(i_stop, self.n_scans)
+            indices = np.arange(i_start, max(i_stop, i_start))
+            data = self._data[indices % capacity]
+            t0 = self._t0
+        return t0 + indices / self.scan_rate, data
+
+    def latest(self, duration):
+        """Get the scans of the last duration seconds, see slice()."""
+        now = time.monotonic()
+        return self.slice(now - duration, now)
+
+    def _configure(self):
+        """Write the analog input and stream settings to the device."""
+        # Internally clocked, default resolution, automatic settling
+        names = [
+            "STREAM_TRIGGER_INDEX",
+            "STREAM_CLOCK_SOURCE",
+            "STREAM_RESOLUTION_INDEX",
+            "STREAM_SETTLING_US",
+        ]
+        values = [0, 0, 0, 0]
+        # Single-ended inputs
+        for name in self.names:
+            if name.startswith("AIN"):
+                names += [f"{name}_RANGE", f"{name}_NEGATIVE_CH"]
+                values += [self.ain_range, 199]
+        ljm.eWriteNames(self.handle, len(names), names, values)
+
+        if self.trigger is not None:
+            # Start the stream on a rising or falling edge of the trigger line
+            address = ljm.nameToAddress(self.trigger)[0]
+            ljm.eWriteName(self.handle, "STREAM_TRIGGER_INDEX", address)
+            ljm.eWriteName(self.handle, f"{self.trigger}_EF_ENABLE", 0)
+            ljm.eWriteName(self.handle, f"{self.trigger}_EF_INDEX", 5)
+            ljm.eWriteName(self.handle, f"{self.trigger}_EF_ENABLE", 1)
+
+            # Do not time out while waiting for the trigger
+            self._write_library_config(
+                ljm.constants.STREAM_SCANS_RETURN,
+                ljm.constants.STREAM_SCANS_RETURN_ALL_OR_NONE,
             )
-            i += 1
-        except ljm.LJMError as err:
-            print("err 333:", err)
-            print("https://support.labjack.com/docs/ljm-error-codes")
-            exit()
-            if err.errorCode == ljm.errorcodes.NO_SCANS_RETURNED:
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                continue
-            else:
-                raise err
-
-    end = datetime.now()
-
-    print("\nTotal scans = %i" % (totScans))
-    tt = (end - start).seconds + float((end - start).microseconds) / 1000000
-    print("Time taken = %f seconds" % (tt))
-    print("LJM Scan Rate = %f scans/second" % (scanRate))
-    print("Timed Scan Rate = %f scans/second" % (totScans / tt))
-    print("Timed Sample Rate = %f samples/second" % (totScans * numAddresses / tt))
-    print("Skipped scans = %0.0f" % (totSkip / numAddresses))
-except ljm.LJMError:
-    ljme = sys.exc_info()[1]
-    print(ljme)
-except Exception:
-    e = sys.exc_info()[1]
-    print(e)
-
-try:
-    print("\nStop Stream")
-    ljm.eStreamStop(handle)
-except ljm.LJMError:
-    ljme = sys.exc_info()[1]
-    print(ljme)
-except Exception:
-    e = sys.exc_info()[1]
-    print(e)
-
-# Close handle
-ljm.close(handle)
+            self._write_library_config(ljm.constants.STREAM_RECEIVE_TIMEOUT_MS, 0)
+
+    def _write_library_config(self, name, value):
+        """Change a process-wide LJM setting, keeping its value for stop()."""
+        if name not in self._library_config:
+            self._library_config[name] = ljm.readLibraryConfigS(name)
+        ljm.writeLibraryConfigS(name, value)
+
+    def _restore_library_config(self):
+        """Restore the LJM settings changed by _configure()."""
+        for name, value in self._library_config.items():
+            try:
+                ljm.writeLibraryConfigS(name, value)
+            except ljm.LJMError as e:
+                log.warning(f"Could not restore LJM setting {name}: {e}")
+        self._library_config.clear()
+
+    def _run(self):
+        """Move the stream data into the ring buffer until stopped."""
+        while not self._stop.is_set():
+            try:
+                data, device_backlog, ljm_backlog = ljm.eStreamRead(self.handle)
+            except ljm.LJMError as e:
+                if e.errorCode == ljm.errorcodes.NO_SCANS_RETURNED:
+                    # Waiting for the trigger
+                    self._stop.wait(0.01)
+                    continue
+                log.error(f"Stream read failed: {e}")
+                self.error = e
+                break
+            now = time.monotonic()
+
+            scans = np.asarray(data).reshape(-1, len(self.names))
+            skipped = scans == skipped_value
+            scans[skipped] = np.nan
+            self._append(scans)
+            self.n_skipped += int(skipped.sum())
+            self.device_backlog = device_backlog
+            self.ljm_backlog = ljm_backlog
+
+            # The time of the first scan follows from the scans acquired so far.
+            # Reads are only ever late, so the earliest estimate is the best one.
+            acquired = self.n_scans + device_backlog + ljm_backlog
+            t0 = now - acquired / self.scan_rate
+            with self._lock:
+                self._t0 = t0 if self._t0 is None else min(self._t0, t0)
+
+    def _append(self, scans):
+        with self._lock:
+            capacity = self._data.shape[0]
+            if len(scans) > capacity:
+                self.n_scans += len(scans) - capacity
+                scans = scans[-capacity:]
+            indices = (self.n_scans + np.arange(len(scans))) % capacity
+            self._data[indices] = scans
+            self.n_scans += len(scans)
+
+
+if __name__ == "__main__":
+    # Stream AIN0 of the first found LabJack for a few seconds
+    logging.basicConfig(level=logging.INFO)
+    handle = ljm.openS("T7", "ANY", "ANY")
+    try:
+        with LabJackStream(handle, ["AIN0"], scan_rate=1000) as stream:
+            start = time.monotonic()
+            time.sleep(2)
+            times, data = stream.slice(start)
+        print(stream.statistics)
+        print(f"{len(times)} scans, AIN0 mean {np.nanmean(data):.5f}V")
+    finally:
+        ljm.close(handle)
@@ -0,0 +1,194 @@
+"""Process-wide pool of instrument sessions.
+
+Procedures queued in the sequencer run one after another in the same process,
+so the instrument sessions are kept open between them instead of reconnecting
+(VISA discovery, LabJack reset, Zeus SSH login and board initialization) in
+every startup. A pooled session is health-checked when it is checked out and is
+reconnected if the check fails. Configuration pushed through configure() is only
+sent again when it changes or when the session was reconnected.
+
+    from light_engine_characterization.instruments.pool import instrument_pool
+
+    tec = instrument_pool.tec()
+    osa = instrument_pool.osa()
+    instrument_pool.configure(
+        "anritsu.sweep", settings, lambda: osa.configure_sweep(*settings)
+    )
+"""
+
+import atexit
+import logging
+import threading
+
+from .agiltron import OpticalSwitch
+from .anritsu import AnritsuMS9740B
+from .arroyo import LDDSource7144, TECSource5240
+from .custom import ZeusController
+from .discovery import detect_instruments
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def _close(instrument):
+    """Close an instrument session, ignoring errors of already broken sessions."""
+    try:
+        if hasattr(instrument, "close"):
+            instrument.close()
+        else:
+            instrument.adapter.close()
+    except Exception as e:
+        log.debug(f"Error while closing {instrument}: {e}")
+
+
+def _check_id(instrument):
+    """Raise an error if a SCPI instrument does not answer *IDN?."""
+    if not instrument.id:
+        raise ConnectionError("no response to *IDN?")
+
+
+def _check_zeus(zeus):
+    """Raise an error if the Zeus agent or REPL session is not alive."""
+    if zeus.rpc is not None:
+        zeus.rpc.call("ping", timeout=2)
+    if zeus.interact is not None:
+        transport = zeus.client.get_transport()
+        if transport is None or not transport.is_active():
+            raise ConnectionError("SSH transport is closed")
+        if zeus.write_read("0") == -1:
+            raise ConnectionError("python prompt did not respond")
+
+
+class InstrumentPool:
+    """Keeps instrument sessions open across procedures."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._instruments = {}
+        self._settings = {}
+        self._resources = {}
+
+    def checkout(self, name, connect, check):
+        """Get the pooled session of an instrument, connecting if needed.
+
+        name: str, key of the session in the pool
+        connect: callable returning a new, configured session
+        check: callable that raises an error if a session is not usable
+        """
+        with self._lock:
+            instrument = self._instruments.get(name)
+            if instrument is not None:
+                try:
+                    check(instrument)
+                    log.debug(f"Reusing {name} session.")
+                    return instrument
+                except Exception as e:
+                    log.warning(
+                        f"{name} session failed health check ({e}), reconnecting."
+                    )
+                    self.discard(name)
+
+            instrument = connect()
+            self._instruments[name] = instrument
+            log.debug(f"Connected to {name}.")
+            return instrument
+
+    def configure(self, key, settings, apply):
+        """Apply settings unless the same settings were already applied.
+
+        key: str, "<session name>.<setting>", e.g. "anritsu.sweep"
+        settings: comparable description of the settings
+        apply: callable that pushes the settings to the instrument
+
+        Returns True if the settings were applied.
+        """
+        with self._lock:
+            if key in self._settings and self._settings[key] == settings:
+                return False
+            apply()
+            self._settings[key] = settings
+            return True
+
+    def setting(self, key, default=None):
+        """Settings last applied through configure(), or default if there are none."""
+        with self._lock:
+            return self._settings.get(key, default)
+
+    def forget(self, key):
+        """Forget applied settings, e.g. after they were changed outside the pool."""
+        with self._lock:
+            self._settings.pop(key, None)
+
+    def discard(self, name):
+        """Close a pooled session and forget its applied settings."""
+        with self._lock:
+            instrument = self._instruments.pop(name, None)
+            self._settings = {
+                key: value
+                for key, value in self._settings.items()
+                if not key.startswith(f"{name}.")
+            }
+        if instrument is not None:
+            _close(instrument)
+
+    def close(self):
+        """Close all pooled sessions."""
+        for name in list(self._instruments):
+            self.discard(name)
+
+    def _visa(self, name, cls):
+        """Connect to a VISA instrument, rediscovering it if it has moved."""
+        try:
+            if name not in self._resources:
+                self._resources = detect_instruments(required=(name,))
+            instrument = cls(self._resources[name])
+            instrument.id
+        except Exception as e:
+            log.warning(f"Could not connect to {name} ({e}), rescanning instruments.")
+            self._resources = detect_instruments(required=(name,), refresh=True)
+            instrument = cls(self._resources[name])
+        return instrument
+
+    def tec(self):
+        """Arroyo 5240 TEC source."""
+        return self.checkout(
+            "arroyo_tec", lambda: self._visa("arroyo_tec", TECSource5240), _check_id
+        )
+
+    def ldd(self):
+        """Arroyo 7144 laser diode driver."""
+        return self.checkout(
+            "arroyo_ldd", lambda: self._visa("arroyo_ldd", LDDSource7144), _check_id
+        )
+
+    def osa(self):
+        """Anritsu MS9740B optical spectrum analyzer."""
+        return self.checkout(
+            "anritsu", lambda: self._visa("anritsu", AnritsuMS9740B), _check_id
+        )
+
+    def switch(self):
+        """Agiltron optical switch, driven through the LabJack."""
+
+        def connect():
+            switch = OpticalSwitch()
+            switch.open()
+            switch.reset()
+            switch.configure()
+            return switch
+
+        return self.checkout("switch", connect, lambda switch: switch.done_voltage)
+
+    def zeus(self, hostname="pynq1"):
+        """Zeus controller board, connected through its persistent RPC agent."""
+
+        def connect():
+            zeus = ZeusController()
+            zeus.connect(hostname)
+            return zeus
+
+        return self.checkout(f"zeus_{hostname}", connect, _check_zeus)
+
+
+instrument_pool = InstrumentPool()
+atexit.register(instrument_pool.close)
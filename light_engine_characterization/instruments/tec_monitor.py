@@ -0,0 +1,226 @@
+"""Background sampling of the TEC temperature and detection of thermal settling.
+
+A TECMonitor thread reads the TEC temperature at a fixed period into a ring
+buffer. Instead of polling the TEC and then sleeping a fixed settling time, the
+procedures wait on the monitor: wait_settled() returns as soon as the recent
+samples are inside the tolerance band, flat (small fitted slope) and quiet
+(small fit residuals), so a temperature step only takes as long as the TEC loop
+actually needs. The settling trace is returned for storage with the sweep.
+
+The TEC session must not be used by two threads at once, so while a monitor is
+running all other TEC commands have to hold monitor.lock, and temperature
+readings should be taken with monitor.read().
+
+    monitor = TECMonitor(tec)
+    monitor.start()
+    with monitor.lock:
+        tec.set_temperature(75)
+    settling = monitor.wait_settled(75, max_settle_time=30)
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def settling_state(
+    t, temp, target, window_s=10.0, tol=0.1, max_slope=0.002, max_noise=0.02
+):
+    """Check whether a temperature trace has settled at the target.
+
+    t, temp: arrays of sample times [s] and temperatures [°C]
+    window_s: length of the trailing window that is evaluated [s]
+    tol: allowed deviation of every sample in the window from the target [°C]
+    max_slope: allowed magnitude of the slope fitted to the window [°C/s]
+    max_noise: allowed standard deviation of the fit residuals [°C]
+
+    Returns (settled, slope, noise); slope and noise are nan while the trace is
+    shorter than the window.
+    """
+    t = np.asarray(t, dtype=float)
+    temp = np.asarray(temp, dtype=float)
+    if t.size < 3 or t[-1] - t[0] < window_s:
+        return False, np.nan, np.nan
+
+    recent = t >= t[-1] - window_s
+    t, temp = t[recent] - t[-1], temp[recent]
+    slope, offset = np.polyfit(t, temp, 1)
+    noise = np.std(temp - (slope * t + offset))
+    settled = (
+        np.all(np.abs(temp - target) < tol)
+        and abs(slope) < max_slope
+        and noise < max_noise
+    )
+    return bool(settled), float(slope), float(noise)
+
+
+class TECMonitor:
+    """Samples the temperature of a TEC source in a background thread.
+
+    tec: instrument with a get_temperature() method
+    period: float, sampling period [s]
+    capacity: int, number of samples kept in the ring buffer
+    """
+
+    # Number of consecutive samples inside the tolerance band before a wait may
+    # end on max_settle_time without the settling criteria being met
+    min_in_band_samples = 10
+
+    def __init__(self, tec, period=0.25, capacity=14400):
+        self.tec = tec
+        self.period = period
+        self.lock = threading.RLock()
+        self._times = np.full(capacity, np.nan)
+        self._temps = np.full(capacity, np.nan)
+        self._n_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in the background."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="tec_monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the thread to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def read(self):
+        """Read the TEC temperature now, adding it to the buffer [°C]."""
+        with self.lock:
+            temp = self.tec.get_temperature()
+            i = self._n_samples % self._times.size
+            self._times[i] = time.monotonic()
+            self._temps[i] = temp
+            self._n_samples += 1
+        return temp
+
+    def trace(self, since=None):
+        """Get the buffered samples in chronological order.
+
+        since: time.monotonic() time of the first sample to return, or None for
+            the whole buffer
+
+        Returns arrays of the sample times [s, time.monotonic()] and
+        temperatures [°C].
+        """
+        with self.lock:
+            n = min(self._n_samples, self._times.size)
+            order = (np.arange(n) + self._n_samples - n) % self._times.size
+            times, temps = self._times[order], self._temps[order]
+        if since is not None:
+            keep = times >= since
+            times, temps = times[keep], temps[keep]
+        return times, temps
+
+    def wait_settled(
+        self,
+        target,
+        tol=0.1,
+        timeout=300,
+        max_settle_time=None,
+        should_stop=None,
+        **criteria,
+    ):
+        """Wait until the temperature has settled at the target.
+
+        tol: tolerance band around the target [°C]
+        timeout: time allowed to reach the tolerance band [s]
+        max_settle_time: longest wait after the band is reached [s]; the wait
+            ends then even if the trace is not flat yet, as long as at least
+            min_in_band_samples consecutive samples are inside the band (an error
+            is logged). Leaving the band restarts the settling. None to wait for
+            the settling criteria only.
+        should_stop: callable that aborts the wait when it returns True
+        criteria: window_s, max_slope and max_noise of settling_state()
+
+        Raises RuntimeError if the temperature is outside the tolerance band
+        after timeout.
+        Returns a dictionary with the trace since the start of the wait
+        ("time_s" relative to the start, "temp_c"), the wait "duration_s" and
+        whether the settling criteria were met ("settled").
+        """
+        start = time.monotonic()
+        reached = None
+        settled = False
+        while not (should_stop is not None and should_stop()):
+            now = time.monotonic()
+            times, temps = self.trace(since=start)
+            in_band = np.abs(temps - target) < tol
+            if temps.size and in_band[-1]:
+                # Settling starts at the first sample after the last one out of band
+                out = np.flatnonzero(~in_band)
+                first = out[-1] + 1 if out.size else 0
+                if reached is None:
+                    log.info(f"Target temperature reached after {now - start:.1f}s")
+                reached = times[first]
+                n_in_band = temps.size - first
+            else:
+                if reached is not None:
+                    log.warning(
+                        f"TEC temperature {temps[-1]:.3f}degC left the tolerance "
+                        f"band, restarting the settling"
+                    )
+                reached = None
+                if now - start > timeout:
+                    raise RuntimeError("Could not reach target TEC temperature.")
+
+            if reached is not None:
+                settling = times >= reached
+                settled, slope, noise = settling_state(
+                    times[settling], temps[settling], target, tol=tol, **criteria
+                )
+                if settled:
+                    log.info(
+                        f"TEC settled after {now - start:.1f}s "
+                        f"(slope {slope * 1000:.2f}mK/s, noise {noise * 1000:.1f}mK)"
+                    )
+                    break
+                if (
+                    max_settle_time is not None
+                    and now - reached >= max_settle_time
+                    and n_in_band >= self.min_in_band_samples
+                ):
+                    log.error(
+                        f"TEC not settled {max_settle_time}s after reaching the "
+                        f"tolerance band (slope {slope * 1000:.2f}mK/s, noise "
+                        f"{noise * 1000:.1f}mK), continuing inside the band"
+                    )
+                    break
+            time.sleep(self.period)
+
+        times, temps = self.trace(since=start)
+        return {
+            "time_s": (times - start).tolist(),
+            "temp_c": temps.tolist(),
+            "duration_s": time.monotonic() - start,
+            "settled": settled,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.read()
+            except Exception as e:
+                log.debug(f"TEC temperature read failed: {e}")
+            self._stop.wait(self.period)
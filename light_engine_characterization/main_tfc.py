@@ -22,6 +22,7 @@ from pymeasure.display.windows import ManagedWindow
 from pymeasure.experiment import Results
 
 from light_engine_characterization.procedures import TFCCharacterization
+from light_engine_characterization.sequence_queue import use_planned_sequence
 
 
 class MainWindow(ManagedWindow):
@@ -39,6 +40,13 @@ class MainWindow(ManagedWindow):
                 "coarse_enable",
                 "coarse_stop",
                 "coarse_step",
+                "resume_enable",
+                "resume_overlap",
+                "adaptive_enable",
+                "adaptive_step",
+                "adaptive_budget",
+                "resume_sweep_id",
+                "liv_enable",
             ],
             displays=[
                 "light_engine_id",
@@ -68,6 +76,9 @@ class MainWindow(ManagedWindow):
         self.file_input.extensions = [".csv", ".txt", ".data"]
         self.file_input.filename_fixed = True
 
+        # Queue sequences in temperature order instead of the order of the tree
+        use_planned_sequence(self)
+
     def queue(self, procedure=None):
         """Queue a measurement based on the parameters in the input-widget."""
         log.debug("Queuing experiment.")
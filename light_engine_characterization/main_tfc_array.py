@@ -22,6 +22,7 @@ from pymeasure.display.windows import ManagedWindow
 from pymeasure.experiment import Results
 
 from light_engine_characterization.procedures import TFCArrayCharacterization
+from light_engine_characterization.sequence_queue import use_planned_sequence
 
 
 class MainWindow(ManagedWindow):
@@ -40,6 +41,10 @@ class MainWindow(ManagedWindow):
                 "coarse_enable",
                 "coarse_stop",
                 "coarse_step",
+                "multi_channel_enable",
+                "channels",
+                "resume_enable",
+                "resume_overlap",
             ],
             displays=[
                 "light_engine_id",
@@ -70,6 +75,9 @@ class MainWindow(ManagedWindow):
         self.file_input.extensions = [".csv", ".txt", ".data"]
         self.file_input.filename_fixed = True
 
+        # Queue sequences in temperature order instead of the order of the tree
+        use_planned_sequence(self)
+
     def queue(self, procedure=None):
         """Queue a measurement based on the parameters in the input-widget."""
         log.debug("Queuing experiment.")
@@ -0,0 +1,93 @@
+"""Adaptive refinement of the bias grid of a sweep.
+
+A uniform grid spends most of its OSA sweeps on the smooth parts of the curves.
+An adaptive sweep measures a coarse grid first and then only adds points where
+the measured curves bend or jump (lasing threshold, mode hops, rollover), until
+the point budget is used up or the curves are resolved down to the minimum step.
+
+Every interior point is scored by how far each metric deviates from the linear
+interpolation between its two neighbours, relative to the tolerance of the
+metric. Smooth curves, including the linear thermal tuning of the peak
+wavelength, score close to zero; the intervals next to high scoring points are
+split at their midpoints by refine_points().
+
+    points = coarse_grid(0, 500, 20)
+    while points.size:
+        measure(points)
+        points = refine_points(measured, metrics, min_step=1, max_points=budget)
+"""
+
+import numpy as np
+
+# Deviation from the linear interpolation between the neighbouring points above
+# which the intervals around a point are refined
+default_tolerances = {
+    "power_peak_dbm": 0.5,
+    "wavelength_peak_nm": 0.05,
+    "smsr_db": 3.0,
+}
+
+
+def coarse_grid(start, stop, step):
+    """Initial grid from start to stop, both included."""
+    return np.append(np.arange(start, stop, step), stop)
+
+
+def interval_scores(points, metrics, tolerances=default_tolerances):
+    """Score the intervals between sorted bias points by the curvature of the metrics.
+
+    points: sorted array of the measured bias points
+    metrics: dictionary of metric name -> values at the points; nan where a
+        metric is not available (e.g. no SMSR below threshold)
+
+    Returns an array of len(points) - 1 scores. Intervals scoring above 1 are
+    not resolved by the points; an interval where a metric appears or vanishes
+    scores inf.
+    """
+    points = np.asarray(points, dtype=float)
+    scores = np.zeros(max(points.size - 1, 0))
+    for name, tol in tolerances.items():
+        if name not in metrics:
+            continue
+        values = np.asarray(metrics[name], dtype=float)
+        if points.size >= 3:
+            left, middle, right = values[:-2], values[1:-1], values[2:]
+            fraction = (points[1:-1] - points[:-2]) / (points[2:] - points[:-2])
+            deviation = np.abs(middle - (left + (right - left) * fraction)) / tol
+            deviation = np.nan_to_num(deviation, nan=0.0)
+            point_scores = np.concatenate([[0.0], deviation, [0.0]])
+            scores = np.maximum(scores, point_scores[:-1])
+            scores = np.maximum(scores, point_scores[1:])
+        missing = np.isnan(values)
+        scores[missing[:-1] != missing[1:]] = np.inf
+    return scores
+
+
+def refine_points(points, metrics, min_step, max_points, tolerances=default_tolerances):
+    """Select the next bias points to measure.
+
+    The unresolved intervals (see interval_scores) that can still be split on
+    the min_step grid are split at their midpoints, the highest scoring first.
+
+    points: array of the measured bias points
+    metrics: dictionary of metric name -> values at the points
+    min_step: smallest spacing of the bias points
+    max_points: largest number of points to return, e.g. the remaining budget
+
+    Returns the sorted new points, empty once the curves are resolved or the
+    budget is used up.
+    """
+    points = np.asarray(points, dtype=float)
+    order = np.argsort(points)
+    points = points[order]
+    metrics = {name: np.asarray(values)[order] for name, values in metrics.items()}
+
+    scores = interval_scores(points, metrics, tolerances)
+    widths = np.diff(points)
+    candidates = np.flatnonzero((scores > 1) & (widths >= 2 * min_step - 1e-9))
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    candidates = candidates[: max(int(max_points), 0)]
+
+    # Midpoints snapped to the min_step grid of the left point
+    offsets = np.round(widths[candidates] / (2 * min_step)) * min_step
+    return np.sort(points[candidates] + offsets)
@@ -0,0 +1,84 @@
+"""Continuation of interrupted sweeps from the points stored in the database.
+
+Every point is written with the sweep_id of its sweep, so the database is the
+checkpoint of a sweep. When an experiment is requeued after a crash or fault,
+find_checkpoint() looks up the latest sweep of the same procedure, light engine,
+channel, temperature and sweep type. If that sweep is still "running" or
+"failed" (see resumable_status; sweeps aborted by the user start anew) and used
+the same bias grid, the experiment continues it under the same sweep_id from
+the first bias point without a stored point. It steps back a few points so
+that the continuation can be checked against the stored curve; these overlap
+points are stored with overlap=True, which data_integrity.py does not count as
+duplicate points. Its repair leaves resumable sweeps alone.
+
+    sweep, start, n_overlap = find_checkpoint(engine, model, key, bias_currents)
+    executor.run(bias_currents[start:], ...)  # the first n_overlap are overlap
+"""
+
+import logging
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from light_engine_characterization.tables import resumable_sweep, stored_bias_currents
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def first_missing_point(bias_currents, stored):
+    """Index of the first bias point without a stored point.
+
+    A stored point counts for the nearest bias point if it is within half a bias
+    step, since some procedures store the measured instead of the set current.
+    Returns len(bias_currents) if all points are stored.
+    """
+    bias_currents = np.asarray(bias_currents, dtype=float)
+    stored = np.asarray(stored, dtype=float)
+    if bias_currents.size == 0 or stored.size == 0:
+        return 0
+    tol = np.min(np.diff(bias_currents)) / 2 if bias_currents.size > 1 else 0.5
+    distance = np.abs(bias_currents[:, None] - stored[None, :]).min(axis=1)
+    missing = np.flatnonzero(distance > tol)
+    return int(missing[0]) if missing.size else bias_currents.size
+
+
+def find_checkpoint(engine, model, key, bias_currents, overlap=0):
+    """Find an interrupted sweep to continue.
+
+    engine: sqlalchemy.Engine, or None if the database is not reachable
+    model: measurement table of the points
+    key: dictionary with the procedure, light_engine_id, channel,
+        nominal_temp_c and sweep_type of the experiment
+    bias_currents: bias grid of the experiment
+    overlap: number of stored points before the first missing one to measure
+        again
+
+    Returns the Sweep to continue, the index of the first bias point to measure
+    and the number of overlap points measured from there, or (None, 0, 0) to
+    start a new sweep.
+    """
+    if engine is None:
+        return None, 0, 0
+    try:
+        with Session(engine) as session:
+            sweep = resumable_sweep(session, **key)
+            if sweep is None:
+                return None, 0, 0
+            if sweep.bias_currents_ma is None or not np.array_equal(
+                np.round(sweep.bias_currents_ma, 6), np.round(bias_currents, 6)
+            ):
+                log.info(f"Sweep {sweep.sweep_id} used another bias grid, not resuming")
+                return None, 0, 0
+            stored = stored_bias_currents(session, model, sweep.sweep_id)
+    except Exception as e:
+        log.error(f"Could not look up interrupted sweeps: {e}")
+        return None, 0, 0
+
+    first = first_missing_point(bias_currents, stored)
+    log.info(
+        f"Found {sweep.status} sweep {sweep.sweep_id} with {len(stored)} points, "
+        f"first missing bias point {first}"
+    )
+    start = max(first - overlap, 0)
+    return sweep, start, first - start
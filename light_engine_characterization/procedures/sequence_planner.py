@@ -0,0 +1,102 @@
+"""Planning of sequencer runs to minimize TEC temperature transitions.
+
+The sequencer queues its entries in the order of the sequence tree, and every
+experiment used to set the TEC, wait the full settling time and turn the TEC off
+again. plan_sequence() instead groups the entries by temperature, orders the
+temperatures monotonically (starting from the end nearer to the current TEC
+temperature) and sorts the entries of a group by channel. Every planned entry
+but the last gets tec_hold=True, so the TEC stays on between the experiments;
+the procedures only wait for settling when the setpoint actually changes.
+
+estimate_duration() gives the up-front duration of a plan for get_estimates().
+"""
+
+from collections import ChainMap
+
+# Approximate time to measure a single sweep point [s]
+point_time = 2.6
+
+# Approximate TEC ramp rate between setpoints [°C/s]
+tec_ramp_rate = 0.2
+
+# Temperature of the TEC when a sequence starts, if it is off [°C]
+ambient_temp_c = 25.0
+
+
+def sequence_parameters(sequence):
+    """Convert the entries of SequencerWidget.get_sequence() to parameter dictionaries."""
+    return [dict(ChainMap(*entry[::-1])) for entry in sequence]
+
+
+def plan_sequence(entries, start_temp=ambient_temp_c):
+    """Order sequencer entries to minimize the TEC temperature transitions.
+
+    entries: list of parameter dictionaries with a "nominal_temp_c" and an
+        optional "channel" key
+    start_temp: current TEC temperature [°C]
+
+    Returns a new list of parameter dictionaries with tec_hold set.
+    """
+    temperatures = sorted({entry["nominal_temp_c"] for entry in entries})
+    if temperatures and abs(temperatures[-1] - start_temp) < abs(
+        temperatures[0] - start_temp
+    ):
+        temperatures.reverse()
+
+    plan = []
+    for temperature in temperatures:
+        group = [entry for entry in entries if entry["nominal_temp_c"] == temperature]
+        group.sort(key=lambda entry: entry.get("channel", 0))
+        plan.extend({**entry, "tec_hold": True} for entry in group)
+    if plan:
+        plan[-1]["tec_hold"] = False
+    return plan
+
+
+def estimate_duration(
+    plan,
+    n_points,
+    settling_time,
+    start_temp=ambient_temp_c,
+    point_time=point_time,
+    ramp_rate=tec_ramp_rate,
+):
+    """Estimate the duration of a planned sequence [s].
+
+    n_points: number of bias points of every sweep
+    settling_time: settling time after every setpoint change [s]
+
+    Returns (duration, number of setpoint changes).
+    """
+    duration = 0.0
+    n_transitions = 0
+    temp = None
+    for entry in plan:
+        # The first experiment always waits for the TEC to settle
+        if entry["nominal_temp_c"] != temp:
+            previous = start_temp if temp is None else temp
+            duration += abs(entry["nominal_temp_c"] - previous) / ramp_rate
+            duration += settling_time
+            n_transitions += 1
+            temp = entry["nominal_temp_c"]
+        duration += n_points * point_time
+    return duration, n_transitions
+
+
+def channel_order(channels, current_port=None, port=lambda channel: channel):
+    """Order channels so that the optical switch moves over the fewest ports.
+
+    The channels are visited in port order, starting from the end nearer to the
+    current switch port.
+
+    current_port: current port of the switch, or None if unknown
+    port: callable mapping a channel to its switch port
+    """
+    ordered = sorted(set(channels), key=port)
+    if (
+        current_port is not None
+        and ordered
+        and abs(port(ordered[-1]) - current_port) < abs(port(ordered[0]) - current_port)
+    ):
+        ordered.reverse()
+    return ordered
@@ -0,0 +1,90 @@
+"""Pipelined execution of bias sweeps.
+
+Each point of a sweep is split into three stages:
+
+1. setup: set the bias point (blocking)
+2. acquire: independent acquisition tasks, e.g. the OSA sweep and the TEC/Zeus
+   telemetry, which run concurrently
+3. process: analysis and storage of the point, which runs in the background
+   while the next point is being set up and acquired
+
+Every instrument call goes through a per-instrument lock, so that no instrument
+ever receives two commands at once even when tasks run on different threads.
+Processing runs on a single worker so that points are recorded in order.
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class SweepExecutor:
+    """Execute a sweep with overlapping instrument I/O."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.locks = defaultdict(threading.Lock)
+        self.pool = None
+        self.processor = None
+
+    def __enter__(self):
+        self.pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="sweep")
+        self.processor = ThreadPoolExecutor(1, thread_name_prefix="sweep_process")
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.shutdown(wait=True)
+        self.processor.shutdown(wait=True)
+        self.pool = None
+        self.processor = None
+
+    def call(self, instrument, fn, *args, **kwargs):
+        """Call fn while holding the lock of the given instrument."""
+        with self.locks[instrument]:
+            return fn(*args, **kwargs)
+
+    def submit(self, instrument, fn, *args, **kwargs):
+        """Submit fn to the thread pool, holding the lock of the given instrument."""
+        return self.pool.submit(self.call, instrument, fn, *args, **kwargs)
+
+    def run(self, points, setup, acquire, process, should_stop=lambda: False):
+        """Run the sweep over all points.
+
+        points: iterable of sweep points (e.g. bias currents)
+        setup: (instrument, fn), fn(point) sets the sweep point
+        acquire: dict of name -> (instrument, fn), fn(point) returns the
+            acquired value, all tasks run concurrently after the setup
+        process: fn(index, point, results) called with the dict of acquired
+            values, runs in the background while the next point is acquired
+        should_stop: fn() returning True if the sweep should be aborted
+
+        Exceptions raised in any stage are re-raised in the calling thread.
+        """
+        processed = []
+        try:
+            for i, point in enumerate(points):
+                if should_stop():
+                    break
+                self.call(*setup, point)
+
+                futures = {
+                    name: self.submit(instrument, fn, point)
+                    for name, (instrument, fn) in acquire.items()
+                }
+                results = {name: future.result() for name, future in futures.items()}
+
+                processed.append(self.processor.submit(process, i, point, results))
+
+                # Surface processing errors without waiting for the sweep to end
+                while processed and processed[0].done():
+                    processed.pop(0).result()
+        except BaseException:
+            wait(processed)
+            raise
+
+        for future in processed:
+            future.result()
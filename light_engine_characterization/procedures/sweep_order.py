@@ -0,0 +1,82 @@
+"""Ordering of the channel/bias grid of multi-channel sweeps.
+
+The temperature is always the outermost loop, since a TEC step costs far more
+than anything inside it. Within one temperature the grid can be run as
+
+- channel_major: every channel gets its own bias sweep, the other channels are
+  set as for a single-channel sweep (off, or full power)
+- bias_major: all channels are driven at the same bias, one telemetry snapshot
+  is taken per bias and the switch then visits every channel for its OSA sweep
+- serpentine: like bias_major, with the channel order reversed on every other
+  bias so that the switch does not jump back to the first channel
+
+estimate_time() is a cost model of the switch moves, Zeus round trips and OSA
+sweeps of an order, and cheapest_order() picks the order with the lowest
+estimate. The bias-major orders change the operating conditions (all channels
+lit, so the measured channel sees the thermal crosstalk of its neighbours) and
+are therefore recorded as "shared_bias" sweeps. They are not equivalent to a
+channel-major sweep, so they are only run when selected explicitly, never by
+the "auto" choice of the procedures.
+"""
+
+orders = ("channel_major", "bias_major", "serpentine")
+
+# Orders that drive all channels at the same bias
+shared_bias_orders = ("bias_major", "serpentine")
+
+# Approximate durations of the sweep operations [s]
+default_costs = {
+    "switch_s": 0.02,  # strobe and wait for the done line
+    "zeus_s": 0.05,  # one agent round trip (bias setting or telemetry snapshot)
+    "osa_s": 2.4,  # single sweep and trace download
+}
+
+
+def sweep_steps(order, channels, bias_currents):
+    """List the (channel, bias_current) points of an order in execution order."""
+    if order == "channel_major":
+        return [(channel, bias) for channel in channels for bias in bias_currents]
+    if order == "bias_major":
+        return [(channel, bias) for bias in bias_currents for channel in channels]
+    if order == "serpentine":
+        return [
+            (channel, bias)
+            for i, bias in enumerate(bias_currents)
+            for channel in (channels if i % 2 == 0 else channels[::-1])
+        ]
+    raise ValueError(f"Unknown sweep order {order!r}, expected one of {orders}")
+
+
+def estimate_time(order, channels, bias_currents, costs=default_costs):
+    """Estimate the duration of a multi-channel sweep in the given order [s].
+
+    A Zeus round trip is counted for every bias setting and telemetry snapshot;
+    the snapshot overlaps with the OSA sweep, so a point takes the longer of the
+    two. The bias-major orders set and read all channels once per bias.
+    """
+    shared_bias = order != "channel_major"
+    duration = 0.0
+    previous = (None, None)
+    for channel, bias in sweep_steps(order, channels, bias_currents):
+        new_bias = bias != previous[1] or (not shared_bias and channel != previous[0])
+        if channel != previous[0]:
+            duration += costs["switch_s"]
+        if new_bias:
+            duration += costs["zeus_s"]
+        snapshot = costs["zeus_s"] if new_bias or not shared_bias else 0.0
+        duration += max(costs["osa_s"], snapshot)
+        previous = (channel, bias)
+    return duration
+
+
+def cheapest_order(channels, bias_currents, costs=default_costs, allowed=orders):
+    """Pick the allowed order with the lowest estimated duration.
+
+    Returns the order and its estimated duration [s].
+    """
+    estimates = {
+        order: estimate_time(order, channels, bias_currents, costs)
+        for order in allowed
+    }
+    order = min(estimates, key=estimates.get)
+    return order, estimates[order]
@@ -1,32 +1,54 @@
 import logging
 import time
+import uuid
 from datetime import datetime, timedelta
 
 import numpy as np
 import pymsteams
-import pyvisa as visa
 from pymeasure.experiment import (
     BooleanParameter,
     FloatParameter,
     IntegerParameter,
+    ListParameter,
     Measurable,
     Metadata,
     Parameter,
     Procedure,
 )
 from pymeasure.instruments.keithley import Keithley2400
-from sqlalchemy import create_engine, inspect
-from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
 
-from light_engine_characterization.instruments.agiltron import OpticalSwitch
-from light_engine_characterization.instruments.anritsu import AnritsuMS9740B
-from light_engine_characterization.instruments.arroyo import TECSource5240
-from light_engine_characterization.instruments.custom import ZeusController
+from light_engine_characterization.analysis import analyze_spectrum
+from light_engine_characterization.instruments.discovery import detect_instruments
+from light_engine_characterization.instruments.pool import instrument_pool
+from light_engine_characterization.instruments.tec_monitor import TECMonitor
 from light_engine_characterization.tables import (
     LightEngineMeasurement,
+    LightEngineMeasurementCompact,
+    MeasurementWriter,
+    Sweep,
+    compact_row,
     database_address,
 )
 
+from .checkpoint import find_checkpoint
+from .sequence_planner import (
+    ambient_temp_c,
+    channel_order,
+    estimate_duration,
+    plan_sequence,
+    sequence_parameters,
+)
+from .sweep_executor import SweepExecutor
+from .sweep_order import (
+    cheapest_order,
+    default_costs,
+    estimate_time,
+    orders,
+    shared_bias_orders,
+    sweep_steps,
+)
+
 # Power corrections to account for switch/connector losses
 # power_corr = (1.06987, 1.21548, 1.45471, 1.38559, 2.34974, 1.4391, 1.22897, 1.64761)
 
@@ -48,28 +70,6 @@ data_columns = list(
 data_columns = list(map(lambda x: x.replace("voltage_v", "Voltage (V)"), data_columns))
 
 
-def detect_instruments():
-    rm = visa.ResourceManager()
-    resources = rm.list_resources()
-    instruments = {}
-    for resource in resources:
-        try:
-            res = rm.open_resource(resource)
-            res.write_termination = "\n"
-            res.baud_rate = 38400
-            resource_id = res.query("*IDN?")
-            if "anritsu" in resource_id.lower():
-                instruments["anritsu"] = resource
-            elif "arroyo" in resource_id.lower():
-                instruments["arroyo"] = resource
-            elif "keithley" in resource_id.lower():
-                instruments["keithley"] = resource
-        except Exception as e:
-            continue
-
-    return instruments
-
-
 class TFCArrayCharacterization(Procedure):
     """Procedure for characterizing Molex Light Engines over temperature and bias current."""
 
@@ -93,6 +93,8 @@ class TFCArrayCharacterization(Procedure):
     temp_settling_time = IntegerParameter(
         "Temperature Settling Time", units="s", default=30
     )
+    # Set by the sequence planner for all but the last experiment of a sequence
+    tec_hold = BooleanParameter("Keep TEC On", default=False)
 
     # Current bias sweep settings
     bias_start = FloatParameter(
@@ -111,6 +113,27 @@ class TFCArrayCharacterization(Procedure):
     # Full power sweep enable
     full_power_enable = BooleanParameter("Full Power Sweep", default=False)
 
+    # Sweep several channels at one settled temperature, stepping the switch.
+    # The shared-bias orders (bias_major, serpentine) light all channels at once
+    # and have to be selected explicitly, "auto" never picks them.
+    multi_channel_enable = BooleanParameter("Sweep Multiple Channels", default=False)
+    channels = Parameter(
+        "Channels", group_by="multi_channel_enable", default="0,1,2,3,4,5,6,7"
+    )
+    sweep_order = ListParameter(
+        "Sweep Order",
+        choices=["auto", *orders],
+        group_by="multi_channel_enable",
+        default="channel_major",
+    )
+
+    # Continue an interrupted sweep of the same experiment from its stored points.
+    # Only channel-major sweeps are continued, shared-bias sweeps start anew.
+    resume_enable = BooleanParameter("Resume Interrupted Sweep", default=True)
+    resume_overlap = IntegerParameter(
+        "Resume Overlap Points", group_by="resume_enable", minimum=0, default=2
+    )
+
     # OSA configuration settings
     wavelength_start = 1565
     wavelength_stop = 1585
@@ -118,6 +141,15 @@ class TFCArrayCharacterization(Procedure):
     wavelength_resolution = 0.03
     resolution_vbw = "1kHz"
 
+    # Analyze spectra on the host rather than with the OSA analysis functions
+    host_analysis = True
+
+    # Store spectra in the compact binary table layout
+    compact_storage = False
+
+    # Durations of the sweep operations used to pick the sweep order
+    sweep_costs = default_costs
+
     # Measurement metadata
     # TODO: Metadata does not seem to be fully supported yet
     # measurement_date = Metadata("Date", fget=lambda: datetime.now().strftime(r"%Y%m%d"))
@@ -151,9 +183,12 @@ class TFCArrayCharacterization(Procedure):
         self.switch = None
         self.zeus = None
         self.engine = None
-        self.session = None
+        self.writer = None
+        self.sweep_writer = None
 
         self.tec_pid = None
+        self.tec_monitor = None
+        self.settling = None
 
         # Evaluate metadata
         self.measurement_date = None
@@ -161,6 +196,17 @@ class TFCArrayCharacterization(Procedure):
         log.debug("Light engine characterization procedure initialized.")
 
         self.measurement_successful = False
+        self.sweep_ids = {}
+        self.sweep_status = None
+        self.sweep_type = None
+        self.n_points_done = 0
+        self.n_overlap = 0
+        self.estimated_duration_s = None
+        self.duration_s = None
+        self.switch_channel = None
+        self.order = None
+        self.shared_bias = None
+        self.shared_snapshot = None
 
     def startup(self):
         """Measurement startup procedure.
@@ -169,9 +215,8 @@ class TFCArrayCharacterization(Procedure):
         """
         log.debug("Beginning startup procedure.")
 
-        instruments = detect_instruments()
-
-        self.tec = TECSource5240(instruments["arroyo"])
+        # Instrument sessions are kept open between procedures by the pool
+        self.tec = instrument_pool.tec()
         self.tec_pid = self.tec.pid_params
         log.debug("Connected to TEC.")
 
@@ -179,12 +224,19 @@ class TFCArrayCharacterization(Procedure):
         self.wavelength_stop = 1578
 
         # Configure the OSA parameters
-        self.osa = AnritsuMS9740B(instruments["anritsu"])
-        self.osa.wavelength_start = self.wavelength_start
-        self.osa.wavelength_stop = self.wavelength_stop
-        self.osa.sampling_points = self.wavelength_points
-        self.osa.resolution = self.wavelength_resolution
-        self.osa.resolution_vbw = self.resolution_vbw
+        self.osa = instrument_pool.osa()
+        sweep_settings = (
+            self.wavelength_start,
+            self.wavelength_stop,
+            self.wavelength_points,
+            self.wavelength_resolution,
+            self.resolution_vbw,
+        )
+        instrument_pool.configure(
+            "anritsu.sweep",
+            sweep_settings,
+            lambda: self.osa.configure_sweep(*sweep_settings),
+        )
         log.debug("Connected to OSA.")
 
         # Connect to SMU
@@ -192,206 +244,310 @@ class TFCArrayCharacterization(Procedure):
         # log.debug("Connected to SMU.")
 
         # Connect to optical switch
-        self.switch = OpticalSwitch()
-        self.switch.open()
-        self.switch.reset()
-        self.switch.configure()
+        self.switch = instrument_pool.switch()
         log.debug("Connected to optical switch (labjack).")
 
         # Connect to Zeus controller
-        self.zeus = ZeusController()
-        self.zeus.open_session("pynq1")
-        self.zeus.write_read("fan.set_le_duty_cycle(90)")
+        self.zeus = instrument_pool.zeus("pynq1")
+        instrument_pool.configure(
+            "zeus_pynq1.fan",
+            90,
+            lambda: self.zeus.set_fan_duty_cycle(90),
+        )
         log.debug("Connected to Zeus controller.")
 
+        # Sample the TEC temperature in the background for the settling detection
+        self.tec_monitor = TECMonitor(self.tec)
+        self.tec_monitor.start()
+
         # Attempt to connect to the database
+        table = (
+            LightEngineMeasurementCompact
+            if self.compact_storage
+            else LightEngineMeasurement
+        )
         try:
             self.engine = create_engine(database_address)
-            self.session = Session(self.engine)
-            self.session.begin()
-            log.debug("Connected to database.")
 
-            # Create the table if it does not exist
-            if not inspect(self.engine).has_table(
-                LightEngineMeasurement.__tablename__,
-                schema=LightEngineMeasurement.__table_args__["schema"],
-            ):
-                try:
-                    LightEngineMeasurement.__table__.create(self.engine)
-                except Exception as e:
-                    log.error(e)
+            # Create the tables if they do not exist
+            Sweep.metadata.create_all(
+                self.engine, tables=[Sweep.__table__, table.__table__]
+            )
+            log.debug("Connected to database.")
         except Exception as e:
             log.error(e)
             log.warning(
-                "Could not connect to database, data will only be saved locally."
+                "Could not connect to database, data will be spooled locally."
             )
-            self.session = None
+            self.engine = None
+
+        # Start the database writers and replay any rows spooled by earlier runs,
+        # sweep headers first since the points reference them
+        self.sweep_writer = MeasurementWriter(
+            self.engine, Sweep, batch_size=1, upsert_key="sweep_id"
+        )
+        self.writer = MeasurementWriter(self.engine, table)
+        try:
+            self.sweep_writer.replay_spool()
+            self.writer.replay_spool()
+        except Exception as e:
+            log.error(f"Could not replay spooled measurements: {e}")
 
         log.info("Measurement startup complete.")
 
     def execute(self):
         """Execute the light engine characterization procedure."""
         log.info(f"Starting bias sweep at {self.nominal_temp_c}degC")
-        # If full power sweep is enabled, set all channels except the target
-        # measurement channel to maximum bias
-        if self.full_power_enable:
-            for i in range(8):
-                if i != self.channel:
-                    full_power_bias = 500
-                    query_string = (
-                        f"light_engine.set_laser_ma(LEChannel.LE{i},{full_power_bias})"
-                    )
-                    log.info(f"Set channel {i} to {full_power_bias}mA")
-                    self.zeus.write_read(query_string)
+        # The channels are visited in switch port order, starting from the end
+        # nearer to the current port, so that the switch moves the least
+        channels = channel_order(
+            self.measurement_channels,
+            self.switch.get_channel(),
+            port=lambda channel: 7 - channel,
+        )
+        self.channel = channels[0]
+        self.set_channel_currents()
+
+        # Set the temperature and wait for it to settle. Within a planned sequence
+        # the TEC stays on, so the settling is skipped if the setpoint is unchanged.
+        if instrument_pool.configure(
+            "arroyo_tec.setpoint", self.nominal_temp_c, self.set_tec_setpoint
+        ):
+            log.debug(f"Waiting up to {self.temp_settling_time}s for TEC to settle.")
+            t_settle = self.temp_settling_time
         else:
-            for i in range(8):
-                query_string = f"light_engine.set_laser_ma(LEChannel.LE{i},0)"
-                log.debug(f"Set channel {i} to 0mA")
-
-        # Set the temperature and wait for it to settle
-        self.tec.set_temperature(self.nominal_temp_c)
-        self.tec.set_output_on()
-        # self.smu.enable_source = True
-        log.debug(f"Waiting {self.temp_settling_time}s for TEC to settle.")
-        self.wait_for_tec(self.nominal_temp_c, self.temp_settling_time)
+            log.info(f"TEC already at {self.nominal_temp_c}degC, skipping settling.")
+            t_settle = 0
+        self.settling = self.wait_for_tec(self.nominal_temp_c, t_settle)
         if self.should_stop():
             log.info("User aborted the procedure.")
             return None
 
-        # Select the channel
-        self.switch.set_channel(7 - self.channel)
+        order, estimate = self.choose_sweep_order(channels)
+        log.info(f"Sweeping channels {channels} {order}, estimated {estimate:.0f}s")
+        self.order = order
+        start = time.monotonic()
+        if order == "channel_major":
+            for channel in channels:
+                self.channel = channel
+                self.sweep_channel()
+                if self.should_stop():
+                    break
+        else:
+            self.sweep_shared_bias(order, channels)
+        log.info(
+            f"Sweep time: estimated {estimate:.0f}s, "
+            f"actual {time.monotonic() - start:.0f}s ({order})"
+        )
 
-        # Perform the bias sweep
-        for j, bias_current in enumerate(self.bias_current_steps):
-            start_date = self.measurement_date
-            start_time = self.measurement_time
+        if not self.should_stop():
+            self.measurement_successful = True
 
-            # Set the light engine channel and bias current
-            log.debug(f"Setting bias current to {bias_current}mA")
-            query_string = (
-                f"light_engine.set_laser_ma(LEChannel.LE{self.channel},{bias_current})"
-            )
-            self.zeus.write_read(query_string)
-
-            # Read the temperatures, voltages, and currents
-            tec_temp_c = self.tec.get_temperature()
-            # cathode_voltage_v = self.read_voltage()
-            cathode_voltage_v = 2 - self.zeus.get_voltage_readout(self.channel)
-            ambient_temp_c, light_engine_temp_c = (
-                self.zeus.get_light_engine_temperatures()
-            )
-            mpd_current_ma = self.zeus.get_mpd_readout(self.channel)
+    def choose_sweep_order(self, channels):
+        """Pick the order of the channel/bias grid, see sweep_order.py.
 
-            # Trigger a single OSA sweep and retrieve the result
-            sweep_successful = False
-            while not sweep_successful:
-                try:
-                    self.osa.single_sweep()
-                    sweep_successful = True
-                except RuntimeWarning:
-                    log.warning("Sweep timed out, re-running sweep")
-
-            wavelength_nm, power_dbm = self.osa.read_memory()
-            wavelength_nm = np.array(wavelength_nm)
-            power_dbm = np.array(power_dbm)
-            power_uw = 10 ** (power_dbm / 10) * 1000
-
-            # Get the spectral peak (wavelength, power)
-            osa_peak = self.osa.measure_peak()
-            peak_wavelength_nm = osa_peak[0]
-            peak_power_dbm = osa_peak[1]
-            log.debug(f"Peak wavelength: {peak_wavelength_nm}nm, {peak_power_dbm}dBm")
+        The bias-major orders drive all channels at the same bias, which changes
+        the thermal condition of the measured channel, so they are only used if
+        selected explicitly and never for full power sweeps; "auto" only picks
+        among the orders that keep one channel lit. Returns the order and its
+        estimated duration [s].
+        """
+        allowed = orders
+        if self.full_power_enable or len(channels) == 1:
+            allowed = ("channel_major",)
+        bias_currents = self.bias_current_steps
+        if self.sweep_order == "auto" or not self.multi_channel_enable:
+            allowed = tuple(o for o in allowed if o not in shared_bias_orders)
+            return cheapest_order(channels, bias_currents, self.sweep_costs, allowed)
+        if self.sweep_order not in allowed:
+            log.warning(f"Sweep order {self.sweep_order} is not possible here.")
+            return cheapest_order(channels, bias_currents, self.sweep_costs, allowed)
+        return self.sweep_order, estimate_time(
+            self.sweep_order, channels, bias_currents, self.sweep_costs
+        )
 
-            # If the peak power is greater than -30dBm, also measure the SMSR and linewidth
-            if peak_power_dbm > -30:
-                smsr_linewidth_nm, smsr_db = self.osa.measure_smsr()
-                linewidth_3db_nm = self.osa.measure_linewidth(3)
-                linewidth_20db_nm = self.osa.measure_linewidth(20)
-            else:
-                smsr_linewidth_nm, smsr_db = np.nan, np.nan
-                linewidth_3db_nm = np.nan
-                linewidth_20db_nm = np.nan
-
-            # Record the measurement
-            # self.bias_current_ma = bias_current
-            le_measurement = {
-                "light_engine_id": self.light_engine_id,
-                "channel": self.channel,
-                "date": start_date,
-                "time": start_time,
-                "Bias Current (mA)": bias_current,
-                "Voltage (V)": cathode_voltage_v,
-                "tec_pid": self.tec_pid,
-                "nominal_temp_c": self.nominal_temp_c,
-                "tec_temp_c": tec_temp_c,
-                "ambient_temp_c": ambient_temp_c,
-                "light_engine_temp_c": light_engine_temp_c,
-                "mpd_current_ma": mpd_current_ma,
-                "wavelength_nm": wavelength_nm.tolist(),
-                "power_dbm": power_dbm.tolist(),
-                "power_uw": power_uw.tolist(),
-                "wavelength_peak_nm": peak_wavelength_nm,
-                "power_peak_dbm": peak_power_dbm,
-                "smsr_db": smsr_db,
-                "smsr_linewidth_nm": smsr_linewidth_nm,
-                "linewidth_3db_nm": linewidth_3db_nm,
-                "linewidth_20db_nm": linewidth_20db_nm,
-                # "sweep_type": "full_power" if self.full_power_enable else "normal",
-            }
-            # k = i * self.n_bias_steps + j
-            self.emit("results", le_measurement)
-            self.emit("progress", 100 * j / self.iterations)
+    def sweep_channel(self):
+        """Perform the bias sweep of the current channel as its own sweep."""
+        log.info(f"Sweeping channel {self.channel}")
+
+        # Select the channel, moving the switch while the currents are set
+        switched = self.switch.set_channel_async(7 - self.channel)
+        self.set_channel_currents()
+        switched.result()
+        self.switch_channel = self.channel
+
+        # Register the sweep before recording any points, or continue the stored
+        # points of an interrupted sweep under its sweep ID
+        self.sweep_type = "full_power" if self.full_power_enable else "normal"
+        sweep, first, self.n_overlap = None, 0, 0
+        if self.resume_enable:
+            sweep, first, self.n_overlap = find_checkpoint(
+                self.engine,
+                self.writer.model,
+                self.sweep_key,
+                self.bias_current_steps,
+                self.resume_overlap,
+            )
+        if sweep is not None:
+            log.info(f"Resuming sweep {sweep.sweep_id} at bias point {first}")
+            self.sweep_ids = {self.channel: sweep.sweep_id}
+        else:
+            self.sweep_ids = {self.channel: str(uuid.uuid4())}
+        bias_currents = self.bias_current_steps[first:]
+        self.sweep_status = "running"
+        self.estimated_duration_s = estimate_time(
+            "channel_major", [self.channel], bias_currents, self.sweep_costs
+        )
+        self.duration_s = None
+        self.record_sweep()
+        start = time.monotonic()
+        self.n_points_done += first
+
+        # Perform the bias sweep, overlapping the instrument I/O of each point
+        self.osa.reset_sweep_statistics()
+        with SweepExecutor() as executor:
+            executor.run(
+                bias_currents,
+                setup=("zeus", self.set_bias_current),
+                acquire={
+                    "tec": ("tec", self.read_tec_telemetry),
+                    "zeus": ("zeus", self.read_zeus_telemetry),
+                    "spectrum": ("osa", self.acquire_spectrum),
+                },
+                process=self.record_point,
+                should_stop=self.should_stop,
+            )
+        if self.should_stop():
+            log.info("User aborted the procedure.")
+            self.sweep_status = "aborted"
+        else:
+            self.sweep_status = "complete"
+        self.duration_s = time.monotonic() - start
+        self.record_sweep()
+        self.n_points_done += bias_currents.size
 
-            if self.session:
-                le_measurement["bias_current_ma"] = le_measurement.pop(
-                    "Bias Current (mA)"
-                )
-                le_measurement["voltage_v"] = le_measurement.pop("Voltage (V)")
-                db_row = LightEngineMeasurement(**le_measurement)
-                self.session.add(db_row)
-                self.session.commit()
+        log.info(f"OSA sweep statistics: {self.osa.sweep_statistics}")
 
-            if self.should_stop():
-                log.info("User aborted the procedure.")
-                break
+    def sweep_shared_bias(self, order, channels):
+        """Sweep all channels at a shared bias, visiting every channel per bias.
 
-        if not self.should_stop():
-            self.measurement_successful = True
+        Every channel still gets its own sweep header and rows; the sweeps are
+        recorded as "shared_bias" since all channels are lit during them.
+        """
+        self.sweep_ids = {channel: str(uuid.uuid4()) for channel in channels}
+        self.sweep_type = "shared_bias"
+        self.n_overlap = 0
+        self.sweep_status = "running"
+        self.estimated_duration_s = estimate_time(
+            order, channels, self.bias_current_steps, self.sweep_costs
+        )
+        self.duration_s = None
+        self.record_sweep()
+        start = time.monotonic()
+
+        self.shared_bias = None
+        self.osa.reset_sweep_statistics()
+        with SweepExecutor() as executor:
+            executor.run(
+                sweep_steps(order, channels, self.bias_current_steps),
+                setup=("zeus", lambda point: self.set_shared_point(point, channels)),
+                acquire={
+                    "tec": ("tec", lambda point: self.read_tec_telemetry(point[1])),
+                    "zeus": ("zeus", self.read_shared_telemetry),
+                    "spectrum": ("osa", lambda point: self.acquire_spectrum(point[1])),
+                },
+                process=lambda j, point, results: self.record_point(
+                    j, point[1], results, channel=point[0]
+                ),
+                should_stop=self.should_stop,
+            )
+        if self.should_stop():
+            log.info("User aborted the procedure.")
+            self.sweep_status = "aborted"
+        else:
+            self.sweep_status = "complete"
+        self.duration_s = time.monotonic() - start
+        self.record_sweep()
+
+        log.info(f"OSA sweep statistics: {self.osa.sweep_statistics}")
+
+    def set_shared_point(self, point, channels):
+        """Set all channels to the bias of a point and switch to its channel."""
+        channel, bias_current = point
+        switched = None
+        if channel != self.switch_channel:
+            switched = self.switch.set_channel_async(7 - channel)
+        if bias_current != self.shared_bias:
+            log.debug(f"Setting all channels to {bias_current}mA")
+            self.zeus.set_laser_currents({c: bias_current for c in channels})
+            self.shared_bias = bias_current
+            self.shared_snapshot = None
+        if switched is not None:
+            switched.result()
+            self.switch_channel = channel
+
+    def read_shared_telemetry(self, point):
+        """Read the Zeus telemetry once per shared bias."""
+        if self.shared_snapshot is None:
+            self.shared_snapshot = self.zeus.snapshot()
+        return self.channel_telemetry(self.shared_snapshot, point[0])
+
+    def set_channel_currents(self):
+        """Set the other channels for the sweep of the current channel.
+
+        If full power sweep is enabled, all channels except the target
+        measurement channel are set to maximum bias, otherwise all are off.
+        """
+        if self.full_power_enable:
+            full_power_bias = 500
+            currents = {i: full_power_bias for i in range(8)}
+            currents[self.channel] = 0
+            self.zeus.set_laser_currents(currents)
+            log.info(f"Set all channels except {self.channel} to {full_power_bias}mA")
+        else:
+            self.zeus.set_laser_currents({i: 0 for i in range(8)})
+            log.debug("Set all channels to 0mA")
 
     def shutdown(self):
         """Execute the shutdown procedure.
 
-        Disable light engine and TEC and disconnect from all instruments.
+        Disable light engine and TEC. The instrument sessions stay open in the
+        instrument pool for the next procedure.
         """
         # Disable light engine
         if self.zeus:
-            for i in range(8):
-                log.info(f"Disabling light engine channel {i}")
-                query_string = f"light_engine.set_laser_ma(LEChannel.LE{i},0)"
-                self.zeus.write_read(query_string)
-            self.zeus.write_read("fan.set_le_duty_cycle(90)")
-            self.zeus.close()
-
-        # Disable TEC
-        if self.tec:
+            log.info("Disabling all light engine channels")
+            self.zeus.set_laser_currents({i: 0 for i in range(8)})
+
+        # Disable TEC, unless the next experiment of a planned sequence uses it
+        if self.tec_monitor:
+            self.tec_monitor.stop()
+        if self.tec and not (self.tec_hold and self.measurement_successful):
             self.tec.set_temperature(25)
             self.tec.set_output_off()
+            instrument_pool.forget("arroyo_tec.setpoint")
             # self.tec.close()
 
-        # Disconnect from optical switch (labjack)
-        if self.switch:
-            self.switch.reset()
-            self.switch.close()
-
         # Disconnect from OSA and SMU
         # if self.osa:
         #     self.osa.close()
         # if self.smu:
         #     self.smu.close()
 
-        # Disconnect from the database
-        if self.session:
-            self.session.close()
+        # Flush the remaining measurements to the database; a failed writer raises
+        # RuntimeError, the other one is still closed
+        try:
+            if self.sweep_status == "running":
+                self.sweep_status = "failed"
+                self.record_sweep()
+        except RuntimeError as e:
+            log.error(e)
+        for writer in (self.sweep_writer, self.writer):
+            if writer:
+                try:
+                    writer.close()
+                except RuntimeError as e:
+                    log.error(e)
 
         # Parent shutdown procedure
         super().shutdown()
@@ -458,55 +614,254 @@ class TFCArrayCharacterization(Procedure):
         """Number of current bias step points."""
         return self.bias_current_steps.size
 
+    @property
+    def measurement_channels(self) -> list:
+        """Channels measured by this procedure."""
+        if not self.multi_channel_enable:
+            return [self.channel]
+        channels = [int(c) for c in str(self.channels).split(",") if c.strip()]
+        if not channels or not all(0 <= c <= 7 for c in channels):
+            raise ValueError(f"Invalid channels: {self.channels!r}")
+        return sorted(set(channels))
+
     @property
     def iterations(self) -> int:
         # return self.n_temp_steps * self.n_bias_steps
-        return self.n_bias_steps
-
-    # def get_estimates(self, sequence_length=None, sequence=None):
-
-    #     # Approximate time to measure a single sweep point (seconds)
-    #     step_time = 2.6
+        return self.n_bias_steps * len(self.measurement_channels)
+
+    def get_estimates(self, sequence=None):
+        """Estimate the duration of the run, or of the planned sequence."""
+        base = {"nominal_temp_c": self.nominal_temp_c}
+        entries = [{**base, **entry} for entry in sequence_parameters(sequence or [])]
+        start_temp = instrument_pool.setting("arroyo_tec.setpoint", ambient_temp_c)
+        plan = plan_sequence(entries or [base], start_temp)
+        order, sweep_time = self.choose_sweep_order(self.measurement_channels)
+        duration, n_transitions = estimate_duration(
+            plan,
+            self.iterations,
+            self.temp_settling_time,
+            start_temp,
+            point_time=sweep_time / self.iterations,
+        )
+        finished = datetime.now() + timedelta(seconds=duration)
+        return [
+            ("Duration", str(timedelta(seconds=int(duration)))),
+            ("Number of lines", "%d" % int(self.iterations)),
+            ("Sequence length", str(len(plan))),
+            ("Temperature changes", str(n_transitions)),
+            ("Sweep order", order),
+            ("Measurement finished at", finished.strftime("%Y-%m-%d %H:%M:%S")),
+        ]
+
+    def set_bias_current(self, bias_current):
+        """Set the bias current of the measurement channel."""
+        log.debug(f"Setting bias current to {bias_current}mA")
+        self.zeus.set_laser_currents({self.channel: bias_current})
+
+    def read_tec_telemetry(self, bias_current):
+        """Read the TEC temperature."""
+        return {"tec_temp_c": self.tec_monitor.read()}
+
+    def read_zeus_telemetry(self, bias_current):
+        """Read the temperatures, voltages, and currents from the Zeus board."""
+        # All channels are read in one round trip, so that the crosstalk and
+        # thermal load on the other channels are recorded with every point
+        return self.channel_telemetry(self.zeus.snapshot(), self.channel)
+
+    def channel_telemetry(self, snapshot, channel):
+        """Get the telemetry of a channel from a Zeus snapshot."""
+        # cathode_voltage_v = self.read_voltage()
+        cathode_voltage_v = 2 - snapshot["voltage_v"][channel]
+        return {
+            "voltage_v": cathode_voltage_v,
+            "ambient_temp_c": float(snapshot["ambient_temp_c"]),
+            "light_engine_temp_c": float(snapshot["light_engine_temp_c"]),
+            "mpd_current_ma": float(snapshot["mpd_current_ma"][channel]),
+            "channel_mpd_currents_ma": snapshot["mpd_current_ma"].tolist(),
+            "channel_voltages_v": snapshot["voltage_v"].tolist(),
+        }
+
+    def acquire_spectrum(self, bias_current):
+        """Trigger a single OSA sweep and retrieve the result."""
+        self.osa.single_sweep()
+        wavelength_nm, power_dbm = self.osa.read_memory()
+        spectrum = {
+            "wavelength_nm": np.array(wavelength_nm),
+            "power_dbm": np.array(power_dbm),
+        }
+
+        # The OSA analysis has to run before the next sweep replaces the trace
+        if not self.host_analysis:
+            spectrum["analysis"] = self.measure_osa_analysis()
+        return spectrum
 
-    #     duration = self.iterations * step_time * sequence_length
+    @property
+    def sweep_key(self):
+        """Experiment identity under which an interrupted sweep is continued."""
+        return {
+            "procedure": type(self).__name__,
+            "light_engine_id": self.light_engine_id,
+            "channel": self.channel,
+            "nominal_temp_c": self.nominal_temp_c,
+            "sweep_type": self.sweep_type,
+        }
+
+    def record_sweep(self):
+        """Queue the sweep headers with the current sweep status."""
+        for channel, sweep_id in self.sweep_ids.items():
+            self.record_channel_sweep(channel, sweep_id)
+
+    def record_channel_sweep(self, channel, sweep_id):
+        """Queue the sweep header of one channel."""
+        self.sweep_writer.put(
+            {
+                "sweep_id": sweep_id,
+                "procedure": type(self).__name__,
+                "light_engine_id": str(self.light_engine_id),
+                "channel": channel,
+                "date": self.measurement_date,
+                "time": self.measurement_time,
+                "nominal_temp_c": self.nominal_temp_c,
+                "sweep_type": self.sweep_type,
+                "sweep_order": self.order,
+                "status": self.sweep_status,
+                "n_points_expected": self.n_bias_steps,
+                "bias_currents_ma": self.bias_current_steps.tolist(),
+                "tec_pid": self.tec_pid,
+                "settling_time_s": self.settling["time_s"],
+                "settling_temp_c": self.settling["temp_c"],
+                "settling_duration_s": self.settling["duration_s"],
+                "estimated_duration_s": self.estimated_duration_s,
+                "duration_s": self.duration_s,
+                "switch_channel": 7 - channel,
+                "power_corr_db": None,
+                "wavelength_start_nm": self.wavelength_start,
+                "wavelength_stop_nm": self.wavelength_stop,
+                "wavelength_points": self.wavelength_points,
+                "wavelength_resolution_nm": self.wavelength_resolution,
+                "resolution_vbw": self.resolution_vbw,
+            }
+        )
 
-    #     estimates = [
-    #         ("Duration", "%d s" % int(duration)),
-    #         ("Number of lines", "%d" % int(self.iterations)),
-    #         ("Sequence length", str(sequence_length)),
-    #         (
-    #             "Measurement finished at",
-    #             str(datetime.now() + timedelta(seconds=duration)),
-    #         ),
-    #     ]
+    def record_point(self, j, bias_current, results, channel=None):
+        """Analyze and record a single bias point of a channel (default current)."""
+        channel = self.channel if channel is None else channel
+        tec, zeus, spectrum = results["tec"], results["zeus"], results["spectrum"]
+        wavelength_nm = spectrum["wavelength_nm"]
+        power_dbm = spectrum["power_dbm"]
+        power_uw = 10 ** (power_dbm / 10) * 1000
+
+        if self.host_analysis:
+            # Analyze the downloaded trace instead of querying the OSA
+            analysis = analyze_spectrum(wavelength_nm, power_dbm)
+            peak_wavelength_nm = analysis["wavelength_peak_nm"]
+            peak_power_dbm = analysis["power_peak_dbm"]
+            smsr_linewidth_nm = analysis["smsr_linewidth_nm"]
+            smsr_db = analysis["smsr_db"]
+            linewidth_3db_nm = analysis["linewidth_3db_nm"]
+            linewidth_20db_nm = analysis["linewidth_20db_nm"]
+            log.debug(f"Peak wavelength: {peak_wavelength_nm}nm, {peak_power_dbm}dBm")
+        else:
+            (
+                peak_wavelength_nm,
+                peak_power_dbm,
+                smsr_linewidth_nm,
+                smsr_db,
+                linewidth_3db_nm,
+                linewidth_20db_nm,
+            ) = spectrum["analysis"]
+
+        # Record the measurement
+        le_measurement = {
+            "light_engine_id": self.light_engine_id,
+            "channel": channel,
+            "date": self.measurement_date,
+            "time": self.measurement_time,
+            "Bias Current (mA)": bias_current,
+            "Voltage (V)": zeus["voltage_v"],
+            "tec_pid": self.tec_pid,
+            "nominal_temp_c": self.nominal_temp_c,
+            "tec_temp_c": tec["tec_temp_c"],
+            "ambient_temp_c": zeus["ambient_temp_c"],
+            "light_engine_temp_c": zeus["light_engine_temp_c"],
+            "mpd_current_ma": zeus["mpd_current_ma"],
+            "channel_mpd_currents_ma": zeus["channel_mpd_currents_ma"],
+            "channel_voltages_v": zeus["channel_voltages_v"],
+            "wavelength_nm": wavelength_nm.tolist(),
+            "power_dbm": power_dbm.tolist(),
+            "power_uw": power_uw.tolist(),
+            "wavelength_peak_nm": peak_wavelength_nm,
+            "power_peak_dbm": peak_power_dbm,
+            "smsr_db": smsr_db,
+            "smsr_linewidth_nm": smsr_linewidth_nm,
+            "linewidth_3db_nm": linewidth_3db_nm,
+            "linewidth_20db_nm": linewidth_20db_nm,
+            # "sweep_type": "full_power" if self.full_power_enable else "normal",
+        }
+        self.emit("results", le_measurement)
+        self.emit("progress", 100 * (self.n_points_done + j) / self.iterations)
+
+        db_row = dict(le_measurement)
+        db_row["bias_current_ma"] = db_row.pop("Bias Current (mA)")
+        db_row["voltage_v"] = db_row.pop("Voltage (V)")
+        db_row["sweep_id"] = self.sweep_ids[channel]
+        db_row["overlap"] = j < self.n_overlap
+        if self.compact_storage:
+            compact_row(db_row)
+        self.writer.put(db_row)
+
+    def measure_osa_analysis(self):
+        """Measure the spectral peak, SMSR and linewidths with the OSA analysis functions.
+
+        Returns (peak_wavelength_nm, peak_power_dbm, smsr_linewidth_nm, smsr_db,
+        linewidth_3db_nm, linewidth_20db_nm).
+        """
+        # Get the spectral peak (wavelength, power)
+        osa_peak = self.osa.measure_peak()
+        peak_wavelength_nm = osa_peak[0]
+        peak_power_dbm = osa_peak[1]
+        log.debug(f"Peak wavelength: {peak_wavelength_nm}nm, {peak_power_dbm}dBm")
+
+        # If the peak power is greater than -30dBm, also measure the SMSR and linewidth
+        if peak_power_dbm > -30:
+            smsr_linewidth_nm, smsr_db = self.osa.measure_smsr()
+            linewidth_3db_nm = self.osa.measure_linewidth(3)
+            linewidth_20db_nm = self.osa.measure_linewidth(20)
+        else:
+            smsr_linewidth_nm, smsr_db = np.nan, np.nan
+            linewidth_3db_nm = np.nan
+            linewidth_20db_nm = np.nan
+
+        return (
+            peak_wavelength_nm,
+            peak_power_dbm,
+            smsr_linewidth_nm,
+            smsr_db,
+            linewidth_3db_nm,
+            linewidth_20db_nm,
+        )
 
-    #     return estimates
+    def set_tec_setpoint(self):
+        """Set the TEC to the nominal temperature and enable its output."""
+        with self.tec_monitor.lock:
+            self.tec.set_temperature(self.nominal_temp_c)
+            self.tec.set_output_on()
 
-    def wait_for_tec(self, target_temp, t_settle, t_sleep=0.5, n=600, tol=0.1):
-        """Wait for the TEC to reach the target temperature, then let it settle for the specified amount of time.
+    def wait_for_tec(self, target_temp, t_settle, timeout=300, tol=0.1):
+        """Wait for the TEC to reach the target temperature and settle.
 
-        Raises RuntimeError if the target temp is not reached in the specified time period (default 5min).
+        The wait ends as soon as the monitored temperature is flat inside the
+        tolerance band, and at most t_settle seconds after the band is reached.
+        Raises RuntimeError if the target temp is not reached within timeout.
+        Returns the settling trace (see TECMonitor.wait_settled).
         """
-        success = False
-        count = 0
-        for _ in range(n):
-            tec_temp = self.tec.get_temperature()
-            if tec_temp > target_temp - tol and tec_temp < target_temp + tol:
-                success = True
-                count += 1
-                if count >= 10:
-                    break
-            elif self.should_stop():
-                break
-            else:
-                count = 0
-            time.sleep(t_sleep)
-
-        if success:
-            log.info(f"Target temperature reached, settling for {t_settle}s")
-            time.sleep(t_settle)
-        else:
-            raise RuntimeError("Could not reach target TEC temperature.")
+        return self.tec_monitor.wait_settled(
+            target_temp,
+            tol=tol,
+            timeout=timeout,
+            max_settle_time=t_settle,
+            should_stop=self.should_stop,
+        )
 
     def read_voltage(self):
         """Quickfix function to implement the SMU read voltage procedure."""
@@ -524,53 +879,4 @@ class TFCArrayCharacterization(Procedure):
 
 
 if __name__ == "__main__":
-    rm = visa.ResourceManager()
-    resources = rm.list_resources()
-    instruments = {}
-    for resource in resources:
-        try:
-            res = rm.open_resource(resource)
-            print(res)
-            res.write_termination = "\n"
-            res.baud_rate = 38400
-            resource_id = res.query("*IDN?")
-            print(resource_id)
-            if "anritsu" in resource_id.lower():
-                instruments["anritsu"] = resource
-            elif "arroyo" in resource_id.lower():
-                instruments["arroyo"] = resource
-            elif "keithley" in resource_id.lower():
-                instruments["keithley"] = resource
-        except Exception as e:
-            continue
-
-    print(instruments)
-
-    # Testing optical switch. Iterate through each channel and toggle the power on
-    # and off to verify transmssion
-    osa = AnritsuMS9740B(instruments["anritsu"])
-    zeus = ZeusController()
-    switch = OpticalSwitch()
-    switch.open()
-    switch.reset()
-    switch.configure()
-    zeus.open_session("pynq1")
-
-    for j in range(8):
-        zeus.write_read(f"light_engine.set_laser_ma(LEChannel.LE{j},0)")
-
-    time.sleep(3)
-    for j in range(8):
-        print(f"Channel {j}")
-        zeus.write_read(f"light_engine.set_laser_ma(LEChannel.LE{j},400)")
-        switch.set_channel(j)
-        time.sleep(0.5)
-        print("reading done voltage")
-        osa.single_sweep()
-        time.sleep(0.5)
-        readback = osa.measure_peak()
-        print(readback)
-        zeus.write_read(f"light_engine.set_laser_ma(LEChannel.LE{j},0)")
-        print()
-
-    switch.close()
+    print(detect_instruments(refresh=True))
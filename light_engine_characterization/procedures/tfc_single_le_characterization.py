@@ -1,10 +1,10 @@
 import logging
 import time
+import uuid
 from datetime import datetime, timedelta
 
 import numpy as np
 import pymsteams
-import pyvisa as visa
 from pymeasure.experiment import (
     BooleanParameter,
     FloatParameter,
@@ -14,16 +14,35 @@ from pymeasure.experiment import (
     Parameter,
     Procedure,
 )
-from sqlalchemy import create_engine, inspect
+import sqlalchemy as sa
+from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 
-from light_engine_characterization.instruments.anritsu import AnritsuMS9740B
-from light_engine_characterization.instruments.arroyo import TECSource5240, LDDSource7144
+from light_engine_characterization.analysis import analyze_spectrum
+from light_engine_characterization.instruments.arroyo import LIVSweepError
+from light_engine_characterization.instruments.pool import instrument_pool
+from light_engine_characterization.instruments.tec_monitor import TECMonitor
 from light_engine_characterization.tables import (
+    LIVMeasurement,
     TFCMeasurement,
+    TFCMeasurementCompact,
+    MeasurementWriter,
+    Sweep,
+    compact_row,
     database_address,
 )
 
+from .adaptive_grid import coarse_grid, default_tolerances, refine_points
+from .checkpoint import find_checkpoint
+from .sequence_planner import (
+    ambient_temp_c,
+    estimate_duration,
+    plan_sequence,
+    point_time,
+    sequence_parameters,
+)
+from .sweep_executor import SweepExecutor
+
 teams_address = (
     "https://celestialai.webhook.office.com/webhookb2/"
     "8cb3d0ed-2d5f-4852-b21f-451dc3552a65@1f01dda0-08ff-4642-9764-7ebe444cecb7/"
@@ -42,31 +61,6 @@ data_columns = list(
 data_columns = list(map(lambda x: x.replace("voltage_v", "Voltage (V)"), data_columns))
 
 
-def detect_instruments():
-    rm = visa.ResourceManager()
-    resources = rm.list_resources()
-    instruments = {}
-    for resource in resources:
-        try:
-            res = rm.open_resource(resource)
-            res.write_termination = "\n"
-            res.baud_rate = 38400
-            resource_id = res.query("*IDN?")
-            if "anritsu" in resource_id.lower():
-                instruments["anritsu"] = resource
-            elif "arroyo" in resource_id.lower():
-                if "7144" in resource_id.lower():
-                    instruments["arroyo_ldd"] = resource
-                elif "5240" in resource_id.lower():
-                    instruments["arroyo_tec"] = resource
-            elif "keithley" in resource_id.lower():
-                instruments["keithley"] = resource
-        except Exception as e:
-            continue
-
-    return instruments
-
-
 class TFCCharacterization(Procedure):
     """Procedure for characterizing Molex Light Engines over temperature and bias current."""
 
@@ -80,6 +74,8 @@ class TFCCharacterization(Procedure):
     temp_settling_time = IntegerParameter(
         "Temperature Settling Time", units="s", default=30
     )
+    # Set by the sequence planner for all but the last experiment of a sequence
+    tec_hold = BooleanParameter("Keep TEC On", default=False)
 
     # Current bias sweep settings
     bias_start = FloatParameter(
@@ -94,6 +90,34 @@ class TFCCharacterization(Procedure):
     coarse_step = FloatParameter(
         "Coarse Bias Current Step", group_by="coarse_enable", units="mA", default=20
     )
+    # Adaptive sampling: sweep a coarse grid, then refine it down to the bias step
+    # where the curves change sharply, up to the point budget
+    adaptive_enable = BooleanParameter("Adaptive Bias Grid", default=False)
+    adaptive_step = FloatParameter(
+        "Adaptive Initial Step", group_by="adaptive_enable", units="mA", default=20
+    )
+    adaptive_budget = IntegerParameter(
+        "Adaptive Point Budget", group_by="adaptive_enable", default=150
+    )
+    # Continue the refinement of an earlier adaptive sweep
+    resume_sweep_id = Parameter(
+        "Resume Sweep ID", group_by="adaptive_enable", default=""
+    )
+
+    # Continue an interrupted sweep of the same experiment from its stored points
+    resume_enable = BooleanParameter("Resume Interrupted Sweep", default=True)
+    resume_overlap = IntegerParameter(
+        "Resume Overlap Points", group_by="resume_enable", minimum=0, default=2
+    )
+
+    # Measure only the L-I-V curve over the bias points, without spectra
+    liv_enable = BooleanParameter("LIV Sweep Only", default=False)
+
+    # Approximate duration of an LIV step (one LDD exchange) [s]
+    liv_point_time = 0.05
+
+    # Deviations from linearity that trigger an adaptive refinement
+    adaptive_tolerances = default_tolerances
 
     # OSA configuration settings
     wavelength_start = 1565
@@ -102,6 +126,12 @@ class TFCCharacterization(Procedure):
     wavelength_resolution = 0.03
     resolution_vbw = "1kHz"
 
+    # Analyze spectra on the host rather than with the OSA analysis functions
+    host_analysis = True
+
+    # Store spectra in the compact binary table layout
+    compact_storage = False
+
     # Measurement metadata
     # TODO: Metadata does not seem to be fully supported yet
     # measurement_date = Metadata("Date", fget=lambda: datetime.now().strftime(r"%Y%m%d"))
@@ -133,9 +163,12 @@ class TFCCharacterization(Procedure):
         self.ldd = None
         self.osa = None
         self.engine = None
-        self.session = None
+        self.writer = None
+        self.sweep_writer = None
 
         self.tec_pid = None
+        self.tec_monitor = None
+        self.settling = None
 
         # Evaluate metadata
         self.measurement_date = None
@@ -143,6 +176,13 @@ class TFCCharacterization(Procedure):
         log.debug("Light engine characterization procedure initialized.")
 
         self.measurement_successful = False
+        self.sweep_id = None
+        self.sweep_status = None
+
+        # Spectral metrics of the measured bias points, for the adaptive grid
+        self.measured = {}
+        self.n_points_done = 0
+        self.n_overlap = 0
 
     def startup(self):
         """Measurement startup procedure.
@@ -154,23 +194,30 @@ class TFCCharacterization(Procedure):
         n_retry = 0
         while True:
             try:
-                instruments = detect_instruments()
-
-                self.tec = TECSource5240(instruments["arroyo_tec"])
+                # Instrument sessions are kept open between procedures by the pool
+                self.tec = instrument_pool.tec()
                 self.tec_pid = self.tec.pid_params
                 log.debug("Connected to TEC.")
 
-                self.ldd = LDDSource7144(instruments["arroyo_ldd"])
+                self.ldd = instrument_pool.ldd()
                 log.debug("Connected to LDD.")
 
-                # Configure the OSA parameters
-                self.osa = AnritsuMS9740B(instruments["anritsu"])
-                self.osa.wavelength_start = self.wavelength_start
-                self.osa.wavelength_stop = self.wavelength_stop
-                self.osa.sampling_points = self.wavelength_points
-                self.osa.resolution = self.wavelength_resolution
-                self.osa.resolution_vbw = self.resolution_vbw
-                log.debug("Connected to OSA.")
+                # Configure the OSA parameters, LIV sweeps do not use the OSA
+                if not self.liv_enable:
+                    self.osa = instrument_pool.osa()
+                    sweep_settings = (
+                        self.wavelength_start,
+                        self.wavelength_stop,
+                        self.wavelength_points,
+                        self.wavelength_resolution,
+                        self.resolution_vbw,
+                    )
+                    instrument_pool.configure(
+                        "anritsu.sweep",
+                        sweep_settings,
+                        lambda: self.osa.configure_sweep(*sweep_settings),
+                    )
+                    log.debug("Connected to OSA.")
                 break
             except:
                 # If we can't connect, wait 5sec and then retry
@@ -182,28 +229,43 @@ class TFCCharacterization(Procedure):
                 else:
                     raise RuntimeError("failed to connect to instruments")
 
+        # Sample the TEC temperature in the background for the settling detection
+        self.tec_monitor = TECMonitor(self.tec)
+        self.tec_monitor.start()
+
         # Attempt to connect to the database
+        if self.liv_enable:
+            table = LIVMeasurement
+        elif self.compact_storage:
+            table = TFCMeasurementCompact
+        else:
+            table = TFCMeasurement
         try:
             self.engine = create_engine(database_address)
-            self.session = Session(self.engine)
-            self.session.begin()
-            log.debug("Connected to database.")
 
-            # Create the table if it does not exist
-            if not inspect(self.engine).has_table(
-                TFCMeasurement.__tablename__,
-                schema=TFCMeasurement.__table_args__["schema"],
-            ):
-                try:
-                    TFCMeasurement.__table__.create(self.engine)
-                except Exception as e:
-                    log.error(e)
+            # Create the tables if they do not exist
+            Sweep.metadata.create_all(
+                self.engine, tables=[Sweep.__table__, table.__table__]
+            )
+            log.debug("Connected to database.")
         except Exception as e:
             log.error(e)
             log.warning(
-                "Could not connect to database, data will only be saved locally."
+                "Could not connect to database, data will be spooled locally."
             )
-            self.session = None
+            self.engine = None
+
+        # Start the database writers and replay any rows spooled by earlier runs,
+        # sweep headers first since the points reference them
+        self.sweep_writer = MeasurementWriter(
+            self.engine, Sweep, batch_size=1, upsert_key="sweep_id"
+        )
+        self.writer = MeasurementWriter(self.engine, table)
+        try:
+            self.sweep_writer.replay_spool()
+            self.writer.replay_spool()
+        except Exception as e:
+            log.error(f"Could not replay spooled measurements: {e}")
 
         log.info("Measurement startup complete.")
 
@@ -211,11 +273,17 @@ class TFCCharacterization(Procedure):
         """Execute the light engine characterization procedure."""
         log.info(f"Starting bias sweep at {self.nominal_temp_c}degC")
 
-        # Set the temperature and wait for it to settle
-        self.tec.set_temperature(self.nominal_temp_c)
-        self.tec.set_output_on()
-        log.debug(f"Waiting {self.temp_settling_time}s for TEC to settle.")
-        self.wait_for_tec(self.nominal_temp_c, self.temp_settling_time)
+        # Set the temperature and wait for it to settle. Within a planned sequence
+        # the TEC stays on, so the settling is skipped if the setpoint is unchanged.
+        if instrument_pool.configure(
+            "arroyo_tec.setpoint", self.nominal_temp_c, self.set_tec_setpoint
+        ):
+            log.debug(f"Waiting up to {self.temp_settling_time}s for TEC to settle.")
+            t_settle = self.temp_settling_time
+        else:
+            log.info(f"TEC already at {self.nominal_temp_c}degC, skipping settling.")
+            t_settle = 0
+        self.settling = self.wait_for_tec(self.nominal_temp_c, t_settle)
         if self.should_stop():
             log.info("User aborted the procedure.")
             return None
@@ -224,98 +292,49 @@ class TFCCharacterization(Procedure):
         self.ldd.channel = 1
         self.ldd.current = 0
         self.ldd.output_enabled = True
-        while not self.ldd.completed:
-            time.sleep(0.1)
-
-        # Perform the bias sweep
-        for j, bias_current in enumerate(self.bias_current_steps):
-            start_date = self.measurement_date
-            start_time = self.measurement_time
-
-            # Set the light engine channel and bias current
-            log.debug(f"Setting bias current to {bias_current}mA")
-            self.ldd.set_current(bias_current)
-            while True:
-                try:
-                    current_ma = float(self.ldd.current)
-                    break
-                except:
-                    continue
-
-            while True:
-                try:
-                    voltage_v = float(self.ldd.voltage)
-                    break
-                except:
-                    continue
-
-            # Read the TEC temperature
-            tec_temp_c = self.tec.get_temperature()
-
-            # Trigger a single OSA sweep and retrieve the result
-            sweep_successful = False
-            while not sweep_successful:
-                try:
-                    self.osa.single_sweep()
-                    sweep_successful = True
-                except RuntimeWarning:
-                    log.warning("Sweep timed out, re-running sweep")
-
-            wavelength_nm, power_dbm = self.osa.read_memory()
-            wavelength_nm = np.array(wavelength_nm)
-            power_dbm = np.array(power_dbm)
-
-            # Get the spectral peak (wavelength, power)
-            osa_peak = self.osa.measure_peak()
-            peak_wavelength_nm = osa_peak[0]
-            peak_power_dbm = osa_peak[1]
-            log.debug(f"Peak wavelength: {peak_wavelength_nm}nm, {peak_power_dbm}dBm")
-
-            # If the peak power is greater than -30dBm, also measure the SMSR and linewidth
-            if peak_power_dbm > -30:
-                smsr_linewidth_nm, smsr_db = self.osa.measure_smsr()
-                linewidth_3db_nm = self.osa.measure_linewidth(3)
-                linewidth_20db_nm = self.osa.measure_linewidth(20)
-            else:
-                smsr_linewidth_nm, smsr_db = np.nan, np.nan
-                linewidth_3db_nm = np.nan
-                linewidth_20db_nm = np.nan
-
-            # Record the measurement
-            le_measurement = {
-                "light_engine_id": self.light_engine_id,
-                "date": start_date,
-                "time": start_time,
-                "Bias Current (mA)": current_ma,
-                "Voltage (V)": voltage_v,
-                "tec_pid": self.tec_pid,
-                "nominal_temp_c": self.nominal_temp_c,
-                "tec_temp_c": tec_temp_c,
-                "wavelength_nm": wavelength_nm.tolist(),
-                "power_dbm": power_dbm.tolist(),
-                "wavelength_peak_nm": peak_wavelength_nm,
-                "power_peak_dbm": peak_power_dbm,
-                "smsr_db": smsr_db,
-                "smsr_linewidth_nm": smsr_linewidth_nm,
-                "linewidth_3db_nm": linewidth_3db_nm,
-                "linewidth_20db_nm": linewidth_20db_nm,
-            }
-            # k = i * self.n_bias_steps + j
-            self.emit("results", le_measurement)
-            self.emit("progress", 100 * j / self.iterations)
-
-            if self.session:
-                le_measurement["bias_current_ma"] = le_measurement.pop(
-                    "Bias Current (mA)"
+        self.ldd.wait_completed()
+
+        # Register the sweep before recording any points. A resumed sweep keeps
+        # its sweep ID and continues from the points already stored: adaptive
+        # sweeps by their ID, uniform sweeps from the latest interrupted sweep of
+        # the same experiment.
+        sweep, start, self.n_overlap = None, 0, 0
+        if self.adaptive_enable and self.resume_sweep_id and not self.liv_enable:
+            self.sweep_id = str(self.resume_sweep_id)
+            self.load_measured_points()
+        else:
+            if self.resume_enable and self.sweep_type is None:
+                sweep, start, self.n_overlap = find_checkpoint(
+                    self.engine,
+                    self.writer.model,
+                    self.sweep_key,
+                    self.bias_current_steps,
+                    self.resume_overlap,
                 )
-                le_measurement["voltage_v"] = le_measurement.pop("Voltage (V)")
-                db_row = TFCMeasurement(**le_measurement)
-                self.session.add(db_row)
-                self.session.commit()
+            if sweep is not None:
+                log.info(f"Resuming sweep {sweep.sweep_id} at bias point {start}")
+                self.sweep_id = sweep.sweep_id
+            else:
+                self.sweep_id = str(uuid.uuid4())
+            self.n_points_done = start
+        self.sweep_status = "running"
+        self.record_sweep()
 
-            if self.should_stop():
-                log.info("User aborted the procedure.")
-                break
+        if self.liv_enable:
+            self.sweep_liv()
+        else:
+            self.osa.reset_sweep_statistics()
+            if self.adaptive_enable:
+                self.sweep_adaptive()
+            else:
+                self.sweep_points(self.bias_current_steps[start:])
+            log.info(f"OSA sweep statistics: {self.osa.sweep_statistics}")
+        if self.should_stop():
+            log.info("User aborted the procedure.")
+            self.sweep_status = "aborted"
+        else:
+            self.sweep_status = "complete"
+        self.record_sweep()
 
         if not self.should_stop():
             self.measurement_successful = True
@@ -323,7 +342,8 @@ class TFCCharacterization(Procedure):
     def shutdown(self):
         """Execute the shutdown procedure.
 
-        Disable light engine and TEC and disconnect from all instruments.
+        Disable light engine and TEC. The instrument sessions stay open in the
+        instrument pool for the next procedure.
         """
         # Disable LDD
         if self.ldd:
@@ -331,14 +351,28 @@ class TFCCharacterization(Procedure):
             self.ldd.current = 0
             self.ldd.output_enabled = False
 
-        # Disable TEC
-        if self.tec:
+        # Disable TEC, unless the next experiment of a planned sequence uses it
+        if self.tec_monitor:
+            self.tec_monitor.stop()
+        if self.tec and not (self.tec_hold and self.measurement_successful):
             self.tec.set_temperature(25)
             self.tec.set_output_off()
+            instrument_pool.forget("arroyo_tec.setpoint")
 
-        # Disconnect from the database
-        if self.session:
-            self.session.close()
+        # Flush the remaining measurements to the database; a failed writer raises
+        # RuntimeError, the other one is still closed
+        try:
+            if self.sweep_status == "running":
+                self.sweep_status = "failed"
+                self.record_sweep()
+        except RuntimeError as e:
+            log.error(e)
+        for writer in (self.sweep_writer, self.writer):
+            if writer:
+                try:
+                    writer.close()
+                except RuntimeError as e:
+                    log.error(e)
 
         # Parent shutdown procedure
         super().shutdown()
@@ -408,36 +442,395 @@ class TFCCharacterization(Procedure):
         """Number of current bias step points."""
         return self.bias_current_steps.size
 
+    @property
+    def n_points_expected(self) -> int:
+        """Number of bias points to measure, at most the budget if adaptive."""
+        if self.adaptive_enable:
+            return min(self.adaptive_budget, self.n_bias_steps)
+        return self.n_bias_steps
+
     @property
     def iterations(self) -> int:
         # return self.n_temp_steps * self.n_bias_steps
-        return self.n_bias_steps
+        return self.n_points_expected
+
+    def get_estimates(self, sequence=None):
+        """Estimate the duration of the run, or of the planned sequence."""
+        base = {"nominal_temp_c": self.nominal_temp_c}
+        entries = [{**base, **entry} for entry in sequence_parameters(sequence or [])]
+        start_temp = instrument_pool.setting("arroyo_tec.setpoint", ambient_temp_c)
+        plan = plan_sequence(entries or [base], start_temp)
+        duration, n_transitions = estimate_duration(
+            plan,
+            self.n_points_expected,
+            self.temp_settling_time,
+            start_temp,
+            point_time=self.liv_point_time if self.liv_enable else point_time,
+        )
+        finished = datetime.now() + timedelta(seconds=duration)
+        return [
+            ("Duration", str(timedelta(seconds=int(duration)))),
+            ("Number of lines", "%d" % int(self.iterations)),
+            ("Sequence length", str(len(plan))),
+            ("Temperature changes", str(n_transitions)),
+            ("Measurement finished at", finished.strftime("%Y-%m-%d %H:%M:%S")),
+        ]
+
+    def set_bias_current(self, bias_current):
+        """Set the LDD bias current and confirm the set point."""
+        log.debug(f"Setting bias current to {bias_current}mA")
+        current_ma, voltage_v = self.ldd.set_current(bias_current)
+        log.debug(f"LDD at {current_ma}mA, {voltage_v}V")
+
+    def read_tec_telemetry(self, bias_current):
+        """Read the TEC temperature."""
+        return {"tec_temp_c": self.tec_monitor.read()}
+
+    def read_ldd_telemetry(self, bias_current):
+        """Read back the LDD current and voltage."""
+        current_ma, voltage_v = self.ldd.measure_current_voltage()
+        return {"current_ma": current_ma, "voltage_v": voltage_v}
+
+    def acquire_spectrum(self, bias_current):
+        """Trigger a single OSA sweep and retrieve the result."""
+        self.osa.single_sweep()
+        wavelength_nm, power_dbm = self.osa.read_memory()
+        spectrum = {
+            "wavelength_nm": np.array(wavelength_nm),
+            "power_dbm": np.array(power_dbm),
+        }
+
+        # The OSA analysis has to run before the next sweep replaces the trace
+        if not self.host_analysis:
+            spectrum["analysis"] = self.measure_osa_analysis()
+        return spectrum
+
+    def sweep_points(self, bias_currents):
+        """Sweep the bias points, overlapping the instrument I/O of each point."""
+        with SweepExecutor() as executor:
+            executor.run(
+                bias_currents,
+                setup=("ldd", self.set_bias_current),
+                acquire={
+                    "tec": ("tec", self.read_tec_telemetry),
+                    "ldd": ("ldd", self.read_ldd_telemetry),
+                    "spectrum": ("osa", self.acquire_spectrum),
+                },
+                process=self.record_point,
+                should_stop=self.should_stop,
+            )
+        self.n_points_done += len(bias_currents)
 
-    def wait_for_tec(self, target_temp, t_settle, t_sleep=0.5, n=600, tol=0.1):
-        """Wait for the TEC to reach the target temperature, then let it settle for the specified amount of time.
+    def sweep_adaptive(self):
+        """Sweep a coarse grid, then refine it where the curves change sharply.
 
-        Raises RuntimeError if the target temp is not reached in the specified time period (default 5min).
+        Every round measures the points selected by refine_points() from all
+        points measured so far, until the curves are resolved to the bias step
+        or the point budget is used up.
         """
-        success = False
-        count = 0
-        for _ in range(n):
-            tec_temp = self.tec.get_temperature()
-            if tec_temp > target_temp - tol and tec_temp < target_temp + tol:
-                success = True
-                count += 1
-                if count >= 10:
-                    break
-            elif self.should_stop():
-                break
-            else:
-                count = 0
-            time.sleep(t_sleep)
+        budget = self.n_points_expected
+        points = coarse_grid(self.bias_start, self.bias_stop, self.adaptive_step)
+        points = points[~np.isin(np.round(points, 6), list(self.measured))]
+        remaining = max(budget - len(self.measured), 0)
+        if points.size > remaining:
+            # Thin the coarse grid evenly, keeping both ends
+            log.warning(
+                f"The coarse grid of {points.size} points exceeds the budget, "
+                f"measuring {remaining} of them"
+            )
+            keep = np.round(np.linspace(0, points.size - 1, remaining)).astype(int)
+            points = points[np.unique(keep)]
+
+        while points.size and not self.should_stop():
+            log.info(f"Measuring {points.size} points, {len(self.measured)} done")
+            self.sweep_points(points)
+            measured = sorted(self.measured)
+            metrics = {
+                name: [self.measured[point][name] for point in measured]
+                for name in self.adaptive_tolerances
+            }
+            points = refine_points(
+                measured,
+                metrics,
+                self.bias_step,
+                budget - len(measured),
+                self.adaptive_tolerances,
+            )
+        log.info(
+            f"Adaptive sweep measured {len(self.measured)} of {self.n_bias_steps} "
+            "bias points"
+        )
+
+    def load_measured_points(self):
+        """Load the points of the sweep to resume from the database.
+
+        The stored (measured) currents are snapped back to the bias step grid.
+        """
+        if self.engine is None:
+            raise RuntimeError("Cannot resume a sweep without a database connection.")
+        table = TFCMeasurementCompact if self.compact_storage else TFCMeasurement
+        names = list(self.adaptive_tolerances)
+        with Session(self.engine) as session:
+            rows = session.execute(
+                sa.select(
+                    table.bias_current_ma, *(getattr(table, name) for name in names)
+                ).where(table.sweep_id == self.sweep_id)
+            ).all()
+        for bias_current, *values in rows:
+            steps = round((bias_current - self.bias_start) / self.bias_step)
+            point = round(self.bias_start + steps * self.bias_step, 6)
+            self.measured[point] = {
+                name: np.nan if value is None else value
+                for name, value in zip(names, values)
+            }
+        self.n_points_done = len(self.measured)
+        log.info(f"Resuming sweep {self.sweep_id} with {len(rows)} stored points")
+
+    def sweep_liv(self):
+        """Measure the L-I-V curve over the bias points and record it as one row.
 
-        if success:
-            log.info(f"Target temperature reached, settling for {t_settle}s")
-            time.sleep(t_settle)
+        If a step is not confirmed, the steps measured so far are recorded and
+        the sweep is marked failed before the error is raised.
+        """
+        start = time.monotonic()
+        try:
+            liv = self.ldd.liv_sweep(
+                self.bias_current_steps, should_stop=self.should_stop
+            )
+        except LIVSweepError as e:
+            log.error(f"LIV sweep failed after {e.liv['current_ma'].size} steps: {e}")
+            self.record_liv(e.liv, start)
+            self.sweep_status = "failed"
+            self.record_sweep()
+            raise
+        log.info(
+            f"LIV sweep of {liv['current_ma'].size} steps took "
+            f"{time.monotonic() - start:.1f}s"
+        )
+        self.record_liv(liv, start)
+
+    def record_liv(self, liv, start):
+        """Emit and queue the L-I-V steps of a sweep started at start (monotonic)."""
+        n_steps = liv["current_ma"].size
+        if not n_steps:
+            return
+
+        # TEC temperature averaged over the sweep
+        _, temps = self.tec_monitor.trace(since=start)
+        tec_temp_c = float(np.mean(temps)) if temps.size else self.tec_monitor.read()
+
+        for j in range(n_steps):
+            self.emit(
+                "results",
+                {
+                    "light_engine_id": self.light_engine_id,
+                    "date": self.measurement_date,
+                    "time": self.measurement_time,
+                    "Bias Current (mA)": liv["current_ma"][j],
+                    "Voltage (V)": liv["voltage_v"][j],
+                    "nominal_temp_c": self.nominal_temp_c,
+                    "tec_temp_c": tec_temp_c,
+                },
+            )
+        self.emit("progress", 100 * n_steps / self.iterations)
+
+        self.writer.put(
+            {
+                "sweep_id": self.sweep_id,
+                "light_engine_id": str(self.light_engine_id),
+                "channel": None,
+                "date": self.measurement_date,
+                "time": self.measurement_time,
+                "tec_pid": self.tec_pid,
+                "nominal_temp_c": self.nominal_temp_c,
+                "tec_temp_c": tec_temp_c,
+                "bias_current_ma": liv["bias_current_ma"].tolist(),
+                "current_ma": liv["current_ma"].tolist(),
+                "voltage_v": liv["voltage_v"].tolist(),
+                "pd_current_ua": liv["pd_current_ua"].tolist(),
+                "step_time_s": liv["time_s"].tolist(),
+            }
+        )
+
+    @property
+    def sweep_type(self):
+        if self.liv_enable:
+            return "liv"
+        if self.adaptive_enable:
+            return "adaptive"
+        return None
+
+    @property
+    def sweep_points_expected(self):
+        """Number of points of the sweep header.
+
+        An adaptive sweep usually converges before its budget is used up, so a
+        complete adaptive sweep expects the points it actually measured.
+        """
+        if self.adaptive_enable and self.sweep_status == "complete":
+            return len(self.measured)
+        return self.n_points_expected
+
+    @property
+    def sweep_key(self):
+        """Experiment identity under which an interrupted sweep is continued."""
+        return {
+            "procedure": type(self).__name__,
+            "light_engine_id": self.light_engine_id,
+            "channel": None,
+            "nominal_temp_c": self.nominal_temp_c,
+            "sweep_type": self.sweep_type,
+        }
+
+    def record_sweep(self):
+        """Queue the sweep header with the current sweep status."""
+        spectral = not self.liv_enable
+        self.sweep_writer.put(
+            {
+                "sweep_id": self.sweep_id,
+                "procedure": type(self).__name__,
+                "light_engine_id": str(self.light_engine_id),
+                "channel": None,
+                "date": self.measurement_date,
+                "time": self.measurement_time,
+                "nominal_temp_c": self.nominal_temp_c,
+                "sweep_type": self.sweep_type,
+                "status": self.sweep_status,
+                "n_points_expected": self.sweep_points_expected,
+                "bias_currents_ma": (
+                    sorted(self.measured)
+                    if self.adaptive_enable
+                    else self.bias_current_steps.tolist()
+                ),
+                "tec_pid": self.tec_pid,
+                "settling_time_s": self.settling["time_s"],
+                "settling_temp_c": self.settling["temp_c"],
+                "settling_duration_s": self.settling["duration_s"],
+                "switch_channel": None,
+                "power_corr_db": None,
+                "wavelength_start_nm": self.wavelength_start if spectral else None,
+                "wavelength_stop_nm": self.wavelength_stop if spectral else None,
+                "wavelength_points": self.wavelength_points if spectral else None,
+                "wavelength_resolution_nm": (
+                    self.wavelength_resolution if spectral else None
+                ),
+                "resolution_vbw": self.resolution_vbw if spectral else None,
+            }
+        )
+
+    def record_point(self, j, bias_current, results):
+        """Analyze and record a single bias point."""
+        tec, ldd, spectrum = results["tec"], results["ldd"], results["spectrum"]
+        wavelength_nm = spectrum["wavelength_nm"]
+        power_dbm = spectrum["power_dbm"]
+
+        if self.host_analysis:
+            # Analyze the downloaded trace instead of querying the OSA
+            analysis = analyze_spectrum(wavelength_nm, power_dbm)
+            peak_wavelength_nm = analysis["wavelength_peak_nm"]
+            peak_power_dbm = analysis["power_peak_dbm"]
+            smsr_linewidth_nm = analysis["smsr_linewidth_nm"]
+            smsr_db = analysis["smsr_db"]
+            linewidth_3db_nm = analysis["linewidth_3db_nm"]
+            linewidth_20db_nm = analysis["linewidth_20db_nm"]
+            log.debug(f"Peak wavelength: {peak_wavelength_nm}nm, {peak_power_dbm}dBm")
+        else:
+            (
+                peak_wavelength_nm,
+                peak_power_dbm,
+                smsr_linewidth_nm,
+                smsr_db,
+                linewidth_3db_nm,
+                linewidth_20db_nm,
+            ) = spectrum["analysis"]
+
+        # Record the measurement
+        le_measurement = {
+            "light_engine_id": self.light_engine_id,
+            "date": self.measurement_date,
+            "time": self.measurement_time,
+            "Bias Current (mA)": ldd["current_ma"],
+            "Voltage (V)": ldd["voltage_v"],
+            "tec_pid": self.tec_pid,
+            "nominal_temp_c": self.nominal_temp_c,
+            "tec_temp_c": tec["tec_temp_c"],
+            "wavelength_nm": wavelength_nm.tolist(),
+            "power_dbm": power_dbm.tolist(),
+            "wavelength_peak_nm": peak_wavelength_nm,
+            "power_peak_dbm": peak_power_dbm,
+            "smsr_db": smsr_db,
+            "smsr_linewidth_nm": smsr_linewidth_nm,
+            "linewidth_3db_nm": linewidth_3db_nm,
+            "linewidth_20db_nm": linewidth_20db_nm,
+        }
+        self.measured[round(float(bias_current), 6)] = {
+            name: np.nan if le_measurement[name] is None else le_measurement[name]
+            for name in self.adaptive_tolerances
+        }
+        self.emit("results", le_measurement)
+        self.emit("progress", 100 * (self.n_points_done + j) / self.iterations)
+
+        db_row = dict(le_measurement)
+        db_row["bias_current_ma"] = db_row.pop("Bias Current (mA)")
+        db_row["voltage_v"] = db_row.pop("Voltage (V)")
+        db_row["sweep_id"] = self.sweep_id
+        db_row["overlap"] = j < self.n_overlap
+        if self.compact_storage:
+            compact_row(db_row)
+        self.writer.put(db_row)
+
+    def measure_osa_analysis(self):
+        """Measure the spectral peak, SMSR and linewidths with the OSA analysis functions.
+
+        Returns (peak_wavelength_nm, peak_power_dbm, smsr_linewidth_nm, smsr_db,
+        linewidth_3db_nm, linewidth_20db_nm).
+        """
+        # Get the spectral peak (wavelength, power)
+        osa_peak = self.osa.measure_peak()
+        peak_wavelength_nm = osa_peak[0]
+        peak_power_dbm = osa_peak[1]
+        log.debug(f"Peak wavelength: {peak_wavelength_nm}nm, {peak_power_dbm}dBm")
+
+        # If the peak power is greater than -30dBm, also measure the SMSR and linewidth
+        if peak_power_dbm > -30:
+            smsr_linewidth_nm, smsr_db = self.osa.measure_smsr()
+            linewidth_3db_nm = self.osa.measure_linewidth(3)
+            linewidth_20db_nm = self.osa.measure_linewidth(20)
         else:
-            raise RuntimeError("Could not reach target TEC temperature.")
+            smsr_linewidth_nm, smsr_db = np.nan, np.nan
+            linewidth_3db_nm = np.nan
+            linewidth_20db_nm = np.nan
+
+        return (
+            peak_wavelength_nm,
+            peak_power_dbm,
+            smsr_linewidth_nm,
+            smsr_db,
+            linewidth_3db_nm,
+            linewidth_20db_nm,
+        )
+
+    def set_tec_setpoint(self):
+        """Set the TEC to the nominal temperature and enable its output."""
+        with self.tec_monitor.lock:
+            self.tec.set_temperature(self.nominal_temp_c)
+            self.tec.set_output_on()
+
+    def wait_for_tec(self, target_temp, t_settle, timeout=300, tol=0.1):
+        """Wait for the TEC to reach the target temperature and settle.
+
+        The wait ends as soon as the monitored temperature is flat inside the
+        tolerance band, and at most t_settle seconds after the band is reached.
+        Raises RuntimeError if the target temp is not reached within timeout.
+        Returns the settling trace (see TECMonitor.wait_settled).
+        """
+        return self.tec_monitor.wait_settled(
+            target_temp,
+            tol=tol,
+            timeout=timeout,
+            max_settle_time=t_settle,
+            should_stop=self.should_stop,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+"""Queuing of the sequencer entries of the main windows as a planned sequence.
+
+The "Queue sequence" button of the pymeasure sequencer queues the entries in the
+order of the sequence tree. use_planned_sequence() connects it to
+queue_planned_sequence() instead, which orders the entries with
+sequence_planner.plan_sequence(), starting from the TEC setpoint the instrument
+pool tracks while the TEC is held on between experiments.
+
+    window = ManagedWindow(..., sequencer=True)
+    use_planned_sequence(window)
+"""
+
+import logging
+
+from pymeasure.display.Qt import QtWidgets
+from pymeasure.experiment.sequencer import SequenceEvaluationError
+
+from light_engine_characterization.instruments.pool import instrument_pool
+from light_engine_characterization.procedures.sequence_planner import (
+    ambient_temp_c,
+    plan_sequence,
+    sequence_parameters,
+)
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def use_planned_sequence(window):
+    """Queue the sequence of a ManagedWindow in temperature order."""
+    button = window.sequencer.queue_button
+    button.clicked.disconnect()
+    button.clicked.connect(lambda: queue_planned_sequence(window))
+
+
+def queue_planned_sequence(window):
+    """Queue the sequencer entries grouped and ordered by temperature.
+
+    The queue button is disabled while queuing, as in the sequencer itself, so
+    that a double click does not queue the sequence twice.
+    """
+    button = window.sequencer.queue_button
+    button.setEnabled(False)
+    try:
+        try:
+            sequence = window.sequencer.get_sequence()
+        except SequenceEvaluationError:
+            log.error("Could not evaluate the sequence, no sequence queued.")
+            return
+
+        base = {"nominal_temp_c": window.make_procedure().nominal_temp_c}
+        entries = [{**base, **entry} for entry in sequence_parameters(sequence)]
+        start_temp = instrument_pool.setting("arroyo_tec.setpoint", ambient_temp_c)
+        plan = plan_sequence(entries, start_temp)
+        log.info(
+            f"Queuing {len(plan)} measurements in temperature order "
+            f"from {start_temp}degC."
+        )
+        for parameters in plan:
+            QtWidgets.QApplication.processEvents()
+            procedure = window.make_procedure()
+            procedure.set_parameters(parameters)
+            window.queue(procedure=procedure)
+    finally:
+        button.setEnabled(True)
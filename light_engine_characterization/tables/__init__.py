@@ -1 +1,17 @@
 from .le_measurement import LightEngineMeasurement, database_address, TFCMeasurement
+from .compact_measurement import (
+    LightEngineMeasurementCompact,
+    SpectrumArray,
+    TFCMeasurementCompact,
+    compact_row,
+)
+from .liv_measurement import LIVMeasurement
+from .sweep import (
+    Sweep,
+    latest_sweep,
+    resumable_status,
+    resumable_sweep,
+    stored_bias_currents,
+)
+from .writer import MeasurementWriter
+from .correction_log import CorrectionLog
@@ -0,0 +1,163 @@
+"""Compact storage layout for light engine measurements.
+
+Instead of three float8 ARRAY columns per row, only the power spectrum is stored,
+as a float32 bytea column that decodes to a NumPy array without copying. The
+wavelength grid is described by its start, stop and number of points (the OSA
+grid is always linear), and the power in uW is derived on read.
+"""
+
+import zlib
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import (
+    ARRAY,
+    Date,
+    Float,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    Time,
+    Uuid,
+)
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.types import TypeDecorator
+
+from .le_measurement import Base
+
+
+class SpectrumArray(TypeDecorator):
+    """1-D NumPy array stored as raw little-endian bytes in a bytea column.
+
+    Uncompressed values are decoded with np.frombuffer, i.e. the returned array
+    is a read-only view of the buffer returned by the database driver.
+
+    dtype: NumPy dtype of the stored values
+    compress: bool, zlib-compress the stored bytes
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dtype=np.float32, compress=False):
+        super().__init__()
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.compress = compress
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        data = np.ascontiguousarray(value, dtype=self.dtype).tobytes()
+        return zlib.compress(data, 1) if self.compress else data
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if self.compress:
+            value = zlib.decompress(value)
+        return np.frombuffer(value, dtype=self.dtype)
+
+
+class CompactSpectrumMixin:
+    """Wavelength grid, spectrum and derived columns shared by compact tables."""
+
+    wavelength_start_nm: Mapped[float]
+    wavelength_stop_nm: Mapped[float]
+    wavelength_points: Mapped[int]
+    power_dbm: Mapped[np.ndarray] = mapped_column(SpectrumArray(np.float32))
+
+    @property
+    def wavelength_nm(self) -> np.ndarray:
+        """Wavelength grid of the spectrum [nm]."""
+        return np.linspace(
+            self.wavelength_start_nm, self.wavelength_stop_nm, self.wavelength_points
+        )
+
+    @property
+    def power_uw(self) -> np.ndarray:
+        """Spectrum power [uW]."""
+        return 10 ** (self.power_dbm / 10) * 1000
+
+
+class LightEngineMeasurementCompact(CompactSpectrumMixin, Base):
+    __tablename__ = "molex_compact"
+    __table_args__ = {"schema": "lightengine"}
+
+    measurement_id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True
+    )
+    sweep_id: Mapped[str | None] = mapped_column(
+        Uuid(as_uuid=False), ForeignKey("lightengine.sweep.sweep_id"), index=True
+    )
+    light_engine_id: Mapped[int] = mapped_column(Integer)
+    channel: Mapped[int] = mapped_column(Integer)
+    date: Mapped[datetime.date] = mapped_column(Date)
+    time: Mapped[datetime.time] = mapped_column(Time)
+    bias_current_ma: Mapped[float]
+    voltage_v: Mapped[float]
+    tec_pid: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    nominal_temp_c: Mapped[float]
+    tec_temp_c: Mapped[float]
+    ambient_temp_c: Mapped[float]
+    light_engine_temp_c: Mapped[float]
+    mpd_current_ma: Mapped[float]
+    # Telemetry of all 8 channels, for crosstalk and thermal load
+    channel_mpd_currents_ma: Mapped[list | None] = mapped_column(
+        ARRAY(Float), nullable=True
+    )
+    channel_voltages_v: Mapped[list | None] = mapped_column(
+        ARRAY(Float), nullable=True
+    )
+    wavelength_peak_nm: Mapped[float]
+    power_peak_dbm: Mapped[float]
+    smsr_db: Mapped[float | None]
+    smsr_linewidth_nm: Mapped[float | None]
+    linewidth_3db_nm: Mapped[float | None]
+    linewidth_20db_nm: Mapped[float | None]
+    sweep_type: Mapped[str | None]
+    # Stored point re-measured when an interrupted sweep was continued
+    overlap: Mapped[bool | None]
+
+
+class TFCMeasurementCompact(CompactSpectrumMixin, Base):
+    __tablename__ = "tfc_compact"
+    __table_args__ = {"schema": "lightengine"}
+
+    measurement_id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True
+    )
+    sweep_id: Mapped[str | None] = mapped_column(
+        Uuid(as_uuid=False), ForeignKey("lightengine.sweep.sweep_id"), index=True
+    )
+    light_engine_id: Mapped[str] = mapped_column(String)
+    date: Mapped[datetime.date] = mapped_column(Date)
+    time: Mapped[datetime.time] = mapped_column(Time)
+    bias_current_ma: Mapped[float]
+    voltage_v: Mapped[float]
+    tec_pid: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    nominal_temp_c: Mapped[float]
+    tec_temp_c: Mapped[float]
+    wavelength_peak_nm: Mapped[float]
+    power_peak_dbm: Mapped[float]
+    smsr_db: Mapped[float | None]
+    smsr_linewidth_nm: Mapped[float | None]
+    linewidth_3db_nm: Mapped[float | None]
+    linewidth_20db_nm: Mapped[float | None]
+    # Stored point re-measured when an interrupted sweep was continued
+    overlap: Mapped[bool | None]
+
+
+def compact_row(row):
+    """Convert a measurement row of the ARRAY layout to the compact layout.
+
+    The wavelength array is replaced by its grid description and power_uw is
+    dropped. The row dictionary is modified in place and returned.
+    """
+    wavelength_nm = np.asarray(row.pop("wavelength_nm"))
+    row.pop("power_uw", None)
+    row["wavelength_start_nm"] = float(wavelength_nm[0])
+    row["wavelength_stop_nm"] = float(wavelength_nm[-1])
+    row["wavelength_points"] = int(wavelength_nm.size)
+    row["power_dbm"] = np.asarray(row["power_dbm"], dtype=np.float32)
+    return row
@@ -0,0 +1,22 @@
+"""Audit log of the corrections applied to the measurement tables."""
+
+from datetime import datetime
+
+from sqlalchemy import ARRAY, DateTime, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .le_measurement import Base
+
+
+class CorrectionLog(Base):
+    __tablename__ = "correction_log"
+    __table_args__ = {"schema": "lightengine"}
+
+    log_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime)
+    table_name: Mapped[str] = mapped_column(String)
+    operation: Mapped[str] = mapped_column(String)
+    parameters: Mapped[str] = mapped_column(String)
+    filters: Mapped[str] = mapped_column(String)
+    n_rows: Mapped[int]
+    measurement_ids: Mapped[list] = mapped_column(ARRAY(Integer))
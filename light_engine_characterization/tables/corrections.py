@@ -0,0 +1,324 @@
+"""Bulk power corrections and light engine ID remaps of measurement tables.
+
+Corrections are applied as single server-side UPDATE statements: the per-channel
+offsets are joined in as a VALUES list and the ARRAY spectra are shifted in SQL.
+Spectra of the compact layout (bytea) are shifted in chunked NumPy batches.
+Every applied change is recorded in lightengine.correction_log together with the
+measurement_ids it touched. With dry_run the changes are rolled back and only
+the number of affected rows is returned.
+
+Usage:
+    python -m light_engine_characterization.tables.corrections --table molex
+        --offset 7=1.64761 --light-engine-id 2413122 --temp 75 [--dry-run]
+    python -m light_engine_characterization.tables.corrections --table molex
+        --remap 2413122=241312 --channel 7 --temp 75 [--dry-run]
+"""
+
+import argparse
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import Float, Integer, bindparam
+
+from .compact_measurement import (
+    LightEngineMeasurementCompact,
+    SpectrumArray,
+    TFCMeasurementCompact,
+)
+from .correction_log import CorrectionLog
+from .le_measurement import LightEngineMeasurement, TFCMeasurement, database_address
+from .sweep import Sweep
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+tables = {
+    model.__tablename__: model
+    for model in [
+        LightEngineMeasurement,
+        LightEngineMeasurementCompact,
+        TFCMeasurement,
+        TFCMeasurementCompact,
+    ]
+}
+
+
+def selection(
+    model,
+    light_engine_ids=None,
+    channels=None,
+    nominal_temps=None,
+    sweep_ids=None,
+    measurement_ids=None,
+):
+    """Build the WHERE clauses that select the rows to correct.
+
+    Every argument is a list of accepted values, or None to not filter on it.
+    measurement_ids is a (first, last) range instead.
+    """
+    table = model.__table__
+    clauses = []
+    if light_engine_ids is not None:
+        clauses.append(table.c.light_engine_id.in_(light_engine_ids))
+    if channels is not None:
+        clauses.append(table.c.channel.in_(channels))
+    if nominal_temps is not None:
+        clauses.append(table.c.nominal_temp_c.in_(nominal_temps))
+    if sweep_ids is not None:
+        clauses.append(table.c.sweep_id.in_(sweep_ids))
+    if measurement_ids is not None:
+        clauses.append(table.c.measurement_id.between(*measurement_ids))
+    return clauses
+
+
+def _offsets_by_channel(table, offsets_db):
+    """Normalize the offsets to a {channel: offset} dictionary.
+
+    A single offset applies to all rows and is keyed with None; it is the only
+    option for tables without a channel column.
+    """
+    if not isinstance(offsets_db, dict):
+        return {None: float(offsets_db)}
+    if "channel" not in table.c:
+        raise ValueError(f"{table.fullname} has no channel column")
+    return {int(channel): float(offset) for channel, offset in offsets_db.items()}
+
+
+def _array_expression(table, column, element):
+    """SQL expression mapping every element x of an ARRAY column, keeping the order."""
+    return sa.literal_column(
+        f"ARRAY(SELECT {element} FROM unnest({table.fullname}.{column}) "
+        f"WITH ORDINALITY AS u(x, i) ORDER BY i)"
+    )
+
+
+def apply_power_correction(connection, model, offsets_db, where=()):
+    """Add a power offset to the selected rows of a measurement table.
+
+    offsets_db: float offset for all rows, or {channel: offset} dictionary [dB]
+    where: WHERE clauses from selection()
+
+    Shifts power_dbm, power_peak_dbm and (if present) power_uw, and adds the
+    offset to power_corr_db of the linked sweeps whose points are all corrected.
+    Sweeps that are only partly selected keep their header; their correction is
+    only recorded in the correction log. Returns the updated measurement_ids.
+    """
+    table = model.__table__
+    offsets = _offsets_by_channel(table, offsets_db)
+    correction = sa.values(
+        sa.column("channel", Integer), sa.column("offset_db", Float), name="correction"
+    ).data(list(offsets.items()))
+    if None in offsets:
+        offset = sa.literal(offsets[None])
+        joined = []
+    else:
+        offset = correction.c.offset_db
+        joined = [table.c.channel == correction.c.channel]
+
+    # Correct the headers of fully selected sweeps before the points are changed
+    sweep = Sweep.__table__
+    sweep_ids = sa.select(table.c.sweep_id).where(*where, *joined)
+    corrected = sa.and_(
+        sa.true(),
+        *where,
+        sa.true() if None in offsets else table.c.channel.in_(list(offsets)),
+    )
+    partial_ids = sa.select(table.c.sweep_id).where(
+        table.c.sweep_id.in_(sweep_ids), ~sa.func.coalesce(corrected, False)
+    )
+    partial = connection.scalars(sa.select(partial_ids.subquery()).distinct()).all()
+    if partial:
+        log.warning(
+            f"{len(partial)} sweeps are only partly corrected, their power_corr_db "
+            f"is not changed: {partial}"
+        )
+    sweep_offset = (
+        offset
+        if None in offsets
+        else sa.case(
+            {channel: offset for channel, offset in offsets.items()},
+            value=sweep.c.channel,
+            else_=0.0,
+        )
+    )
+    connection.execute(
+        sa.update(sweep)
+        .where(sweep.c.sweep_id.in_(sweep_ids))
+        .where(sweep.c.sweep_id.not_in(partial_ids))
+        .values(
+            power_corr_db=sa.func.coalesce(sweep.c.power_corr_db, 0) + sweep_offset
+        )
+    )
+
+    values = {"power_peak_dbm": table.c.power_peak_dbm + offset}
+    array_layout = not isinstance(table.c.power_dbm.type, SpectrumArray)
+    if array_layout:
+        offset_sql = str(offset.compile(compile_kwargs={"literal_binds": True}))
+        values["power_dbm"] = _array_expression(
+            table, "power_dbm", f"x + {offset_sql}"
+        )
+        if "power_uw" in table.c:
+            values["power_uw"] = _array_expression(
+                table, "power_uw", f"x * power(10, {offset_sql} / 10)"
+            )
+    measurement_ids = connection.scalars(
+        sa.update(table)
+        .where(*where, *joined)
+        .values(values)
+        .returning(table.c.measurement_id)
+    ).all()
+    if not array_layout:
+        _shift_spectra(connection, model, offsets, measurement_ids)
+    return measurement_ids
+
+
+def _shift_spectra(connection, model, offsets, measurement_ids, chunk_size=1000):
+    """Shift the bytea spectra of the given rows in chunks, on the client."""
+    table = model.__table__
+    channel = table.c.channel if None not in offsets else sa.null()
+    update = (
+        sa.update(table)
+        .where(table.c.measurement_id == bindparam("id"))
+        .values(power_dbm=bindparam("spectrum"))
+    )
+    for i in range(0, len(measurement_ids), chunk_size):
+        rows = connection.execute(
+            sa.select(table.c.measurement_id, channel, table.c.power_dbm).where(
+                table.c.measurement_id.in_(measurement_ids[i : i + chunk_size])
+            )
+        ).all()
+        connection.execute(
+            update,
+            [
+                {
+                    "id": measurement_id,
+                    "spectrum": power_dbm + np.float32(offsets[row_channel]),
+                }
+                for measurement_id, row_channel, power_dbm in rows
+            ],
+        )
+
+
+def remap_light_engine_id(connection, model, mapping, where=()):
+    """Remap the light_engine_id of the selected rows.
+
+    mapping: {old_id: new_id} dictionary
+
+    The linked sweep headers are remapped as well. Returns the updated
+    measurement_ids.
+    """
+    table = model.__table__
+    sweep = Sweep.__table__
+    where = [*where, table.c.light_engine_id.in_(list(mapping))]
+
+    connection.execute(
+        sa.update(sweep)
+        .where(sweep.c.sweep_id.in_(sa.select(table.c.sweep_id).where(*where)))
+        .values(
+            light_engine_id=sa.case(
+                {str(old): str(new) for old, new in mapping.items()},
+                value=sweep.c.light_engine_id,
+                else_=sweep.c.light_engine_id,
+            )
+        )
+    )
+    return connection.scalars(
+        sa.update(table)
+        .where(*where)
+        .values(
+            light_engine_id=sa.case(
+                mapping, value=table.c.light_engine_id, else_=table.c.light_engine_id
+            )
+        )
+        .returning(table.c.measurement_id)
+    ).all()
+
+
+def run_correction(engine, model, operation, parameters, filters, dry_run=False):
+    """Apply a correction in one transaction and record it in the correction log.
+
+    operation: "power" (parameters are the offsets) or "remap" (parameters are
+        the {old: new} light engine ID mapping)
+    filters: keyword arguments of selection()
+
+    Returns the number of updated rows.
+    """
+    functions = {"power": apply_power_correction, "remap": remap_light_engine_id}
+    CorrectionLog.__table__.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        measurement_ids = functions[operation](
+            connection, model, parameters, selection(model, **filters)
+        )
+        log.info(
+            f"{operation} correction of {model.__table__.fullname}: "
+            f"{len(measurement_ids)} rows{' (dry run)' if dry_run else ''}"
+        )
+        if dry_run:
+            connection.rollback()
+            return len(measurement_ids)
+
+        connection.execute(
+            sa.insert(CorrectionLog.__table__).values(
+                timestamp=datetime.now(),
+                table_name=model.__table__.fullname,
+                operation=operation,
+                parameters=json.dumps({str(k): v for k, v in parameters.items()})
+                if isinstance(parameters, dict)
+                else json.dumps(parameters),
+                filters=json.dumps(filters),
+                n_rows=len(measurement_ids),
+                measurement_ids=measurement_ids,
+            )
+        )
+        connection.commit()
+    return len(measurement_ids)
+
+
+def _pairs(values, key_type, value_type):
+    """Parse KEY=VALUE command line arguments into a dictionary."""
+    pairs = [value.split("=") for value in values]
+    return {key_type(key): value_type(value) for key, value in pairs}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--table", choices=tables, required=True)
+    operation = parser.add_mutually_exclusive_group(required=True)
+    operation.add_argument("--offset", nargs="+", help="CHANNEL=DB or DB")
+    operation.add_argument("--remap", nargs="+", help="OLD_ID=NEW_ID")
+    parser.add_argument("--light-engine-id", nargs="+")
+    parser.add_argument("--channel", nargs="+", type=int)
+    parser.add_argument("--temp", nargs="+", type=float)
+    parser.add_argument("--sweep-id", nargs="+")
+    parser.add_argument(
+        "--measurement-ids", nargs=2, type=int, metavar=("FIRST", "LAST")
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    model = tables[args.table]
+    id_type = model.__table__.c.light_engine_id.type.python_type
+    if args.offset and "=" not in args.offset[0]:
+        operation, parameters = "power", float(args.offset[0])
+    elif args.offset:
+        operation, parameters = "power", _pairs(args.offset, int, float)
+    else:
+        operation, parameters = "remap", _pairs(args.remap, id_type, id_type)
+    filters = {
+        "light_engine_ids": args.light_engine_id
+        and [id_type(id) for id in args.light_engine_id],
+        "channels": args.channel,
+        "nominal_temps": args.temp,
+        "sweep_ids": args.sweep_id,
+        "measurement_ids": args.measurement_ids,
+    }
+
+    engine = sa.create_engine(database_address)
+    n_rows = run_correction(
+        engine, model, operation, parameters, filters, dry_run=args.dry_run
+    )
+    print(f"{model.__table__.fullname}: {n_rows} rows {operation} corrected")
@@ -1,126 +1,308 @@
+"""Check the measurement tables for incomplete, duplicated and mislabeled sweeps.
+
+The whole table is checked with a few GROUP BY queries over the scalar columns
+(spectra are never fetched). Points are grouped by their sweep_id, so
+migrate_sweeps.py has to be run first for tables that predate the sweep table;
+unlinked points are only counted.
+
+Findings:
+    incomplete: fewer points than the sweep's n_points_expected
+    duplicate_points: more than one point with the same bias current in a sweep;
+        overlap points re-measured when a sweep was continued are not counted
+    repeated: more than one complete sweep of the same light engine, channel,
+        temperature and sweep type
+    mislabeled: two "imported" (legacy) "normal" sweeps and no "full_power"
+        sweep of the same light engine and temperature on channel 0; before the
+        sweep type was recorded, the later one was most likely the full power
+        sweep. Sweeps written by the procedures record their sweep type, so
+        their repeated normal sweeps are reported as repeated instead.
+
+Usage:
+    python -m light_engine_characterization.tables.data_integrity
+        [--table molex] [--report report.json] [--repair] [--dry-run]
+
+With --repair the findings are fixed in a single transaction per table: points
+of incomplete sweeps and duplicated points are deleted, the older repeated
+sweeps are marked "superseded" and mislabeled sweeps are relabeled "full_power".
+Incomplete sweeps that are "running" or "failed" are left alone, since a requeued
+experiment continues them (see procedures/checkpoint.py). With --dry-run
+the repairs are rolled back and only reported.
+"""
+
+import argparse
+import json
 import sys
+from collections import defaultdict
 from datetime import datetime
 
-import pandas as pd
 import sqlalchemy as sa
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
 
 from light_engine_characterization.tables import (
     LightEngineMeasurement,
+    LightEngineMeasurementCompact,
+    Sweep,
+    TFCMeasurement,
+    TFCMeasurementCompact,
     database_address,
+    resumable_status,
 )
 
-engine = create_engine(database_address)
-temps = [25, 35, 45, 55, 65, 75]
+tables = {
+    model.__tablename__: model
+    for model in [
+        LightEngineMeasurement,
+        LightEngineMeasurementCompact,
+        TFCMeasurement,
+        TFCMeasurementCompact,
+    ]
+}
+
+default_points_expected = 501
+
+complete_status = ("complete", "imported")
+
+# Channels on which legacy full power sweeps were stored as "normal"
+mislabeled_channels = (0,)
+
+
+def summarize_sweeps(connection, model):
+    """Get the number of points and distinct bias currents of every sweep.
 
-# Get the number of unique Light Engines in the database
-with Session(engine) as session:
-    le_ids = sorted(
-        [v for (v,) in session.query(LightEngineMeasurement.light_engine_id).distinct()]
+    Returns a list of dictionaries, one per sweep, joined with the sweep header.
+    """
+    table = model.__table__
+    sweep = Sweep.__table__
+    point_columns = [
+        sa.func.count().label("n_points"),
+        sa.func.count(sa.distinct(table.c.bias_current_ma)).label("n_bias"),
+        sa.func.min(table.c.measurement_id).label("first_measurement_id"),
+        sa.func.max(table.c.measurement_id).label("last_measurement_id"),
+    ]
+    if "sweep_type" in table.c:
+        point_columns += [
+            sa.func.count(sa.distinct(table.c.sweep_type)).label("n_point_types"),
+            sa.func.min(table.c.sweep_type).label("point_sweep_type"),
+        ]
+    points = (
+        sa.select(table.c.sweep_id, *point_columns)
+        .where(table.c.sweep_id.is_not(None))
+        .where(not_overlap(table))
+        .group_by(table.c.sweep_id)
+        .subquery()
     )
-    for le_id in le_ids:
-        for i in range(8):
-            for temp in temps:
-                n_points = session.scalar(
-                    sa.select(sa.func.count())
-                    .select_from(LightEngineMeasurement)
-                    .where(LightEngineMeasurement.light_engine_id == le_id)
-                    .where(LightEngineMeasurement.channel == i)
-                    .where(LightEngineMeasurement.nominal_temp_c == temp)
-                    .where(LightEngineMeasurement.sweep_type == "normal")
-                )
-
-                # If channel=0 and n_points=1002, then it is most likely
-                # that the first sweep is a normal sweep and the second
-                # sweep is a full power sweep
-                if i == 0 and n_points == 1002:
-                    query = (
-                        sa.select(LightEngineMeasurement)
-                        .where(LightEngineMeasurement.light_engine_id == le_id)
-                        .where(LightEngineMeasurement.channel == i)
-                        .where(LightEngineMeasurement.nominal_temp_c == temp)
-                    )
-                    df = pd.read_sql(query, session.bind)
-                    df_groups = df.groupby(["date", "time"])
-
-                    # If we have two groups and each group has 501 datapoints,
-                    # then the first group is the normal sweep and the second
-                    # group is the full_power sweep
-                    if len(df_groups) == 2 and all(
-                        [d.shape[0] == 501 for _, d in df_groups]
-                    ):
-                        print("Found probable normal and full_power sweeps.")
-                        key_0, key_1 = list(df_groups.groups.keys())
-                        key_0_dt = datetime.combine(key_0[0], key_0[1])
-                        key_1_dt = datetime.combine(key_1[0], key_1[1])
-                        if key_0_dt < key_1_dt:
-                            # Key 1 belongs to the later entry
-                            meas_ids = df_groups.get_group(key_1)[
-                                "measurement_id"
-                            ].values
-                        else:
-                            # Key 0 belongs to the later entry
-                            meas_ids = df_groups.get_group(key_0)[
-                                "measurement_id"
-                            ].values
-
-                        updates = [
-                            {"measurement_id": meas_id, "sweep_type": "full_power"}
-                            for meas_id in meas_ids
-                        ]
-                        session.execute(sa.update(LightEngineMeasurement), updates)
-                        session.commit()
-
-                elif n_points < 501:
-                    print(
-                        f"Insufficient datapoints for light_engine_id={le_id}, channel={i}, temp={temp} (expected {501}, found {n_points})"
-                    )
-                    # For now, we can just skip doing anything about
-                    # insufficient number of points since these are most likely
-                    # due to a measurement not being complete
-
-                elif n_points > 501:
-                    print(
-                        f"Excess datapoints for light_engine_id={le_id}, channel={i}, temp={temp} (expected {501}, found {n_points})"
-                    )
-                    # In the event that we have too many datapoints, we need to
-                    # separate the sweeps into complete and incomplete sweeps
-                    query = (
-                        sa.select(LightEngineMeasurement)
-                        .where(LightEngineMeasurement.light_engine_id == le_id)
-                        .where(LightEngineMeasurement.channel == i)
-                        .where(LightEngineMeasurement.nominal_temp_c == temp)
-                    )
-                    df = pd.read_sql(query, session.bind)
-
-                    # First try to separate the measurements by day/time and
-                    # delete any incomplete sweeps
-                    for name, sub_df in df.groupby(["date", "time"]):
-                        # Delete any incomplete sweeps
-                        if sub_df.shape[0] < 501:
-                            print(f"Incomplete sweep found for sub-table {name}")
-                            sub_df.sort_values(by="measurement_id", inplace=True)
-                            print(sub_df)
-                            resp = input(
-                                (
-                                    f"""Delete entries {sub_df["measurement_id"].values[0]} """
-                                    f"""through {sub_df["measurement_id"].values[-1]}? [y/N]: """
-                                )
-                            )
-                            if resp.lower() == "y":
-                                print("Deleting entries ... ", flush=True, end="")
-                                stmt = sa.delete(LightEngineMeasurement).where(
-                                    LightEngineMeasurement.measurement_id.in_(
-                                        sub_df["measurement_id"].values
-                                    )
-                                )
-                                session.execute(stmt)
-                                session.commit()
-                                print("Completed.")
-                            else:
-                                print("Skipping delete.")
-                        else:
-                            sub_df.sort_values(by="measurement_id", inplace=True)
-                            print(name)
-                            print(sub_df)
+    query = sa.select(
+        points,
+        sweep.c.light_engine_id,
+        sweep.c.channel,
+        sweep.c.date,
+        sweep.c.time,
+        sweep.c.nominal_temp_c,
+        sweep.c.sweep_type,
+        sweep.c.status,
+        sweep.c.n_points_expected,
+    ).join(sweep, sweep.c.sweep_id == points.c.sweep_id)
+    return [dict(row) for row in connection.execute(query).mappings()]
+
+
+def not_overlap(table):
+    """Condition excluding the overlap points of continued sweeps."""
+    if "overlap" not in table.c:
+        return sa.true()
+    return table.c.overlap.is_not(True)
+
+
+def count_unlinked(connection, model):
+    """Get the number of points without a sweep_id."""
+    table = model.__table__
+    return connection.scalar(
+        sa.select(sa.func.count())
+        .select_from(table)
+        .where(table.c.sweep_id.is_(None))
+    )
+
+
+def check_sweeps(sweeps, points_expected=default_points_expected):
+    """Classify the summarized sweeps into the findings of the report.
+
+    points_expected: int, used for sweeps without a stored n_points_expected
+    """
+    findings = {
+        "incomplete": [],
+        "duplicate_points": [],
+        "repeated": [],
+        "mislabeled": [],
+    }
+    groups = defaultdict(list)
+    for sweep in sweeps:
+        expected = sweep["n_points_expected"] or points_expected
+        sweep["n_points_expected"] = expected
+        if sweep["n_bias"] < sweep["n_points"]:
+            findings["duplicate_points"].append(sweep)
+        if sweep["n_bias"] < expected:
+            findings["incomplete"].append(sweep)
+        elif sweep["status"] in complete_status:
+            key = (sweep["light_engine_id"], sweep["channel"], sweep["nominal_temp_c"])
+            groups[key].append(sweep)
+
+    for group in groups.values():
+        group.sort(key=lambda sweep: (sweep["date"], sweep["time"]))
+        by_type = defaultdict(list)
+        for sweep in group:
+            by_type[sweep["sweep_type"]].append(sweep)
+
+        # Two legacy normal sweeps without a full power sweep, see the module
+        # docstring
+        normal = by_type.get("normal", [])
+        if (
+            len(normal) == 2
+            and "full_power" not in by_type
+            and all(sweep["status"] == "imported" for sweep in normal)
+            and normal[0]["channel"] in mislabeled_channels
+        ):
+            findings["mislabeled"].append(by_type.pop("normal")[1])
+
+        # All but the latest sweep of each type are superseded
+        for same_type in by_type.values():
+            findings["repeated"].extend(same_type[:-1])
+    return findings
+
+
+def repair(connection, model, findings):
+    """Fix the findings of check_sweeps in the given transaction.
+
+    Returns a dictionary with the number of rows changed by each repair.
+    """
+    table = model.__table__
+    sweep = Sweep.__table__
+    changes = {}
+
+    # Delete incomplete sweeps, except the ones that may still be running or
+    # that a requeued experiment would continue
+    incomplete = [
+        s["sweep_id"]
+        for s in findings["incomplete"]
+        if s["status"] not in resumable_status
+    ]
+    changes["incomplete_points_deleted"] = connection.execute(
+        sa.delete(table).where(table.c.sweep_id.in_(incomplete))
+    ).rowcount
+    connection.execute(
+        sa.update(sweep)
+        .where(sweep.c.sweep_id.in_(incomplete))
+        .values(status="discarded")
+    )
+
+    # Keep the first point of each bias current
+    duplicated = [s["sweep_id"] for s in findings["duplicate_points"]]
+    ranked = (
+        sa.select(
+            table.c.measurement_id,
+            sa.func.row_number()
+            .over(
+                partition_by=[table.c.sweep_id, table.c.bias_current_ma],
+                order_by=table.c.measurement_id,
+            )
+            .label("rank"),
+        )
+        .where(table.c.sweep_id.in_(duplicated))
+        .where(not_overlap(table))
+        .subquery()
+    )
+    changes["duplicate_points_deleted"] = connection.execute(
+        sa.delete(table).where(
+            table.c.measurement_id.in_(
+                sa.select(ranked.c.measurement_id).where(ranked.c.rank > 1)
+            )
+        )
+    ).rowcount
+
+    changes["sweeps_superseded"] = connection.execute(
+        sa.update(sweep)
+        .where(sweep.c.sweep_id.in_([s["sweep_id"] for s in findings["repeated"]]))
+        .values(status="superseded")
+    ).rowcount
+
+    mislabeled = [s["sweep_id"] for s in findings["mislabeled"]]
+    changes["sweeps_relabeled"] = connection.execute(
+        sa.update(sweep)
+        .where(sweep.c.sweep_id.in_(mislabeled))
+        .values(sweep_type="full_power")
+    ).rowcount
+    if "sweep_type" in table.c:
+        changes["points_relabeled"] = connection.execute(
+            sa.update(table)
+            .where(table.c.sweep_id.in_(mislabeled))
+            .values(sweep_type="full_power")
+        ).rowcount
+    return changes
+
+
+def check_table(
+    engine, model, points_expected=default_points_expected, fix=False, dry_run=False
+):
+    """Check a measurement table and optionally repair it.
+
+    With dry_run the repairs are rolled back, so that the report shows what a
+    repair would change. Returns the report as a dictionary.
+    """
+    with engine.connect() as connection:
+        sweeps = summarize_sweeps(connection, model)
+        findings = check_sweeps(sweeps, points_expected)
+        report = {
+            "table": model.__table__.fullname,
+            "generated": datetime.now().isoformat(timespec="seconds"),
+            "n_sweeps": len(sweeps),
+            "n_points": sum(s["n_points"] for s in sweeps),
+            "n_unlinked_points": count_unlinked(connection, model),
+            **{name: len(found) for name, found in findings.items()},
+            "findings": findings,
+        }
+        if fix:
+            report["repairs"] = repair(connection, model, findings)
+            report["dry_run"] = dry_run
+            if dry_run:
+                connection.rollback()
+            else:
+                connection.commit()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--table", choices=tables, action="append")
+    parser.add_argument("--points-expected", type=int, default=default_points_expected)
+    parser.add_argument("--report", help="write the JSON report to this file")
+    parser.add_argument("--repair", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    engine = sa.create_engine(database_address)
+    inspector = sa.inspect(engine)
+    reports = []
+    for name in args.table or tables:
+        table = tables[name].__table__
+        if not inspector.has_table(table.name, schema=table.schema):
+            continue
+        report = check_table(
+            engine,
+            tables[name],
+            args.points_expected,
+            fix=args.repair,
+            dry_run=args.dry_run,
+        )
+        reports.append(report)
+        print(
+            f"{report['table']}: {report['n_sweeps']} sweeps, "
+            f"{report['incomplete']} incomplete, "
+            f"{report['duplicate_points']} with duplicate points, "
+            f"{report['repeated']} repeated, {report['mislabeled']} mislabeled, "
+            f"{report['n_unlinked_points']} unlinked points",
+            file=sys.stderr,
+        )
+
+    output = json.dumps(reports, indent=2, default=str)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,40 @@
+"""L-I-V curve table.
+
+An LIV sweep is stored as a single row per sweep with the readings of every
+current step as arrays, instead of one row per bias point as for the spectral
+sweeps.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import ARRAY, Date, Float, ForeignKey, Integer, String, Time, Uuid
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .le_measurement import Base
+
+
+class LIVMeasurement(Base):
+    __tablename__ = "liv"
+    __table_args__ = {"schema": "lightengine"}
+
+    measurement_id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True
+    )
+    sweep_id: Mapped[str | None] = mapped_column(
+        Uuid(as_uuid=False), ForeignKey("lightengine.sweep.sweep_id"), index=True
+    )
+    light_engine_id: Mapped[str] = mapped_column(String)
+    channel: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    date: Mapped[datetime.date] = mapped_column(Date)
+    time: Mapped[datetime.time] = mapped_column(Time)
+    tec_pid: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    nominal_temp_c: Mapped[float]
+    tec_temp_c: Mapped[float | None]
+    # Set points and readings of every step
+    bias_current_ma: Mapped[list] = mapped_column(ARRAY(Float))
+    current_ma: Mapped[list] = mapped_column(ARRAY(Float))
+    voltage_v: Mapped[list] = mapped_column(ARRAY(Float))
+    # Monitor photodiode current measured by the LDD
+    pd_current_ua: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    # Time of every step since the start of the sweep
+    step_time_s: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
@@ -0,0 +1,62 @@
+"""Add the nullable columns of the measurement models that are missing in the database.
+
+Columns added to a model after its table was created (e.g. the per-channel
+telemetry columns) are added with ALTER TABLE ... ADD COLUMN IF NOT EXISTS, so
+the script can be re-run safely. Existing rows get NULL in the new columns.
+"""
+
+import sqlalchemy as sa
+
+from light_engine_characterization.tables import (
+    LightEngineMeasurement,
+    LightEngineMeasurementCompact,
+    Sweep,
+    TFCMeasurement,
+    TFCMeasurementCompact,
+    database_address,
+)
+
+models = [
+    Sweep,
+    LightEngineMeasurement,
+    LightEngineMeasurementCompact,
+    TFCMeasurement,
+    TFCMeasurementCompact,
+]
+
+
+def add_missing_columns(engine, model):
+    """Add the nullable model columns that the database table does not have.
+
+    Returns the names of the added columns.
+    """
+    table = model.__table__
+    inspector = sa.inspect(engine)
+    if not inspector.has_table(table.name, schema=table.schema):
+        return []
+    existing = {c["name"] for c in inspector.get_columns(table.name, table.schema)}
+
+    added = []
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                print(f"{table.fullname}: cannot add NOT NULL column {column.name}")
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            connection.execute(
+                sa.text(
+                    f"ALTER TABLE {table.fullname} "
+                    f"ADD COLUMN IF NOT EXISTS {column.name} {column_type}"
+                )
+            )
+            added.append(column.name)
+    return added
+
+
+if __name__ == "__main__":
+    engine = sa.create_engine(database_address)
+    for model in models:
+        added = add_missing_columns(engine, model)
+        print(f"{model.__table__.fullname}: added {', '.join(added) or 'no columns'}")
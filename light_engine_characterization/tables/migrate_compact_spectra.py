@@ -0,0 +1,82 @@
+"""Migrate the lightengine.molex and lightengine.tfc tables to the compact layout.
+
+Rows are copied in chunks of measurement_id order, keeping their measurement_id.
+The migration can be interrupted and re-run; it continues after the last
+migrated measurement_id.
+"""
+
+import logging
+
+import sqlalchemy as sa
+
+from light_engine_characterization.tables import (
+    LightEngineMeasurement,
+    TFCMeasurement,
+    database_address,
+)
+from light_engine_characterization.tables.compact_measurement import (
+    LightEngineMeasurementCompact,
+    TFCMeasurementCompact,
+    compact_row,
+)
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+migrations = [
+    (LightEngineMeasurement, LightEngineMeasurementCompact),
+    (TFCMeasurement, TFCMeasurementCompact),
+]
+
+
+def migrate_table(engine, source, target, chunk_size=1000):
+    """Copy all rows of source that are not yet in target, converting the spectra.
+
+    Returns the number of rows migrated.
+    """
+    target.__table__.create(engine, checkfirst=True)
+    source_table = source.__table__
+    target_table = target.__table__
+
+    with engine.connect() as connection:
+        last_id = connection.scalar(
+            sa.select(sa.func.coalesce(sa.func.max(target_table.c.measurement_id), 0))
+        )
+
+    n_migrated = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                sa.select(source_table)
+                .where(source_table.c.measurement_id > last_id)
+                .order_by(source_table.c.measurement_id)
+                .limit(chunk_size)
+            ).mappings()
+            rows = [compact_row(dict(row)) for row in rows]
+            if not rows:
+                break
+            connection.execute(sa.insert(target_table), rows)
+
+        last_id = rows[-1]["measurement_id"]
+        n_migrated += len(rows)
+        log.info(f"Migrated {n_migrated} rows to {target_table.fullname}")
+
+    # The ids were copied explicitly, so move the sequence past them
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.execute(
+                sa.text(
+                    "SELECT setval(pg_get_serial_sequence(:table, 'measurement_id'), "
+                    f"(SELECT coalesce(max(measurement_id), 1) FROM {target_table.fullname}))"
+                ),
+                {"table": target_table.fullname},
+            )
+    return n_migrated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    engine = sa.create_engine(database_address)
+    for source, target in migrations:
+        n_rows = migrate_table(engine, source, target)
+        print(f"{source.__table__.fullname} -> {target.__table__.fullname}: {n_rows}")
@@ -0,0 +1,110 @@
+"""Create the sweep header table and link the existing measurement rows to it.
+
+Adds the sweep_id column to the measurement tables and creates one sweep row per
+(light_engine_id, channel, date, time, nominal_temp_c, sweep_type) group of the
+existing points. Sweeps created this way get the status "imported". The script
+only touches rows without a sweep_id, so it can be re-run safely.
+"""
+
+import sqlalchemy as sa
+
+from light_engine_characterization.tables import (
+    LightEngineMeasurement,
+    LightEngineMeasurementCompact,
+    Sweep,
+    TFCMeasurement,
+    TFCMeasurementCompact,
+    database_address,
+)
+
+procedures = [
+    (LightEngineMeasurement, "MolexLECharacterization"),
+    (LightEngineMeasurementCompact, "MolexLECharacterization"),
+    (TFCMeasurement, "TFCCharacterization"),
+    (TFCMeasurementCompact, "TFCCharacterization"),
+]
+
+group_columns = [
+    "light_engine_id",
+    "channel",
+    "date",
+    "time",
+    "nominal_temp_c",
+    "sweep_type",
+]
+
+
+def add_sweep_column(connection, model):
+    """Add the sweep_id column and its index to an existing measurement table."""
+    table = model.__table__
+    connection.execute(
+        sa.text(
+            f"ALTER TABLE {table.fullname} ADD COLUMN IF NOT EXISTS sweep_id uuid "
+            f"REFERENCES {Sweep.__table__.fullname} (sweep_id)"
+        )
+    )
+    connection.execute(
+        sa.text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table.name}_sweep_id "
+            f"ON {table.fullname} (sweep_id)"
+        )
+    )
+
+
+def backfill_sweeps(connection, model, procedure):
+    """Create sweeps for the unlinked points of a table and link them.
+
+    Returns the number of sweeps created.
+    """
+    table = model.__table__
+    sweep = Sweep.__table__
+    columns = {
+        name: table.c[name] if name in table.c else sa.null() for name in group_columns
+    }
+    columns["light_engine_id"] = sa.cast(table.c.light_engine_id, sa.String)
+
+    groups = (
+        sa.select(
+            sa.func.gen_random_uuid(),
+            sa.literal(procedure),
+            *[column.label(name) for name, column in columns.items()],
+            sa.literal("imported"),
+        )
+        .where(table.c.sweep_id.is_(None))
+        .group_by(*[columns[name] for name in group_columns if name in table.c])
+    )
+    n_sweeps = connection.execute(
+        sa.insert(sweep).from_select(
+            ["sweep_id", "procedure", *group_columns, "status"], groups
+        )
+    ).rowcount
+
+    connection.execute(
+        sa.update(table)
+        .where(table.c.sweep_id.is_(None))
+        .where(sweep.c.procedure == procedure)
+        .where(sweep.c.status == "imported")
+        .where(
+            *[
+                sweep.c[name].is_not_distinct_from(column)
+                for name, column in columns.items()
+            ]
+        )
+        .values(sweep_id=sweep.c.sweep_id)
+    )
+    return n_sweeps
+
+
+if __name__ == "__main__":
+    engine = sa.create_engine(database_address)
+    Sweep.__table__.create(engine, checkfirst=True)
+
+    inspector = sa.inspect(engine)
+    for model, procedure in procedures:
+        table = model.__table__
+        if not inspector.has_table(table.name, schema=table.schema):
+            continue
+        with engine.begin() as connection:
+            add_sweep_column(connection, model)
+            n_sweeps = backfill_sweeps(connection, model, procedure)
+        print(f"{table.fullname}: created {n_sweeps} sweeps")
@@ -0,0 +1,124 @@
+"""Sweep header table.
+
+Each bias sweep gets one row with its run metadata, and the measurement points
+reference it through sweep_id.
+"""
+
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import ARRAY, Date, Float, Index, Integer, String, Time, Uuid
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .le_measurement import Base
+
+# Status of sweeps interrupted by a crash or fault, which a requeued experiment
+# continues. Sweeps aborted by the user are not continued.
+resumable_status = ("running", "failed")
+
+
+class Sweep(Base):
+    __tablename__ = "sweep"
+    __table_args__ = (
+        Index(
+            "ix_sweep_le_channel_temp", "light_engine_id", "channel", "nominal_temp_c"
+        ),
+        {"schema": "lightengine"},
+    )
+
+    # Generated by the procedure so that spooled points can reference the sweep
+    # before it reaches the database
+    sweep_id: Mapped[str] = mapped_column(Uuid(as_uuid=False), primary_key=True)
+    procedure: Mapped[str] = mapped_column(String)
+    light_engine_id: Mapped[str] = mapped_column(String)
+    channel: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    date: Mapped[datetime.date] = mapped_column(Date)
+    time: Mapped[datetime.time] = mapped_column(Time)
+    nominal_temp_c: Mapped[float]
+    sweep_type: Mapped[str | None]
+    # Order of the channel/bias grid of a multi-channel sweep (see sweep_order.py)
+    sweep_order: Mapped[str | None]
+    status: Mapped[str] = mapped_column(String)
+    n_points_expected: Mapped[int | None]
+    bias_currents_ma: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    tec_pid: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    # TEC temperature trace of the wait before the sweep
+    settling_time_s: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    settling_temp_c: Mapped[list | None] = mapped_column(ARRAY(Float), nullable=True)
+    settling_duration_s: Mapped[float | None]
+    # Estimated (sweep order cost model) and actual duration of the sweep
+    estimated_duration_s: Mapped[float | None]
+    duration_s: Mapped[float | None]
+    switch_channel: Mapped[int | None]
+    power_corr_db: Mapped[float | None]
+    wavelength_start_nm: Mapped[float | None]
+    wavelength_stop_nm: Mapped[float | None]
+    wavelength_points: Mapped[int | None]
+    wavelength_resolution_nm: Mapped[float | None]
+    resolution_vbw: Mapped[str | None]
+
+
+def latest_sweep(
+    session,
+    light_engine_id,
+    channel,
+    nominal_temp_c,
+    sweep_type="normal",
+    status="complete",
+):
+    """Get the most recent sweep matching the given light engine, channel and temperature.
+
+    Returns the Sweep or None if there is no matching sweep.
+    """
+    return session.scalars(
+        sa.select(Sweep)
+        .where(Sweep.light_engine_id == str(light_engine_id))
+        .where(Sweep.channel == channel)
+        .where(Sweep.nominal_temp_c == nominal_temp_c)
+        .where(Sweep.sweep_type == sweep_type)
+        .where(Sweep.status == status)
+        .order_by(Sweep.date.desc(), Sweep.time.desc())
+        .limit(1)
+    ).first()
+
+
+def resumable_sweep(
+    session,
+    procedure,
+    light_engine_id,
+    channel,
+    nominal_temp_c,
+    sweep_type,
+    status=resumable_status,
+):
+    """Get the latest sweep of an experiment if it was interrupted.
+
+    Returns the most recent Sweep of the procedure with the given light engine,
+    channel, temperature and sweep type if its status is one of status,
+    otherwise None.
+    """
+    sweep = session.scalars(
+        sa.select(Sweep)
+        .where(Sweep.procedure == procedure)
+        .where(Sweep.light_engine_id == str(light_engine_id))
+        .where(Sweep.channel == channel)
+        .where(Sweep.nominal_temp_c == nominal_temp_c)
+        .where(Sweep.sweep_type == sweep_type)
+        .order_by(Sweep.date.desc(), Sweep.time.desc())
+        .limit(1)
+    ).first()
+    if sweep is None or sweep.status not in status:
+        return None
+    return sweep
+
+
+def stored_bias_currents(session, model, sweep_id):
+    """Get the bias currents of the points of a sweep stored in a table.
+
+    Overlap points of earlier continuations are not included.
+    """
+    return session.scalars(
+        sa.select(model.bias_current_ma)
+        .where(model.sweep_id == sweep_id)
+        .where(model.overlap.is_not(True))
+    ).all()
@@ -0,0 +1,263 @@
+"""Batched, asynchronous writer for measurement rows.
+
+Rows are queued by the measurement procedure and inserted by a background thread
+in batches, so that a slow database does not stall the instruments. Batches that
+cannot be written are spooled to a local JSON-lines file and replayed once the
+database is reachable again; batches the database rejects on replay are moved to
+a quarantine file next to the spool file. If the writer thread fails, put() and
+close() raise RuntimeError in the producer.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+spool_directory = Path("~/measurement_data/light_engine/spool").expanduser()
+
+_STOP = object()
+
+
+def _to_json(value):
+    """Convert NumPy values to types that can be serialized to JSON."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _write_lines(path, lines, mode):
+    """Write lines to a file and sync it to disk."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode) as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class MeasurementWriter:
+    """Background writer that bulk-inserts rows into a measurement table.
+
+    engine: sqlalchemy.Engine, database to write to, or None to only spool rows
+    model: declarative table class (e.g. LightEngineMeasurement)
+    batch_size: int, number of rows that triggers a flush
+    flush_interval: float, maximum time a row waits before being flushed [s]
+    max_queue: int, maximum number of queued rows before put() blocks
+    spool_path: path of the local spool file, defaults to
+        <spool_directory>/<schema>.<table>.jsonl; rejected rows are moved to
+        <schema>.<table>.quarantine.jsonl
+    upsert_key: str, primary key column on which rows update an existing row
+        instead of being inserted (PostgreSQL only)
+    """
+
+    def __init__(
+        self,
+        engine,
+        model,
+        batch_size=50,
+        flush_interval=5.0,
+        max_queue=5000,
+        spool_path=None,
+        upsert_key=None,
+    ):
+        self.engine = engine
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.upsert_key = upsert_key
+        if spool_path is None:
+            table = model.__table__
+            spool_path = spool_directory / f"{table.schema}.{table.name}.jsonl"
+        self.spool_path = Path(spool_path)
+        self.quarantine_path = self.spool_path.with_suffix(".quarantine.jsonl")
+
+        self.n_written = 0
+        self.n_spooled = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{model.__tablename__}_writer", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, row):
+        """Queue a row (dictionary of column values) for insertion.
+
+        Raises RuntimeError if the writer thread has failed.
+        """
+        self._put(dict(row))
+
+    def close(self, timeout=None):
+        """Flush all queued rows and stop the writer thread.
+
+        Raises RuntimeError if the writer thread has failed; the rows queued
+        after the failure are lost.
+        """
+        if self._thread.is_alive():
+            self._put(_STOP)
+            self._thread.join(timeout)
+        log.info(
+            f"Measurement writer closed ({self.n_written} rows written, "
+            f"{self.n_spooled} rows spooled)"
+        )
+        self._check()
+
+    def _put(self, item):
+        """Queue an item, without blocking forever on a failed writer thread."""
+        while True:
+            self._check()
+            try:
+                self._queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                pass
+
+    def _check(self):
+        """Raise the failure of the writer thread in the producer."""
+        if self._error is not None:
+            raise RuntimeError(
+                f"Writer of {self.model.__tablename__} failed: {self._error}"
+            ) from self._error
+
+    def _run(self):
+        """Collect queued rows and flush them by size and by time."""
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = (
+                    None if deadline is None else max(deadline - time.monotonic(), 0)
+                )
+                try:
+                    row = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    row = None
+
+                if row is _STOP:
+                    self._flush(batch)
+                    return
+                if row is not None:
+                    batch.append(row)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                if len(batch) >= self.batch_size or (
+                    deadline is not None and time.monotonic() >= deadline
+                ):
+                    self._flush(batch)
+                    batch = []
+                    deadline = None
+        except Exception as e:
+            log.exception(
+                f"Writer of {self.model.__tablename__} failed, "
+                f"{len(batch)} rows not written"
+            )
+            self._error = e
+
+    def _flush(self, batch):
+        """Insert a batch of rows, spooling it to disk if the insert fails."""
+        if not batch:
+            return
+        if self.engine is not None:
+            try:
+                self._insert(batch)
+                self.n_written += len(batch)
+                return
+            except Exception as e:
+                log.error(f"Failed to write {len(batch)} rows to database: {e}")
+        self._spool(batch)
+
+    def _insert(self, rows):
+        """Bulk insert rows in a single transaction (executemany)."""
+        with self.engine.begin() as connection:
+            self._execute(connection, rows)
+
+    def _execute(self, connection, rows):
+        """Execute the insert (or upsert) statement for a list of rows."""
+        table = self.model.__table__
+        if self.upsert_key is None:
+            connection.execute(sa.insert(table), rows)
+            return
+
+        # Only the last version of each row can be applied in one statement
+        rows = list({row[self.upsert_key]: row for row in rows}.values())
+        statement = postgresql.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.upsert_key],
+            set_={
+                key: statement.excluded[key] for key in rows[0] if key != self.upsert_key
+            },
+        )
+        connection.execute(statement, rows)
+
+    def _spool(self, rows):
+        """Append rows to the local spool file."""
+        lines = [json.dumps(row, default=_to_json) + "\n" for row in rows]
+        with self._spool_lock:
+            _write_lines(self.spool_path, lines, "a")
+        self.n_spooled += len(rows)
+        log.warning(f"Spooled {len(rows)} rows to {self.spool_path}")
+
+    def replay_spool(self):
+        """Insert the rows of the spool file into the database.
+
+        Every batch is inserted in its own transaction. A batch the database
+        rejects (e.g. a constraint violation) and lines that cannot be parsed are
+        moved to the quarantine file, so that they do not block the other rows.
+        If the database cannot be reached, the rows not yet replayed stay in the
+        spool file. Returns the number of rows replayed.
+        """
+        with self._spool_lock:
+            if self.engine is None or not self.spool_path.exists():
+                return 0
+            with open(self.spool_path) as f:
+                lines = [line for line in f if line.strip()]
+
+            rows, rejected, remaining = [], [], []
+            for line in lines:
+                try:
+                    rows.append((line, json.loads(line)))
+                except json.JSONDecodeError:
+                    rejected.append(line)
+            n_replayed = 0
+            for i in range(0, len(rows), self.batch_size):
+                batch = rows[i : i + self.batch_size]
+                try:
+                    with self.engine.begin() as connection:
+                        self._execute(connection, [row for _, row in batch])
+                except (sa.exc.OperationalError, sa.exc.InterfaceError) as e:
+                    log.error(f"Stopped replaying {self.spool_path}: {e}")
+                    remaining = [line for line, _ in rows[i:]]
+                    break
+                except Exception as e:
+                    log.error(f"Database rejected {len(batch)} spooled rows: {e}")
+                    rejected.extend(line for line, _ in batch)
+                else:
+                    n_replayed += len(batch)
+
+            if rejected:
+                _write_lines(self.quarantine_path, rejected, "a")
+                log.warning(
+                    f"Moved {len(rejected)} spooled rows to {self.quarantine_path}"
+                )
+            if remaining:
+                partial = self.spool_path.with_suffix(".partial")
+                _write_lines(partial, remaining, "w")
+                os.replace(partial, self.spool_path)
+            else:
+                self.spool_path.unlink()
+        log.info(f"Replayed {n_replayed} spooled rows from {self.spool_path}")
+        return n_replayed
+
@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyvisa_sim")
+
+from light_engine_characterization.instruments.discovery import (
+    detect_instruments,
+    identify,
+)
+
+station = f"{Path(__file__).with_name('station.yaml')}@sim"
+
+expected = {
+    "anritsu": "GPIB0::8::INSTR",
+    "arroyo_ldd": "ASRL1::INSTR",
+    "arroyo_tec": "ASRL2::INSTR",
+}
+
+
+def test_identify():
+    assert identify("Arroyo 7144 LaserSource") == "arroyo_ldd"
+    assert identify("Arroyo 5240 TECSource") == "arroyo_tec"
+    assert identify("Arroyo 6301") == "arroyo"
+    assert identify("ACME,Widget,1,1") is None
+
+
+def test_detect_station():
+    instruments = detect_instruments(
+        required=("anritsu", "arroyo_ldd"), cache_path=None, visa_library=station
+    )
+    assert instruments == expected
+
+
+def test_missing_required_instrument():
+    with pytest.raises(RuntimeError, match="keithley"):
+        detect_instruments(
+            required=("keithley",), cache_path=None, visa_library=station
+        )
+
+
+def test_cache_is_written_and_reused(tmp_path):
+    cache_path = tmp_path / "instruments.json"
+    assert detect_instruments(cache_path=cache_path, visa_library=station) == expected
+    assert json.loads(cache_path.read_text()) == expected
+    assert detect_instruments(cache_path=cache_path, visa_library=station) == expected
+
+
+def test_moved_instrument_is_rediscovered(tmp_path):
+    cache_path = tmp_path / "instruments.json"
+    cache_path.write_text(
+        json.dumps({**expected, "arroyo_ldd": "ASRL3::INSTR", "keithley": "ASRL9::INSTR"})
+    )
+    instruments = detect_instruments(
+        required=("arroyo_ldd",), cache_path=cache_path, visa_library=station
+    )
+    assert instruments == expected
+    assert json.loads(cache_path.read_text()) == expected
@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("labjack")
+
+from light_engine_characterization.instruments.labjack import t7
+from light_engine_characterization.instruments.labjack.t7 import LabJackStream
+
+
+def make_stream(capacity_s=1.0, scan_rate=10.0, names=("AIN0", "AIN1")):
+    """Stream with a ring buffer of capacity_s * scan_rate scans, not started."""
+    stream = LabJackStream(None, names, scan_rate=scan_rate, capacity_s=capacity_s)
+    stream._t0 = 100.0
+    return stream
+
+
+def scans(first, n, n_inputs=2):
+    """Scans whose values are their scan index (plus 0.5 for the second input)."""
+    index = np.arange(first, first + n, dtype=float)[:, None]
+    return index + 0.5 * np.arange(n_inputs)[None, :]
+
+
+def test_ring_buffer_wraps_around():
+    stream = make_stream()
+    stream._append(scans(0, 7))
+    stream._append(scans(7, 6))
+    assert stream.n_scans == 13
+
+    times, data = stream.slice(0, 1000)
+    np.testing.assert_allclose(data[:, 0], np.arange(3, 13))
+    np.testing.assert_allclose(times, 100.0 + np.arange(3, 13) / 10)
+
+
+def test_block_larger_than_the_buffer_keeps_the_latest_scans():
+    stream = make_stream()
+    stream._append(scans(0, 25))
+    assert stream.n_scans == 25
+    _, data = stream.slice(0, 1000)
+    np.testing.assert_allclose(data, scans(15, 10))
+
+
+def test_slice_selects_scans_by_time():
+    stream = make_stream()
+    stream._append(scans(0, 8))
+    times, data = stream.slice(100.25, 100.5)
+    np.testing.assert_allclose(times, [100.3, 100.4, 100.5])
+    np.testing.assert_allclose(data, scans(3, 3))
+
+    times, data = stream.slice(100.9, 101.5)
+    assert times.size == 0 and data.shape == (0, 2)
+
+
+def test_slice_before_the_first_read_is_empty():
+    stream = make_stream()
+    stream._t0 = None
+    times, data = stream.slice(0, 1000)
+    assert times.size == 0 and data.shape == (0, 2)
+
+
+def test_latest():
+    stream = make_stream(capacity_s=10.0, scan_rate=100.0, names=["AIN0"])
+    stream._append(scans(0, 500, 1))
+    stream._t0 = time.monotonic() - 5.0
+    times, data = stream.latest(1.0)
+    assert 99 <= times.size <= 101
+    np.testing.assert_allclose(data[:, 0], np.arange(500 - times.size, 500))
+
+
+def test_skipped_samples_are_nan(monkeypatch):
+    stream = make_stream()
+    stream._t0 = None
+    blocks = [[1.0, 2.0, t7.skipped_value, 4.0], [5.0, t7.skipped_value, 7.0, 8.0]]
+
+    def read(handle):
+        if len(blocks) == 1:
+            stream._stop.set()
+        return blocks.pop(0), 0, 0
+
+    monkeypatch.setattr(t7.ljm, "eStreamRead", read)
+    stream._run()
+
+    assert stream.n_scans == 4
+    assert stream.n_skipped == 2
+    _, data = stream.slice(0, time.monotonic() + 1)
+    np.testing.assert_array_equal(np.isnan(data), [[0, 0], [1, 0], [0, 1], [0, 0]])
+    np.testing.assert_allclose(data[0], [1.0, 2.0])
+
+
+def test_library_config_is_restored(monkeypatch):
+    config = {
+        t7.ljm.constants.STREAM_SCANS_RETURN: 1.0,
+        t7.ljm.constants.STREAM_RECEIVE_TIMEOUT_MS: 1000.0,
+    }
+    original = dict(config)
+    monkeypatch.setattr(t7.ljm, "readLibraryConfigS", lambda name: config[name])
+    monkeypatch.setattr(t7.ljm, "writeLibraryConfigS", config.__setitem__)
+    monkeypatch.setattr(t7.ljm, "eWriteNames", lambda *args: None)
+    monkeypatch.setattr(t7.ljm, "eWriteName", lambda *args: None)
+    monkeypatch.setattr(t7.ljm, "nameToAddress", lambda name: (2000, 0))
+    monkeypatch.setattr(t7.ljm, "eStreamStop", lambda handle: None)
+
+    stream = LabJackStream(None, ["AIN0"], trigger="DIO0")
+    stream._configure()
+    assert config[t7.ljm.constants.STREAM_RECEIVE_TIMEOUT_MS] == 0
+    stream.stop()
+    assert config == original
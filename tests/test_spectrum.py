@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from light_engine_characterization.analysis import analyze_spectrum, measure_smsr
+
+wavelength_nm = np.linspace(1565, 1585, 2001)
+
+
+def reference_trace(side_modes=((1.0, -40.0),), noise_db=0.3, seed=0):
+    """OSA-like trace of a main mode at 1575nm with side modes and noise.
+
+    side_modes: (offset [nm], power relative to the main mode [dB]) pairs
+    """
+    rng = np.random.default_rng(seed)
+
+    def mode(center_nm, power_db, width_nm=0.03):
+        # Gaussian resolution bandwidth of the OSA with a Lorentzian line skirt
+        x = (wavelength_nm - center_nm) / width_nm
+        return 10 ** (power_db / 10) * (np.exp(-(x**2)) + 1e-2 / (1 + x**2))
+
+    power_mw = mode(1575, 0) + 1e-7
+    for offset_nm, power_db in side_modes:
+        power_mw += mode(1575 + offset_nm, power_db)
+    return 10 * np.log10(power_mw) + rng.normal(0, noise_db, wavelength_nm.size)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_side_mode_found_on_noisy_trace(seed):
+    delta_nm, smsr_db = measure_smsr(wavelength_nm, reference_trace(seed=seed))
+    assert delta_nm == pytest.approx(1.0, abs=0.02)
+    assert smsr_db == pytest.approx(40, abs=1.5)
+
+
+def test_highest_side_mode_is_reported():
+    trace = reference_trace(side_modes=((-0.8, -45.0), (1.6, -35.0)))
+    delta_nm, smsr_db = measure_smsr(wavelength_nm, trace)
+    assert delta_nm == pytest.approx(1.6, abs=0.02)
+    assert smsr_db == pytest.approx(35, abs=1.5)
+
+
+def test_noise_ripples_are_not_side_modes():
+    # Ripples on the skirt of the main mode and on the floor stay below the peak
+    # excursion
+    delta_nm, smsr_db = measure_smsr(wavelength_nm, reference_trace(side_modes=()))
+    assert np.isnan(delta_nm) and np.isnan(smsr_db)
+
+
+def test_clean_trace_without_side_modes():
+    trace = reference_trace(side_modes=(), noise_db=0)
+    delta_nm, smsr_db = measure_smsr(wavelength_nm, trace)
+    assert np.isnan(delta_nm) and np.isnan(smsr_db)
+
+
+def test_stack_matches_single_traces():
+    traces = np.stack([reference_trace(seed=seed) for seed in range(3)])
+    delta_nm, smsr_db = measure_smsr(wavelength_nm, traces)
+    for i, trace in enumerate(traces):
+        assert measure_smsr(wavelength_nm, trace) == (delta_nm[i], smsr_db[i])
+
+
+def test_analyze_spectrum_below_threshold():
+    results = analyze_spectrum(wavelength_nm, reference_trace() - 40)
+    assert results["power_peak_dbm"] < -30
+    assert np.isnan(results["smsr_db"])
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("paramiko")
+pytest.importorskip("paramiko_expect")
+
+from light_engine_characterization.instruments.custom import (
+    ZeusController,
+    snapshot_dtype,
+)
+from light_engine_characterization.instruments.custom.zeus_rpc import ZeusRPCError
+
+
+@pytest.fixture
+def zeus():
+    zeus = ZeusController.fake()
+    yield zeus
+    zeus.close()
+
+
+def test_ping(zeus):
+    assert zeus.rpc.call("ping") is True
+
+
+def test_laser_currents_heat_the_light_engine(zeus):
+    _, cold_c = zeus.get_light_engine_temperatures()
+    zeus.set_laser_currents({0: 200, 3: 200})
+    ambient_c, hot_c = zeus.get_light_engine_temperatures()
+    assert ambient_c == pytest.approx(25, abs=1)
+    assert hot_c - cold_c == pytest.approx(4, abs=1)
+
+
+def test_readouts_follow_the_laser_current(zeus):
+    zeus.set_laser_currents({2: 120})
+    assert zeus.get_mpd_readout(2) == pytest.approx(0.5, abs=0.01)
+    assert zeus.get_mpd_readout(1) == pytest.approx(0, abs=0.01)
+    assert zeus.get_voltage_readout(2) == pytest.approx(1.24, abs=0.01)
+
+
+def test_read_telemetry(zeus):
+    zeus.set_laser_currents({5: 100})
+    telemetry = zeus.read_telemetry([5, 0])
+    assert set(telemetry) == {
+        "ambient_temp_c",
+        "light_engine_temp_c",
+        "mpd_current_ma",
+        "voltage_v",
+    }
+    assert telemetry["mpd_current_ma"] == pytest.approx([0.4, 0], abs=0.01)
+    assert telemetry["voltage_v"] == pytest.approx([1.2, 1.0], abs=0.01)
+
+
+def test_snapshot(zeus):
+    snapshots = np.array([zeus.snapshot() for _ in range(3)], dtype=snapshot_dtype)
+    assert snapshots["mpd_current_ma"].shape == (3, 8)
+    assert np.all(np.diff(snapshots["timestamp_s"]) > 0)
+
+
+def test_agent_errors_are_raised(zeus):
+    with pytest.raises(ZeusRPCError, match="read_mpd"):
+        zeus.rpc.call("read_mpd", channel=8)
+    with pytest.raises(ZeusRPCError, match="no_such_method"):
+        zeus.rpc.call("no_such_method")
+    # The agent keeps serving after an error
+    assert zeus.rpc.call("ping") is True
+
+
+def test_no_repl_session(zeus):
+    with pytest.raises(ConnectionError):
+        zeus.execute_batch(["1 + 1"])
+
+
+def test_close_stops_the_agent():
+    zeus = ZeusController.fake()
+    rpc = zeus.rpc
+    zeus.close()
+    assert zeus.rpc is None
+    with pytest.raises(ConnectionError):
+        rpc.call("ping", timeout=1)